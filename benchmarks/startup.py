@@ -0,0 +1,105 @@
+"""
+Measure the cold start cost of `main.py` with `python -X importtime`.
+
+Each repeat imports `main` in a fresh interpreter and records the cumulative import time of
+every module. The report lists the slowest imports and whether any Google client library was
+loaded, which should never happen before a Gmail send.
+
+The result is compared against the report committed in `benchmarks/baselines/startup.json`, and
+the script fails when startup is more than `--threshold` slower. Import times depend on the machine,
+so refresh the baseline with `--output` whenever it is measured on different hardware.
+
+Usage:
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 10 --output benchmarks/baselines/startup.json
+    python benchmarks/startup.py --baseline ''
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent / "pollyanna_secret_santa"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baselines" / "startup.json"
+GOOGLE_PREFIXES = ("google", "googleapiclient", "google_auth_oauthlib")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='How many cold starts to measure')
+    parser.add_argument('--top', type=int, default=15, help='How many of the slowest imports to report')
+    parser.add_argument('--output', type=str, default=None, help='Write the JSON report to this file')
+    parser.add_argument(
+        '--baseline', type=str, default=str(DEFAULT_BASELINE),
+        help='A previous report to compare against. Defaults to the committed baseline; pass an empty string to skip'
+    )
+    parser.add_argument(
+        '--threshold', type=float, default=0.2, help='Relative slowdown over the baseline that counts as a regression'
+    )
+    return parser.parse_args()
+
+
+def measure_once():
+    """Import `main` in a fresh interpreter and return ``{module: cumulative microseconds}``."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=PACKAGE_DIR, capture_output=True, text=True, check=True,
+    )
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cumulative_us, module = (part.strip() for part in line.replace("import time:", "|", 1).split("|"))
+        cumulative[module] = int(cumulative_us)
+    return cumulative
+
+
+def measure(repeat: int, top: int) -> dict:
+    runs = [measure_once() for _ in range(repeat)]
+    modules = set().union(*runs)
+    median = {module: statistics.median(run.get(module, 0) for run in runs) for module in modules}
+    slowest = sorted(median.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "python": sys.version.split()[0],
+        "repeat": repeat,
+        "main_import_ms": median.get("main", 0) / 1000,
+        "google_modules_loaded": sorted(m for m in modules if m.split(".")[0] in GOOGLE_PREFIXES),
+        "slowest_imports_ms": {module: microseconds / 1000 for module, microseconds in slowest},
+    }
+
+
+def main():
+    args = parse_args()
+    report = measure(args.repeat, args.top)
+
+    print(f"Importing main.py took {report['main_import_ms']:.1f} ms (median of {args.repeat})")
+    for module, milliseconds in report["slowest_imports_ms"].items():
+        print(f"  {milliseconds:8.1f} ms  {module}")
+    if report["google_modules_loaded"]:
+        print(f"Google modules loaded at startup: {', '.join(report['google_modules_loaded'])}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=4))
+
+    regressed = bool(report["google_modules_loaded"])
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        limit = baseline["main_import_ms"] * (1 + args.threshold)
+        if report["main_import_ms"] > limit:
+            print(f"REGRESSION: {report['main_import_ms']:.1f} ms is over {limit:.1f} ms "
+                  f"(baseline {baseline['main_import_ms']:.1f} ms + {args.threshold:.0%})")
+            regressed = True
+        # Point at the imports that grew, so a regression says where to look
+        for module, milliseconds in report["slowest_imports_ms"].items():
+            before = baseline["slowest_imports_ms"].get(module)
+            if before is not None and milliseconds > before * (1 + args.threshold):
+                print(f"  slower: {module} {milliseconds:.1f} ms (was {before:.1f} ms)")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
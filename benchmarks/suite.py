@@ -0,0 +1,316 @@
+"""
+Benchmark the draw engine, email rendering and a stubbed send path on synthetic groups.
+
+For every roster size and `exclude_last_n` value a synthetic history is generated and the draw
+is timed with each entry point:
+
+    secret_santa      one round through the generic callable based path
+    generate          generate_secret_santa_results, every round together
+
+and the report records the median wall time, the mean number of redraws (times every round was
+drawn again because two rounds collided), the failure rate (draws that raised NoValidDrawError)
+and the peak traced memory of one extra run under tracemalloc. Rendering is timed with MessageRenderer, and sending with
+gmail_send_batched against an in-process stub of the Gmail API that can inject 429 errors.
+
+The report is printed and can be saved as JSON. Given a `--baseline` report, any case that got
+slower, used more memory or failed more often than the threshold allows is flagged and the
+script exits with status 1.
+
+Usage:
+    python benchmarks/suite.py
+    python benchmarks/suite.py --sizes 10 1000 100000 --exclude 0 3 --output bench.json
+    python benchmarks/suite.py --baseline bench.json --threshold 0.25
+"""
+
+import argparse
+import json
+import logging
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+PACKAGE_DIR = Path(__file__).resolve().parent.parent / "pollyanna_secret_santa"
+sys.path.insert(0, str(PACKAGE_DIR))
+
+from src import secret_santa as secret_santa_module  # noqa: E402
+from src.delivery import TokenBucket, gmail_send_batched  # noqa: E402
+from src.helpers import SantasMemory, YearAllocator  # noqa: E402
+from src.instrumentation import DRAW_COLLISIONS, METRICS  # noqa: E402
+from src.matching import NoValidDrawError  # noqa: E402
+from src.rendering import MessageRenderer  # noqa: E402
+
+DRAW_METHODS = ("secret_santa", "generate")
+
+# Differences below this many milliseconds are noise, whatever the relative change
+MIN_REGRESSION_MS = 2.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000, 100000],
+                        help='Roster sizes to benchmark')
+    parser.add_argument('--exclude', type=int, nargs='+', default=[0, 1, 3, 5],
+                        help='exclude_last_n values to benchmark (years of synthetic history)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic rosters, histories and draws')
+    parser.add_argument('--send_error_rate', type=float, default=0.05,
+                        help='Share of stubbed Gmail sends that fail with a retryable 429')
+    parser.add_argument('--skip_memory', action='store_true', help='Do not measure peak memory (much faster)')
+    parser.add_argument('--output', type=str, default=None, help='Write the JSON report to this file')
+    parser.add_argument('--baseline', type=str, default=None, help='A previous report to compare against')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2, help='Relative slowdown over the baseline that counts as a regression'
+    )
+    return parser.parse_args()
+
+
+def synthetic_roster(size: int) -> dict:
+    return {f"Participant {index}": f"participant{index}@example.com" for index in range(size)}
+
+
+def synthetic_history(names: list, years: int, rng: random.Random) -> dict:
+    """Random assignments for the last ``years`` years, in the shape the history store returns."""
+    history = {}
+    for age in range(1, years + 1):
+        history[str(YearAllocator.YEAR - age)] = {
+            round_name: dict(zip(names, rng.sample(names, len(names))))
+            for round_name in SantasMemory.ROUNDS
+        }
+    return history
+
+
+def draw_once(method: str, participants: dict, history: dict, exclude_last_n: int):
+    """Run one draw and return ``(seconds, redraws, failed)``."""
+    santas_memory = SantasMemory(cached_results=history, memory_length=exclude_last_n)
+    METRICS.reset()
+    started = time.perf_counter()
+    try:
+        if method == "secret_santa":
+            secret_santa_module.secret_santa(
+                participants, santas_memory, santas_memory.get_past_regular_gift_recievers
+            )
+        else:
+            secret_santa_module.generate_secret_santa_results(participants, history, santas_memory)
+        failed = False
+    except NoValidDrawError:
+        failed = True
+    elapsed = time.perf_counter() - started
+    return elapsed, METRICS.counters[DRAW_COLLISIONS], failed
+
+
+def peak_memory_mb(function, *args) -> float:
+    tracemalloc.start()
+    try:
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1 << 20)
+
+
+def bench_draws(args) -> list:
+    cases = []
+    for size in args.sizes:
+        participants = synthetic_roster(size)
+        names = list(participants)
+        for exclude_last_n in args.exclude:
+            # Seeded per case, so a case's history does not depend on which other cases run
+            history = synthetic_history(names, exclude_last_n, random.Random(f"{args.seed}-{size}-{exclude_last_n}"))
+            for method in DRAW_METHODS:
+                random.seed(args.seed)
+                runs = [draw_once(method, participants, history, exclude_last_n) for _ in range(args.repeat)]
+                case = {
+                    "method": method,
+                    "size": size,
+                    "exclude_last_n": exclude_last_n,
+                    "wall_ms_median": statistics.median(run[0] for run in runs) * 1000,
+                    "wall_ms_min": min(run[0] for run in runs) * 1000,
+                    "redraws_mean": statistics.mean(run[1] for run in runs),
+                    "failure_rate": sum(run[2] for run in runs) / len(runs),
+                }
+                if not args.skip_memory:
+                    case["peak_memory_mb"] = peak_memory_mb(draw_once, method, participants, history, exclude_last_n)
+                cases.append(case)
+                print(
+                    f"draw    {method:<15}n={size:<7}exclude={exclude_last_n:<3}"
+                    f"{case['wall_ms_median']:10.1f} ms  redraws {case['redraws_mean']:5.1f}  "
+                    f"failed {case['failure_rate']:4.0%}"
+                    + (f"  peak {case['peak_memory_mb']:8.1f} MB" if "peak_memory_mb" in case else "")
+                )
+    return cases
+
+
+def synthetic_results(names: list) -> dict:
+    """A valid two round draw: everyone gives to the next person and gags the one after."""
+    return {
+        round_name: {name: names[(index + shift) % len(names)] for index, name in enumerate(names)}
+        for shift, round_name in enumerate(SantasMemory.ROUNDS, start=1)
+    }
+
+
+def bench_render(args) -> list:
+    cases = []
+    for size in args.sizes:
+        participants = synthetic_roster(size)
+        results = synthetic_results(list(participants))
+        renderer = MessageRenderer(gif_url="https://media.giphy.com/media/example/giphy.gif")
+
+        def render():
+            for _ in renderer.render(participants, results):
+                pass
+
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+        case = {
+            "size": size,
+            "wall_ms_median": statistics.median(timings) * 1000,
+            "messages_per_second": size / statistics.median(timings),
+        }
+        if not args.skip_memory:
+            case["peak_memory_mb"] = peak_memory_mb(render)
+        cases.append(case)
+        print(f"render  n={size:<7}{case['wall_ms_median']:10.1f} ms  {case['messages_per_second']:10.0f} msg/s")
+    return cases
+
+
+class StubHttpError(Exception):
+    status_code = 429
+
+
+class StubGmailService:
+    """Just enough of the Gmail API client for ``gmail_send_batched``, failing a share of sends."""
+
+    def __init__(self, error_rate: float, rng: random.Random):
+        self.error_rate = error_rate
+        self.rng = rng
+        self.sent = 0
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        return body
+
+    def new_batch_http_request(self, callback):
+        return StubBatch(self, callback)
+
+
+class StubBatch:
+    def __init__(self, service: StubGmailService, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append(request_id)
+
+    def execute(self):
+        for request_id in self.requests:
+            if self.service.rng.random() < self.service.error_rate:
+                self.callback(request_id, None, StubHttpError("429 Too Many Requests"))
+            else:
+                self.service.sent += 1
+                self.callback(request_id, {"id": f"stub-{self.service.sent}"}, None)
+
+
+def bench_send(args) -> list:
+    cases = []
+    for size in args.sizes:
+        participants = synthetic_roster(size)
+        messages = list(MessageRenderer().render(participants, synthetic_results(list(participants))))
+
+        timings, retries = [], []
+        for run in range(args.repeat):
+            service = StubGmailService(args.send_error_rate, random.Random(args.seed + run))
+            started = time.perf_counter()
+            outcomes = gmail_send_batched(
+                service,
+                messages,
+                rate_limiter=TokenBucket(rate=float(1 << 30), capacity=1 << 30),
+                max_attempts=10,
+                sleep=lambda seconds: None,
+            )
+            timings.append(time.perf_counter() - started)
+            retries.append(sum(outcome.attempts - 1 for outcome in outcomes.values()))
+        case = {
+            "size": size,
+            "wall_ms_median": statistics.median(timings) * 1000,
+            "retries_mean": statistics.mean(retries),
+        }
+        cases.append(case)
+        print(f"send    n={size:<7}{case['wall_ms_median']:10.1f} ms  retries {case['retries_mean']:8.1f}")
+    return cases
+
+
+def case_key(section: str, case: dict) -> tuple:
+    return section, case.get("method"), case["size"], case.get("exclude_last_n")
+
+
+def find_regressions(report: dict, baseline: dict, threshold: float) -> list:
+    """Compare every case present in both reports and describe the ones that got worse."""
+    baseline_cases = {
+        case_key(section, case): case for section in ("draw", "render", "send") for case in baseline.get(section, [])
+    }
+    regressions = []
+    for section in ("draw", "render", "send"):
+        for case in report[section]:
+            key = case_key(section, case)
+            before = baseline_cases.get(key)
+            if before is None:
+                continue
+            label = " ".join(str(part) for part in key if part is not None)
+
+            limit = before["wall_ms_median"] * (1 + threshold)
+            if case["wall_ms_median"] > limit and case["wall_ms_median"] - before["wall_ms_median"] > MIN_REGRESSION_MS:
+                regressions.append(
+                    f"{label}: {case['wall_ms_median']:.1f} ms, baseline {before['wall_ms_median']:.1f} ms"
+                )
+            if "peak_memory_mb" in case and "peak_memory_mb" in before:
+                if case["peak_memory_mb"] > before["peak_memory_mb"] * (1 + threshold) + 0.1:
+                    regressions.append(
+                        f"{label}: peak {case['peak_memory_mb']:.1f} MB, baseline {before['peak_memory_mb']:.1f} MB"
+                    )
+            if case.get("failure_rate", 0) > before.get("failure_rate", 0):
+                regressions.append(
+                    f"{label}: failure rate {case['failure_rate']:.0%}, baseline {before['failure_rate']:.0%}"
+                )
+    return regressions
+
+
+def main():
+    args = parse_args()
+    # Keep the send logs, including the injected retries, out of the report
+    logging.basicConfig(level=logging.ERROR)
+
+    report = {
+        "python": sys.version.split()[0],
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "draw": bench_draws(args),
+        "render": bench_render(args),
+        "send": bench_send(args),
+    }
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=4))
+
+    regressions = []
+    if args.baseline:
+        regressions = find_regressions(report, json.loads(Path(args.baseline).read_text()), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
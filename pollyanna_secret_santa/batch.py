@@ -0,0 +1,284 @@
+"""
+Run many separate Secret Santa exchanges in one go.
+
+Each exchange lives in its own directory holding a `participants.json` (or `.ndjson` / `.csv`), an optional
+`settings.json`, an optional `rules.json` of house rules and its own history and journals:
+
+    exchanges/
+        family/participants.json
+        family/settings.json        {"exclude_last_n": 3, "rounds": ["regular", "gag"], "gif_url": "..."}
+        office/participants.json
+
+Pass the parent directory, or a manifest JSON listing the exchange directories (relative to the
+manifest) with optional setting overrides:
+
+    [{"directory": "family", "exclude_last_n": 2}, {"directory": "office"}]
+
+The draws are solved in a process pool, then every exchange is sent through one shared,
+rate limited transport and a per exchange summary with timings is printed.
+
+With `--resume` nothing is drawn: each exchange's last unfinished run (from an earlier batch
+that did not send everything, or a `server.py` /draw) is sent instead, skipping emails that
+already went out.
+"""
+
+from typing import Optional
+
+import argparse
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import logging
+
+from main import add_delivery_arguments, create_transport
+from src.constants import ROUNDS
+from src.delivery import build_messages
+from src.feasibility import check_feasibility
+from src.helpers import load_info_from_json, SantasMemory, YearAllocator
+from src.history import HistoryStore
+from src.journal import SendJournal
+from src.matching import NoValidDrawError
+from src.min_cost import min_cost_secret_santa
+from src.roster import load_roster
+from src.rules import ExclusionRules
+from src.seeding import new_seed, seeded_secret_santa_results
+from src.validation import validate_draw
+
+logger = logging.getLogger(__name__)
+
+PARTICIPANTS_FILES = ("participants.json", "participants.ndjson", "participants.csv")
+SETTINGS_FILE = "settings.json"
+RULES_FILE = "rules.json"
+HISTORY_DB_FILE = "santa_history.sqlite3"
+LEGACY_HISTORY_FILE = "prior_year_santa_results.json"
+JOURNAL_DIR = "journal"
+
+DEFAULT_SETTINGS = {
+    "exclude_last_n": 3, "soft_history": False, "rounds": list(ROUNDS), "gif_url": None, "seed": None
+}
+
+
+def parse_args():
+    """
+    Parse the command line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'exchanges',
+        type=str,
+        help='A directory of exchange directories, or a manifest JSON listing them',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help='How many exchanges to solve in parallel. Default is the number of CPUs',
+        required=False,
+        default=None
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help="Instead of drawing, send each exchange's last unfinished run, skipping the emails that already went out",
+        required=False,
+    )
+    add_delivery_arguments(parser)
+
+    return parser.parse_args()
+
+
+def discover_exchanges(path: Path) -> list:
+    """
+    Return the settings of every exchange under a directory or listed in a manifest.
+
+    Args:
+        path (Path): A directory of exchange directories, or a manifest JSON file.
+
+    Returns:
+        list: One settings dict per exchange, with `name` and `directory` filled in.
+    """
+    if path.is_dir():
+        entries = [
+            {"directory": str(child)}
+            for child in sorted(path.iterdir())
+            if find_roster(child) is not None
+        ]
+        base = path
+    else:
+        entries = load_info_from_json(path)
+        base = path.parent
+
+    exchanges = []
+    for entry in entries:
+        directory = Path(base, entry["directory"])
+        settings = dict(DEFAULT_SETTINGS, name=directory.name)
+        settings_path = Path(directory, SETTINGS_FILE)
+        if settings_path.exists():
+            settings.update(load_info_from_json(settings_path))
+        settings.update(entry)
+        settings["directory"] = str(directory)
+        exchanges.append(settings)
+    return exchanges
+
+
+def find_roster(directory: Path) -> Optional[Path]:
+    """Return the exchange's roster file, or None if it has none."""
+    for file_name in PARTICIPANTS_FILES:
+        path = Path(directory, file_name)
+        if path.exists():
+            return path
+    return None
+
+
+def open_history(directory: Path) -> HistoryStore:
+    return HistoryStore.open(Path(directory, HISTORY_DB_FILE), legacy_json_path=Path(directory, LEGACY_HISTORY_FILE))
+
+
+def solve_exchange(settings: dict) -> dict:
+    """
+    Load one exchange and draw it. Runs in a worker process.
+
+    Returns:
+        dict: The settings plus `participants`, `results` and `solve_seconds`, or `error` if the
+            exchange could not be drawn.
+    """
+    started = time.perf_counter()
+    directory = Path(settings["directory"])
+    outcome = dict(settings)
+    try:
+        roster_path = find_roster(directory)
+        if roster_path is None:
+            raise FileNotFoundError(f"No {' or '.join(PARTICIPANTS_FILES)} in {directory}")
+        participants = load_roster(roster_path)
+
+        rules_path = Path(directory, RULES_FILE)
+        rules = ExclusionRules.load(rules_path) if rules_path.exists() else None
+
+        history = open_history(directory)
+        prior_year_results = history.load_recent(settings["exclude_last_n"])
+        history.close()
+
+        feasibility = check_feasibility(
+            participants, prior_year_results, memory_length=settings["exclude_last_n"], name_index=participants.index,
+            rounds=settings["rounds"], rules=rules
+        )
+        if not feasibility.feasible and not settings["soft_history"]:
+            raise RuntimeError(feasibility.describe())
+
+        santas_memory = SantasMemory(
+            cached_results=prior_year_results, memory_length=settings["exclude_last_n"], name_index=participants.index,
+            rounds=settings["rounds"], rules=rules
+        )
+        seed = settings["seed"] if settings["seed"] is not None else new_seed()
+        outcome["seed"] = seed
+        if feasibility.feasible:
+            try:
+                outcome["results"] = seeded_secret_santa_results(
+                    participants, prior_year_results, santas_memory, seed
+                )
+            except NoValidDrawError as error:
+                # The precheck leaves combining the rounds to the draw, which has now shown they cannot be
+                if not feasibility.record_draw_failure(error):
+                    raise
+                if not settings["soft_history"]:
+                    raise RuntimeError(feasibility.describe()) from error
+        if not feasibility.feasible:
+            min_cost_draw = min_cost_secret_santa(participants, santas_memory, rng=random.Random(seed))
+            logger.warning(f"{settings['name']}: {min_cost_draw.describe()}")
+            outcome["results"] = min_cost_draw.results
+        validate_draw(participants, outcome["results"], santas_memory, allow_history=not feasibility.feasible)
+        outcome["participants"] = participants
+    except Exception as error:
+        outcome["error"] = f"{type(error).__name__}: {error}".replace("\n", " ")
+    outcome["solve_seconds"] = time.perf_counter() - started
+    return outcome
+
+
+def resume_exchange(settings: dict) -> dict:
+    """
+    Load one exchange's last unfinished run instead of drawing it.
+
+    Returns:
+        dict: The settings plus `participants`, `results`, `journal` and `solve_seconds`, or `error` if
+            the exchange has no run to resume.
+    """
+    started = time.perf_counter()
+    outcome = dict(settings)
+    journal = SendJournal.latest_unfinished(Path(settings["directory"], JOURNAL_DIR))
+    try:
+        if journal is None:
+            raise FileNotFoundError(f"No unfinished run to resume in {Path(settings['directory'], JOURNAL_DIR)}")
+        validate_draw(journal.participants, journal.results)
+        outcome.update(participants=journal.participants, results=journal.results, seed=journal.seed, journal=journal)
+    except Exception as error:
+        outcome["error"] = f"{type(error).__name__}: {error}".replace("\n", " ")
+    outcome["solve_seconds"] = time.perf_counter() - started
+    return outcome
+
+
+def send_exchange(outcome: dict, transport, render_processes: int = 0) -> None:
+    """Journal, send and record one solved exchange, adding `sent`, `failed` and `send_seconds`."""
+    started = time.perf_counter()
+    directory = Path(outcome["directory"])
+    results, participants = outcome["results"], outcome["participants"]
+
+    journal = outcome.get("journal") or SendJournal.create(
+        Path(directory, JOURNAL_DIR), YearAllocator.YEAR, results, participants, seed=outcome["seed"]
+    )
+    messages = build_messages(
+        participants, results, gif_url=outcome["gif_url"], names=journal.unfinished(), processes=render_processes
+    )
+    transport.send(messages, on_result=journal.record)
+
+    history = open_history(directory)
+    history.save_year(journal.year, results)
+    history.close()
+
+    unsent = journal.unfinished()
+    if not unsent:
+        journal.mark_complete()
+    outcome["sent"] = len(participants) - len(unsent)
+    outcome["failed"] = len(unsent)
+    outcome["send_seconds"] = time.perf_counter() - started
+
+
+def print_summary(outcomes: list) -> None:
+    print(f"{'exchange':<24}{'people':>8}{'solve ms':>10}{'send ms':>10}{'sent':>7}{'failed':>8}  status")
+    for outcome in outcomes:
+        people = len(outcome.get("participants", {}))
+        send_ms = f"{outcome['send_seconds'] * 1000:.0f}" if "send_seconds" in outcome else "-"
+        status = outcome.get("error") or ("ok" if not outcome.get("failed") else "incomplete, see journal")
+        print(
+            f"{outcome['name']:<24}{people:>8}{outcome['solve_seconds'] * 1000:>10.0f}{send_ms:>10}"
+            f"{outcome.get('sent', 0):>7}{outcome.get('failed', 0):>8}  {status}"
+        )
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    parent_path = Path(__file__).parent
+
+    exchanges = discover_exchanges(Path(args.exchanges))
+    logger.info(f"Found {len(exchanges)} exchanges")
+
+    if args.resume:
+        outcomes = [resume_exchange(exchange) for exchange in exchanges]
+    else:
+        # Solve every draw in parallel before sending anything
+        with ProcessPoolExecutor(max_workers=args.workers or os.cpu_count()) as executor:
+            outcomes = list(executor.map(solve_exchange, exchanges))
+
+    # Send through one transport so every exchange shares its connection and rate limit
+    solved = [outcome for outcome in outcomes if "error" not in outcome]
+    if solved:
+        with create_transport(args, parent_path) as transport:
+            for outcome in solved:
+                logger.info(f"Sending exchange {outcome['name']}")
+                send_exchange(outcome, transport, render_processes=args.render_processes)
+
+    print_summary(outcomes)
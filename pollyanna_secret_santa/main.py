@@ -1,20 +1,43 @@
+from typing import Optional, Tuple
+
 import os
 import argparse
-import json
+import random
 from pathlib import Path
 import logging
 from datetime import datetime
 
+from src.constants import GAG, REGULAR, ROUNDS
+from src.delivery import build_messages, count_delivery
+from src.feasibility import check_feasibility
+from src.history import HistoryStore
+from src.instrumentation import METRICS, profiled
+from src.journal import SendJournal
+from src.matching import NoValidDrawError
+from src.min_cost import min_cost_secret_santa
+from src.repair import repair_secret_santa_results
+from src.roster import RosterValidationError, load_roster
+from src.rules import ExclusionRules
 from src.secret_santa import generate_secret_santa_results
+from src.seeding import multi_start_secret_santa, new_seed, seeded_secret_santa_results
+from src.transports import (
+    GMAIL,
+    MAILDIR,
+    MBOX,
+    OUTBOX,
+    SMTP,
+    TRANSPORTS,
+    GmailApiTransport,
+    OutboxTransport,
+    SmtpTransport,
+    Transport
+)
+from src.validation import check_uniformity, validate_draw
 from src.helpers import (
     clean_up,
-    gmail_send_messages,
-    load_info_from_json,
-    load_results_from_cache,
-    save_results_to_cache,
-    SantasMemory
+    SantasMemory,
+    YearAllocator
 )
-from src.auth import build_gmail_api_service
 
 # Set up basic logging configuration
 logging.basicConfig(
@@ -25,6 +48,12 @@ logger = logging.getLogger(__name__)
 
 PARTICIPATNS_JSON_RELATIVE_PATH = "resources/participants.json"
 CACHE_FILE_RELATIVE_PATH = "resources/prior_year_santa_results.json"
+RULES_JSON_RELATIVE_PATH = "resources/rules.json"
+HISTORY_DB_RELATIVE_PATH = "resources/santa_history.sqlite3"
+JOURNAL_DIR_RELATIVE_PATH = "resources/journal"
+OUTBOX_RELATIVE_PATH = "resources/outbox"
+RUN_REPORT_RELATIVE_PATH = "resources/run_report.json"
+PROFILE_RELATIVE_PATH = "resources/run_profile.prof"
 
 
 def parse_args():
@@ -42,13 +71,37 @@ def parse_args():
         required=False,
         default=None
     )
+    parser.add_argument(
+        '--participants',
+        type=str,
+        help='The roster: a name to email JSON object, NDJSON lines with name and email, or a CSV with name and '
+             f'email columns. Default is {PARTICIPATNS_JSON_RELATIVE_PATH}',
+        required=False,
+        default=None
+    )
+    parser.add_argument(
+        '--rules',
+        type=str,
+        help='A JSON file of house rules: households, couples, never pairs and groups people may only draw '
+             f'within. Default is {RULES_JSON_RELATIVE_PATH}, if it exists',
+        required=False,
+        default=None
+    )
     parser.add_argument(
         '--includeGag',
-        type=bool,
-        help='Whether to include a Gag gift or not. Default is True',
+        type=str_to_bool,
+        help='Whether to include a Gag gift or not (true/false). Default is True',
         required=False,
         default=True
     )
+    parser.add_argument(
+        '--rounds',
+        type=str,
+        help=f'Comma separated names of the gift rounds to draw, each with its own history, e.g. '
+             f'"{REGULAR},{GAG},white-elephant". Default is "{",".join(ROUNDS)}"',
+        required=False,
+        default=",".join(ROUNDS)
+    )
     parser.add_argument(
         '--exclude_last_n',
         type=int,
@@ -56,54 +109,419 @@ def parse_args():
         required=False,
         default=3
     )
-
+    parser.add_argument(
+        '--soft_history',
+        action='store_true',
+        help='If --exclude_last_n leaves no valid draw, repeat the fewest and oldest past pairings instead of '
+             'stopping, and report which repeats were needed',
+        required=False,
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume the last unfinished run: reuse its draw and only send the emails that did not go out',
+        required=False,
+    )
+    parser.add_argument(
+        '--repair',
+        action='store_true',
+        help="Update this year's draw after participants joined or dropped out, changing as few assignments as "
+             'possible, and only email the givers whose assignment changed',
+        required=False,
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        help='Seed the draw so it can be replayed exactly. Without one a random seed is picked, logged and '
+             'recorded in the journal and run report',
+        required=False,
+        default=None
+    )
+    parser.add_argument(
+        '--starts',
+        type=int,
+        help='Race this many independently seeded draws in worker processes and keep the first valid one. The '
+             'winning seed is logged, so --seed replays it. Default is 1',
+        required=False,
+        default=1
+    )
+    parser.add_argument(
+        '--uniformity_draws',
+        type=int,
+        help='Instead of drawing and sending, run this many seeded draws and report how evenly the receivers '
+             'are spread (a chi-square test against uniform). Default is 0 (off)',
+        required=False,
+        default=0
+    )
+    parser.add_argument(
+        '--report',
+        type=str,
+        help=f'Where to write the JSON run report with the time spent in each phase and the draw and send '
+             f'counters. Default is {RUN_REPORT_RELATIVE_PATH}',
+        required=False,
+        default=None
+    )
+    parser.add_argument(
+        '--prometheus',
+        type=str,
+        help="Also write the run's metrics to this Prometheus textfile (e.g. for node_exporter's textfile collector)",
+        required=False,
+        default=None
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help=f'Profile the run with cProfile, save the stats to {PROFILE_RELATIVE_PATH} and log the slowest functions',
+        required=False,
+    )
+    add_delivery_arguments(parser)
 
     return parser.parse_args()
 
 
-if __name__ == "__main__":
+def str_to_bool(value: str) -> bool:
+    """Parse a true/false command line value."""
+    if value.lower() in ("1", "true", "yes", "y"):
+        return True
+    if value.lower() in ("0", "false", "no", "n"):
+        return False
+    raise argparse.ArgumentTypeError(f"Expected true or false, got {value!r}")
 
-    args = parse_args()
+
+def selected_rounds(args) -> Tuple[str, ...]:
+    """
+    Return the rounds to draw from `--rounds`, without the gag round when `--includeGag false`.
+
+    Raises:
+        ValueError: If no rounds are left or a round is listed twice.
+    """
+    rounds = tuple(round_name.strip() for round_name in args.rounds.split(",") if round_name.strip())
+    if not args.includeGag:
+        rounds = tuple(round_name for round_name in rounds if round_name != GAG)
+    if not rounds:
+        raise ValueError("There must be at least one gift round to draw")
+    if len(set(rounds)) != len(rounds):
+        raise ValueError(f"Each round can only be listed once: {args.rounds}")
+    return rounds
+
+
+def add_delivery_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the options that choose and tune how emails are delivered.
+
+    Args:
+        parser (argparse.ArgumentParser): The parser to extend.
+    """
+    parser.add_argument(
+        '--transport',
+        choices=TRANSPORTS,
+        help='How to deliver the emails: the Gmail API, an SMTP server (configured with SMTP_* env variables) '
+             'or a local outbox for dry runs. Default is gmail',
+        required=False,
+        default=GMAIL
+    )
+    parser.add_argument(
+        '--outbox',
+        type=str,
+        help=f'Where --transport outbox writes the emails. A Maildir directory, or an mbox file if the path ends in '
+             f'.mbox. Default is {OUTBOX_RELATIVE_PATH}',
+        required=False,
+        default=None
+    )
+    parser.add_argument(
+        '--keep_credentials',
+        action='store_true',
+        help='Keep the Gmail OAuth token in an encrypted local store between runs so later runs can refresh it '
+             'instead of logging in again (requires the cryptography package)',
+        required=False,
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        help='How many emails to send at the same time (SMTP: how many connections to open). '
+             'Default is 1 (batched, sequential sending)',
+        required=False,
+        default=1
+    )
+    parser.add_argument(
+        '--render_processes',
+        type=int,
+        help='Render the emails in this many worker processes. Only worthwhile for very large groups. Default is 0',
+        required=False,
+        default=0
+    )
+    parser.add_argument(
+        '--send_timeout',
+        type=float,
+        help='Seconds to wait for a single email to send when --concurrency is above 1. Default is 30',
+        required=False,
+        default=30.0
+    )
+
+
+def load_rules(args, parent_path: Path) -> Optional[ExclusionRules]:
+    """
+    Load the house rules given with `--rules`, or the default rules file if there is one.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+        parent_path (Path): The directory holding `main.py`.
+
+    Returns:
+        Optional[ExclusionRules]: The rules, or None if there are none.
+    """
+    if args.rules:
+        return ExclusionRules.load(Path(args.rules))
+    default_path = Path(parent_path, RULES_JSON_RELATIVE_PATH)
+    return ExclusionRules.load(default_path) if default_path.exists() else None
+
+
+def create_transport(args, parent_path: Path) -> Transport:
+    """
+    Create the email transport selected on the command line.
+
+    SMTP is configured through the SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_FROM
+    and SMTP_SSL environment variables.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+        parent_path (Path): The directory holding `main.py`.
+
+    Returns:
+        Transport: The transport to deliver the emails with.
+    """
+    if args.transport == OUTBOX:
+        outbox_path = Path(args.outbox) if args.outbox else Path(parent_path, OUTBOX_RELATIVE_PATH)
+        mailbox_format = MBOX if outbox_path.suffix == ".mbox" else MAILDIR
+        return OutboxTransport(outbox_path, mailbox_format=mailbox_format)
+
+    if args.transport == SMTP:
+        use_ssl = os.getenv("SMTP_SSL", "").lower() in ("1", "true", "yes")
+        return SmtpTransport(
+            host=os.getenv("SMTP_HOST", "localhost"),
+            port=int(os.getenv("SMTP_PORT", 465 if use_ssl else 587)),
+            username=os.getenv("SMTP_USERNAME"),
+            password=os.getenv("SMTP_PASSWORD"),
+            from_addr=os.getenv("SMTP_FROM"),
+            use_ssl=use_ssl,
+            pool_size=args.concurrency,
+            timeout=args.send_timeout,
+        )
+
+    # The Google client libraries are slow to import, so only load them when sending through Gmail
+    from src.auth import get_credentials, shared_service_factory
+
+    store = None
+    if args.keep_credentials:
+        from src.credential_store import CredentialStore
+        store = CredentialStore()
+
+    creds = get_credentials(store=store)
+    return GmailApiTransport(
+        service_factory=shared_service_factory(creds),
+        concurrency=args.concurrency,
+        timeout=args.send_timeout,
+    )
+
+
+def run(args) -> None:
+    """
+    Draw this year's assignments, or reuse or repair an earlier draw, and send the emails.
+
+    Every phase runs inside a ``METRICS`` span, so the run report shows where the time went.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+    """
+    rounds = selected_rounds(args)
 
     parent_path = Path(__file__).parent
-    path_to_participatns_json = Path(parent_path, PARTICIPATNS_JSON_RELATIVE_PATH)
+    path_to_participatns_json = Path(args.participants or Path(parent_path, PARTICIPATNS_JSON_RELATIVE_PATH))
+    journal_dir = Path(parent_path, JOURNAL_DIR_RELATIVE_PATH)
 
-    # Load the participants for this year
-    try:
-        participants = load_info_from_json(path_to_participatns_json)
-    except json.decoder.JSONDecodeError as json_error:
-        raise NotImplementedError(
-            f"Please populate a JSON with the following key: value pairs as name: email in {path_to_participatns_json}"
+    # Load only the remembered years from the history store, importing the old JSON cache on first use
+    with METRICS.span("open_history"):
+        history = HistoryStore.open(
+            Path(parent_path, HISTORY_DB_RELATIVE_PATH), legacy_json_path=Path(parent_path, CACHE_FILE_RELATIVE_PATH)
         )
 
-    logger.info("Participatns loaded from participants.json")
+    if args.resume:
+        # Reuse the draw of the last unfinished run and only retry the emails that did not go out
+        with METRICS.span("load_journal"):
+            journal = SendJournal.latest_unfinished(journal_dir)
+        if journal is None:
+            raise RuntimeError(f"There is no unfinished run to resume in {journal_dir}")
 
-    # Load prior year results from cache, or use a hardcoded fallback
-    cache_results_path = Path(parent_path, CACHE_FILE_RELATIVE_PATH)
-    prior_year_results = load_results_from_cache(cache_results_path)
+        METRICS.annotate(seed=journal.seed)
+        participants = journal.participants
+        secret_santa_results = journal.results
+        with METRICS.span("validate"):
+            validate_draw(participants, secret_santa_results)
+        logger.info(f"Resuming {journal.path.name}: {len(journal.unfinished())} emails left to send")
+    else:
+        # Load the participants for this year
+        with METRICS.span("load_roster"):
+            try:
+                participants = load_roster(path_to_participatns_json)
+            except RosterValidationError as roster_error:
+                if path_to_participatns_json.stat().st_size:
+                    raise
+                raise NotImplementedError(
+                    f"Please populate a JSON with the following key: value pairs as name: email in {path_to_participatns_json}"
+                ) from roster_error
 
-    santas_memory = SantasMemory(cached_results=prior_year_results, memory_length=args.exclude_last_n)
+        with METRICS.span("load_rules"):
+            rules = load_rules(args, parent_path)
+        with METRICS.span("load_history"):
+            prior_year_results = history.load_recent(args.exclude_last_n)
 
-    # Generate Secret Santa results
-    secret_santa_results = generate_secret_santa_results(
-        participants, prior_year_results, santas_memory
-    )
+        # Make sure a draw is possible before drawing anything
+        with METRICS.span("feasibility"):
+            feasibility = check_feasibility(
+                participants, prior_year_results, memory_length=args.exclude_last_n, name_index=participants.index,
+                rounds=rounds, rules=rules
+            )
+        if not feasibility.feasible and not args.soft_history:
+            raise NoValidDrawError(feasibility.describe())
+
+        with METRICS.span("santas_memory"):
+            santas_memory = SantasMemory(
+                cached_results=prior_year_results, memory_length=args.exclude_last_n, name_index=participants.index,
+                rounds=rounds, rules=rules
+            )
+
+        # Every draw below is replayable from the seed it was made with
+        seed = args.seed if args.seed is not None else new_seed()
+        rng = random.Random(seed)
+
+        if args.uniformity_draws:
+            # Only measure how evenly the draw engine spreads the receivers; nothing is saved or sent
+            with METRICS.span("uniformity"):
+                uniformity = check_uniformity(
+                    participants, santas_memory,
+                    lambda draw_rng: generate_secret_santa_results(
+                        participants, prior_year_results, santas_memory, rng=draw_rng
+                    ),
+                    draws=args.uniformity_draws, rng=rng,
+                )
+            logger.info(uniformity.describe())
+            history.close()
+            return
+
+        pending = None
+        with METRICS.span("draw"):
+            if args.repair:
+                # Patch this year's draw for the changed roster and only email the givers it affects
+                this_years_results = history.load([YearAllocator.YEAR]).get(str(YearAllocator.YEAR))
+                if not this_years_results:
+                    raise RuntimeError(f"There is no {YearAllocator.YEAR} draw to repair. Run without --repair first")
+
+                repair = repair_secret_santa_results(participants, this_years_results, santas_memory, rng=rng)
+                secret_santa_results = repair.results
+                pending = repair.changed_givers
+            elif feasibility.feasible:
+                try:
+                    if args.starts > 1:
+                        # Race several derived seeds and keep the draw that finished first
+                        secret_santa_results, seed = multi_start_secret_santa(
+                            participants, prior_year_results, santas_memory, seed, args.starts
+                        )
+                    else:
+                        # Generate Secret Santa results
+                        secret_santa_results = seeded_secret_santa_results(
+                            participants, prior_year_results, santas_memory, seed
+                        )
+                except NoValidDrawError as draw_error:
+                    # The precheck leaves combining the rounds to the draw, which has now shown they cannot be
+                    if not feasibility.record_draw_failure(draw_error):
+                        raise
+                    if not args.soft_history:
+                        raise NoValidDrawError(feasibility.describe()) from draw_error
+
+            if not args.repair and not feasibility.feasible:
+                # Allow the fewest and oldest repeats instead of giving up
+                logger.warning(feasibility.describe())
+                min_cost_draw = min_cost_secret_santa(participants, santas_memory, rng=rng)
+                logger.warning(min_cost_draw.describe())
+                secret_santa_results = min_cost_draw.results
+
+        # Never send or save a draw that breaks a rule; repeats are only allowed when soft history needed them
+        with METRICS.span("validate"):
+            validate_draw(participants, secret_santa_results, santas_memory, allow_history=not feasibility.feasible)
+
+        logger.info(f"Drew with seed {seed}. Run again with --seed {seed} and the same files to replay this draw")
+        METRICS.annotate(seed=seed)
+
+        # Journal the draw before sending anything so a failed run can be resumed
+        with METRICS.span("journal"):
+            journal = SendJournal.create(
+                journal_dir, YearAllocator.YEAR, secret_santa_results, participants, pending=pending, seed=seed
+            )
 
     # # Define the GIF URL and use it in an HTML <img> tag
     gif_url = os.getenv("GIF_URL", args.gifUrl)
 
-    # # Send out emails
-    service = build_gmail_api_service()
-    gmail_send_messages(
-        service=service,
-        participants=participants,
-        secret_santa_results=secret_santa_results,
-        gif_url=gif_url,
+    def on_result(result):
+        journal.record(result)
+        count_delivery(result)
+
+    # # Send out emails, rendering each one as it is sent
+    messages = build_messages(
+        participants, secret_santa_results, gif_url=gif_url, names=journal.unfinished(), processes=args.render_processes
     )
+    with METRICS.span("authenticate"):
+        transport = create_transport(args, parent_path)
+    with transport:
+        with METRICS.span("send"):
+            transport.send(messages, on_result=on_result)
 
     # # Cache the results for future use
-    save_results_to_cache(
-        prior_year_results=prior_year_results, results=secret_santa_results, cache_file_path=cache_results_path
-    )
+    with METRICS.span("save_history"):
+        history.save_year(journal.year, secret_santa_results)
+        history.close()
+
+    unsent = journal.unfinished()
+    if unsent:
+        logger.error(f"{len(unsent)} emails were not sent. Run again with --resume to retry only those")
+    else:
+        journal.mark_complete()
 
     clean_up()
+
+
+def write_run_reports(args, parent_path: Path, error: Optional[BaseException]) -> None:
+    """
+    Write the JSON run report and, with `--prometheus`, the Prometheus textfile.
+
+    Args:
+        args (argparse.Namespace): The parsed arguments.
+        parent_path (Path): The directory holding `main.py`.
+        error (Optional[BaseException]): What stopped the run, or None if it finished.
+    """
+    METRICS.write_report(
+        Path(args.report) if args.report else Path(parent_path, RUN_REPORT_RELATIVE_PATH),
+        success=error is None,
+        error=None if error is None else f"{type(error).__name__}: {error}",
+        options=vars(args),
+    )
+    if args.prometheus:
+        METRICS.write_prometheus(Path(args.prometheus), success=error is None)
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    parent_path = Path(__file__).parent
+
+    error = None
+    try:
+        if args.profile:
+            with profiled(Path(parent_path, PROFILE_RELATIVE_PATH)):
+                run(args)
+        else:
+            run(args)
+    except BaseException as run_error:
+        error = run_error
+        raise
+    finally:
+        write_run_reports(args, parent_path, error)
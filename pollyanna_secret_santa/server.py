@@ -0,0 +1,533 @@
+"""
+Serve draws, previews, feasibility checks and history lookups over a local HTTP/JSON API.
+
+The server keeps each exchange's parsed roster, rules, remembered history and compiled
+`SantasMemory` in an LRU cache, so repeated requests skip the loading and compiling a cold
+`main.py` run pays for. An entry is reloaded as soon as the exchange's roster, rules or history
+file changes on disk (by modification time and size).
+
+Exchanges are laid out as for `batch.py`: a directory with a `participants.json` (or `.ndjson` / `.csv`),
+an optional `rules.json`, `settings.json` and `santa_history.sqlite3`. The served root can itself be an
+exchange (the default root is `resources/`, the exchange `main.py` uses) or hold one exchange per
+subdirectory. Requests name the exchange relative to the root, defaulting to the root itself.
+
+Endpoints (bodies and responses are JSON):
+
+    GET  /health                                    {"status": "ok", "cache": {...}}
+    POST /feasibility {"exchange": "family"}        Whether a draw exists, and what blocks it if not
+    POST /preview     {"exchange": "family"}        A draw, without saving it
+    POST /draw        {"exchange": "family"}        A draw, journaled and saved as this year's in the exchange's history
+    GET  /history?exchange=family&last=3            Past draws; or &years=2023,2024, optionally &giver=Name
+
+`/feasibility` checks each round on its own; its `rounds_combine` is null until a draw of the exchange
+has shown whether the rounds can also be drawn together, and false once one has shown they cannot.
+
+`/feasibility`, `/preview` and `/draw` accept the `settings.json` keys `exclude_last_n`, `rounds`,
+`soft_history` and `seed` to override the exchange's settings. Every draw returns the seed it was made
+with, so passing that seed back replays it.
+
+No emails are sent. `/draw` writes the draw to the exchange's `journal/` directory as an unsent run,
+which `main.py --resume` (for the default `resources/` exchange) or `batch.py --resume` then sends.
+Drawing again before sending supersedes that run; once any email of this year's draw has gone out,
+`/draw` refuses to replace it (use `main.py --repair` to change a sent draw).
+
+Usage:
+    python pollyanna_secret_santa/server.py
+    python pollyanna_secret_santa/server.py exchanges/ --port 8765 --cache_size 64
+    curl -s -X POST localhost:8765/preview -d '{"exchange": "family", "exclude_last_n": 2}'
+"""
+
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+import logging
+
+from batch import (
+    DEFAULT_SETTINGS,
+    HISTORY_DB_FILE,
+    JOURNAL_DIR,
+    LEGACY_HISTORY_FILE,
+    RULES_FILE,
+    SETTINGS_FILE,
+    find_roster,
+    open_history
+)
+from src.feasibility import FeasibilityReport, check_feasibility
+from src.helpers import load_info_from_json, SantasMemory, YearAllocator
+from src.journal import SendJournal
+from src.matching import NoValidDrawError
+from src.min_cost import min_cost_secret_santa
+from src.roster import Roster, RosterValidationError, load_roster
+from src.rules import ExclusionRules
+from src.seeding import new_seed, seeded_secret_santa_results
+from src.validation import validate_draw
+
+# Set up basic logging configuration
+logging.basicConfig(
+    level=logging.INFO, format="%(asctime)s [%(name)s] — %(levelname)s - %(message)s"
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOT_RELATIVE_PATH = "resources"
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_SIZE = 32
+
+# Request keys that override an exchange's settings.json
+OVERRIDABLE_SETTINGS = ("exclude_last_n", "rounds", "soft_history", "seed")
+MAX_BODY_BYTES = 1 << 20
+
+
+class RequestError(Exception):
+    """A request that cannot be served, answered with ``status`` and the error message."""
+
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_args():
+    """
+    Parse the command line arguments.
+
+    Returns:
+        argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        'root',
+        type=str,
+        nargs='?',
+        help=f'The exchange directory, or a directory of exchange directories. Default is {DEFAULT_ROOT_RELATIVE_PATH}',
+        default=None
+    )
+    parser.add_argument(
+        '--host',
+        type=str,
+        help=f'The address to listen on. Default is {DEFAULT_HOST} (this machine only)',
+        required=False,
+        default=DEFAULT_HOST
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        help=f'The port to listen on. Default is {DEFAULT_PORT}',
+        required=False,
+        default=DEFAULT_PORT
+    )
+    parser.add_argument(
+        '--cache_size',
+        type=int,
+        help=f'How many loaded exchanges to keep warm. Default is {DEFAULT_CACHE_SIZE}',
+        required=False,
+        default=DEFAULT_CACHE_SIZE
+    )
+    return parser.parse_args()
+
+
+@dataclass
+class LoadedExchange:
+    """An exchange's roster, rules and history, compiled for drawing."""
+
+    participants: Roster
+    rules: Optional[ExclusionRules]
+    prior_year_results: Dict
+    santas_memory: SantasMemory
+    # Computed on first use, then reused until the exchange changes
+    feasibility: Optional[FeasibilityReport] = None
+
+
+def load_exchange(directory: Path, exclude_last_n: int, rounds: Tuple[str, ...]) -> LoadedExchange:
+    """
+    Load and compile one exchange for the given settings.
+
+    Args:
+        directory (Path): The exchange directory.
+        exclude_last_n (int): How many prior years to exclude.
+        rounds (Tuple[str, ...]): The rounds to draw.
+
+    Returns:
+        LoadedExchange: The loaded exchange.
+    """
+    participants = load_roster(find_roster(directory))
+    rules_path = Path(directory, RULES_FILE)
+    rules = ExclusionRules.load(rules_path) if rules_path.exists() else None
+
+    # Opening the store creates the database, which would change the exchange's signature, so skip it until needed
+    prior_year_results = {}
+    if Path(directory, HISTORY_DB_FILE).exists() or Path(directory, LEGACY_HISTORY_FILE).exists():
+        history = open_history(directory)
+        try:
+            prior_year_results = history.load_recent(exclude_last_n)
+        finally:
+            history.close()
+
+    santas_memory = SantasMemory(
+        cached_results=prior_year_results, memory_length=exclude_last_n, name_index=participants.index,
+        rounds=rounds, rules=rules
+    )
+    return LoadedExchange(participants, rules, prior_year_results, santas_memory)
+
+
+def exchange_signature(directory: Path) -> Tuple:
+    """Return the modification time and size of every file a ``LoadedExchange`` is built from."""
+    signature = []
+    for path in (find_roster(directory), Path(directory, RULES_FILE), Path(directory, HISTORY_DB_FILE)):
+        try:
+            stat = os.stat(path)
+        except (OSError, TypeError):
+            signature.append(None)
+        else:
+            signature.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class ExchangeCache:
+    """
+    A thread safe LRU cache of loaded exchanges, invalidated when their files change.
+
+    Entries are keyed by exchange directory and the settings that shape the compiled exclusions
+    (``exclude_last_n`` and the rounds). Every lookup compares the files' current modification
+    times and sizes with the ones the entry was loaded from, so an edited roster or a newly saved
+    draw is picked up on the next request.
+
+    Args:
+        max_entries (int, optional): How many exchanges to keep. Defaults to ``DEFAULT_CACHE_SIZE``.
+
+    Example:
+        cache = ExchangeCache(max_entries=8)
+        exchange = cache.get(Path("exchanges/family"), 3, ("regular", "gag"))
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple, Tuple[Tuple, LoadedExchange]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, directory: Path, exclude_last_n: int, rounds: Tuple[str, ...]) -> LoadedExchange:
+        """Return the loaded exchange, loading it if it is not cached or its files changed."""
+        key = (str(directory), exclude_last_n, tuple(rounds))
+        # Taken before loading, so a change made while loading triggers another load rather than being missed
+        signature = exchange_signature(directory)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        started = time.perf_counter()
+        exchange = load_exchange(directory, exclude_last_n, tuple(rounds))
+        logger.info(
+            f"Loaded {directory} ({len(exchange.participants)} participants) in "
+            f"{(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (signature, exchange)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return exchange
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits,
+                    "misses": self.misses}
+
+
+class SantaServer(ThreadingHTTPServer):
+    """
+    The HTTP server, holding the served root and the exchange cache shared by its request threads.
+
+    Args:
+        address (Tuple[str, int]): The host and port to listen on. Port 0 picks a free port.
+        root (Path): The exchange directory, or a directory of exchange directories.
+        cache_size (int, optional): How many loaded exchanges to keep. Defaults to ``DEFAULT_CACHE_SIZE``.
+
+    Example:
+        server = SantaServer(("127.0.0.1", 0), Path("exchanges"))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], root: Path, cache_size: int = DEFAULT_CACHE_SIZE):
+        super().__init__(address, SantaRequestHandler)
+        self.root = Path(root).resolve()
+        self.cache = ExchangeCache(cache_size)
+        # Serialises saving draws, so two /draw requests cannot interleave their history writes
+        self.save_lock = threading.Lock()
+
+    def exchange_directory(self, name: Optional[str]) -> Path:
+        """
+        Resolve an exchange name to its directory under the root.
+
+        Raises:
+            RequestError: If the name points outside the root or at a directory without a roster.
+        """
+        directory = Path(self.root, name or ".").resolve()
+        if directory != self.root and self.root not in directory.parents:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Exchange {name!r} is outside the served directory")
+        if find_roster(directory) is None:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"There is no exchange {name or '.'!r}")
+        return directory
+
+    def settings(self, directory: Path, request: Dict) -> Dict:
+        """Merge the defaults, the exchange's settings.json and the request's overrides."""
+        settings = dict(DEFAULT_SETTINGS)
+        settings_path = Path(directory, SETTINGS_FILE)
+        if settings_path.exists():
+            settings.update(load_info_from_json(settings_path))
+        settings.update({key: request[key] for key in OVERRIDABLE_SETTINGS if key in request})
+
+        if not isinstance(settings["exclude_last_n"], int) or settings["exclude_last_n"] < 0:
+            raise RequestError(HTTPStatus.BAD_REQUEST, "exclude_last_n must be a whole number of years")
+        if settings["seed"] is not None and not isinstance(settings["seed"], int):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "seed must be a whole number")
+        rounds = settings["rounds"]
+        if isinstance(rounds, str):
+            rounds = [round_name.strip() for round_name in rounds.split(",") if round_name.strip()]
+        if not rounds or len(set(rounds)) != len(rounds):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "rounds must list at least one round, each once")
+        settings["rounds"] = tuple(rounds)
+        return settings
+
+    def feasibility(self, request: Dict) -> Dict:
+        directory = self.exchange_directory(request.get("exchange"))
+        settings = self.settings(directory, request)
+        exchange = self.cache.get(directory, settings["exclude_last_n"], settings["rounds"])
+        report = _feasibility(exchange, settings)
+        return {
+            "feasible": report.feasible,
+            "description": report.describe(),
+            "suggested_exclude_last_n": report.suggested_exclude_last_n,
+            "rounds_combine": report.rounds_combine,
+            "rounds": {
+                round_name: {
+                    "feasible": round_result.feasible,
+                    "blocking_givers": round_result.blocking_givers,
+                    "blocking_pairs": [
+                        {"giver": giver, "receiver": receiver, "years": years}
+                        for giver, receiver, years in round_result.blocking_pairs
+                    ],
+                }
+                for round_name, round_result in report.rounds.items()
+            },
+        }
+
+    def draw(self, request: Dict, save: bool) -> Dict:
+        """
+        Draw an exchange, and with ``save`` journal it as an unsent run and record it as this year's draw.
+
+        Raises:
+            RequestError: 409 if the history and rules leave no valid draw and ``soft_history`` is off, or
+                if ``save`` would replace a draw of this year that has already been emailed.
+        """
+        started = time.perf_counter()
+        directory = self.exchange_directory(request.get("exchange"))
+        settings = self.settings(directory, request)
+        if save:
+            # Checked again under the lock before saving; this only avoids drawing for nothing
+            self._unsent_journals(directory)
+        exchange = self.cache.get(directory, settings["exclude_last_n"], settings["rounds"])
+
+        report = _feasibility(exchange, settings)
+        seed = settings["seed"] if settings["seed"] is not None else new_seed()
+        response = {"year": YearAllocator.YEAR, "seed": seed, "saved": False, "repeats": []}
+        try:
+            if report.feasible:
+                try:
+                    response["results"] = seeded_secret_santa_results(
+                        exchange.participants, exchange.prior_year_results, exchange.santas_memory, seed
+                    )
+                except NoValidDrawError as error:
+                    # The cached report keeps what the draw showed, so /feasibility answers with it from now on
+                    if not report.record_draw_failure(error):
+                        raise
+            if not report.feasible:
+                if not settings["soft_history"]:
+                    raise RequestError(HTTPStatus.CONFLICT, report.describe())
+                min_cost_draw = min_cost_secret_santa(
+                    exchange.participants, exchange.santas_memory, rng=random.Random(seed)
+                )
+                response["results"] = min_cost_draw.results
+                response["repeats"] = [
+                    {"round": repeat.round_name, "giver": repeat.giver, "receiver": repeat.receiver,
+                     "years": repeat.years}
+                    for repeat in min_cost_draw.repeats
+                ]
+        except NoValidDrawError as error:
+            raise RequestError(HTTPStatus.CONFLICT, str(error)) from error
+        validate_draw(
+            exchange.participants, response["results"], exchange.santas_memory, allow_history=not report.feasible
+        )
+
+        if save:
+            with self.save_lock:
+                for earlier in self._unsent_journals(directory):
+                    earlier.mark_superseded()
+                journal = SendJournal.create(
+                    Path(directory, JOURNAL_DIR), YearAllocator.YEAR, response["results"], exchange.participants,
+                    seed=seed
+                )
+                history = open_history(directory)
+                try:
+                    history.save_year(YearAllocator.YEAR, response["results"])
+                finally:
+                    history.close()
+            response["saved"] = True
+            response["journal"] = journal.path.name
+
+        response["milliseconds"] = (time.perf_counter() - started) * 1000
+        return response
+
+    def _unsent_journals(self, directory: Path) -> List[SendJournal]:
+        """
+        Return the open journals of this year's earlier draws, none of which has sent anything.
+
+        Raises:
+            RequestError: 409 if any email of this year's draw has already been sent.
+        """
+        journals = SendJournal.for_year(Path(directory, JOURNAL_DIR), YearAllocator.YEAR)
+        if any(journal.any_sent() for journal in journals):
+            raise RequestError(
+                HTTPStatus.CONFLICT,
+                f"The {YearAllocator.YEAR} draw has already been emailed, so it cannot be replaced. "
+                f"Use main.py --repair to change it"
+            )
+        return [journal for journal in journals if not journal.complete and not journal.superseded]
+
+    def history(self, query: Dict) -> Dict:
+        directory = self.exchange_directory(_single(query, "exchange"))
+        try:
+            if "years" in query:
+                years = [int(year) for value in query["years"] for year in value.split(",") if year]
+            else:
+                years = [YearAllocator.YEAR - age for age in range(1, int(_single(query, "last") or 3) + 1)]
+        except ValueError as error:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"years and last must be whole numbers: {error}") from error
+
+        history = open_history(directory)
+        try:
+            results = history.load(years)
+        finally:
+            history.close()
+
+        giver = _single(query, "giver")
+        if giver is not None:
+            results = {
+                year: {round_name: {giver: assignment[giver]} for round_name, assignment in rounds.items()
+                       if giver in assignment}
+                for year, rounds in results.items()
+            }
+        return {"years": results}
+
+
+class SantaRequestHandler(BaseHTTPRequestHandler):
+    """Routes requests to the ``SantaServer`` and answers in JSON."""
+
+    server: SantaServer
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/health":
+            self._respond(lambda: {"status": "ok", "cache": self.server.cache.stats()})
+        elif url.path == "/history":
+            self._respond(lambda: self.server.history(query))
+        else:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"No such endpoint: GET {url.path}"})
+
+    def do_POST(self):
+        routes = {
+            "/feasibility": lambda request: self.server.feasibility(request),
+            "/preview": lambda request: self.server.draw(request, save=False),
+            "/draw": lambda request: self.server.draw(request, save=True),
+        }
+        path = urlsplit(self.path).path
+        if path not in routes:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"No such endpoint: POST {path}"})
+            return
+        self._respond(lambda: routes[path](self._read_json()))
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "The request body is too large")
+        body = self.rfile.read(length) if length else b"{}"
+        try:
+            request = json.loads(body)
+        except ValueError as error:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"The request body is not valid JSON: {error}") from error
+        if not isinstance(request, dict):
+            raise RequestError(HTTPStatus.BAD_REQUEST, "The request body must be a JSON object")
+        return request
+
+    def _respond(self, handle) -> None:
+        try:
+            self._send_json(HTTPStatus.OK, handle())
+        except RequestError as error:
+            self._send_json(error.status, {"error": str(error)})
+        except (RosterValidationError, ValueError) as error:
+            self._send_json(HTTPStatus.UNPROCESSABLE_ENTITY, {"error": str(error)})
+        except Exception as error:
+            logger.exception(f"Failed to serve {self.command} {self.path}")
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(error).__name__}: {error}"})
+
+    def _send_json(self, status: HTTPStatus, payload: Dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+
+def _feasibility(exchange: LoadedExchange, settings: Dict) -> FeasibilityReport:
+    """Check the exchange once per load; the cached report stays valid until its files change."""
+    if exchange.feasibility is None:
+        exchange.feasibility = check_feasibility(
+            exchange.participants, exchange.prior_year_results, memory_length=settings["exclude_last_n"],
+            name_index=exchange.participants.index, rounds=settings["rounds"], rules=exchange.rules
+        )
+    return exchange.feasibility
+
+
+def _single(query: Dict, key: str) -> Optional[str]:
+    values = query.get(key)
+    return values[-1] if values else None
+
+
+if __name__ == "__main__":
+
+    args = parse_args()
+    root = Path(args.root) if args.root else Path(Path(__file__).parent, DEFAULT_ROOT_RELATIVE_PATH)
+
+    server = SantaServer((args.host, args.port), root, cache_size=args.cache_size)
+    logger.info(f"Serving {server.root} on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        server.server_close()
@@ -1,6 +1,8 @@
 """Get the token credentials from the Google project"""
 
 import os.path
+import json
+import threading
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -8,34 +10,45 @@ from googleapiclient.discovery import build
 
 from src.constants import GoogleAuthConstants
 
+from logging import getLogger
+
+logger = getLogger(__name__)
+
 SCOPES = ["https://www.googleapis.com/auth/gmail.send"]
 
 
-def build_gmail_api_service():
+def get_credentials(store=None) -> Credentials:
     """
-    Builds and returns a Gmail API service instance using OAuth 2.0 credentials.
+    Return valid OAuth 2.0 credentials for the Gmail API.
 
     This function retrieves stored credentials from `token.json`, if available.
     If the credentials are expired or invalid, the user is prompted to log in and 
     new credentials are generated and saved. If no credentials are present, the user 
-    is prompted to complete the OAuth 2.0 flow. The resulting credentials are used 
-    to create a Gmail API service instance.
+    is prompted to complete the OAuth 2.0 flow.
+
+    With a `CredentialStore`, the token is read from and saved to the encrypted store instead
+    of `token.json`, so an expired token is refreshed in place and later runs do not need an
+    interactive login.
+
+    Args:
+        store (CredentialStore, optional): An encrypted store to keep the token in between runs.
 
     Returns:
-        googleapiclient.discovery.Resource: A Gmail API service instance.
+        google.oauth2.credentials.Credentials: The authorized credentials.
 
     Raises:
         google.auth.exceptions.RefreshError: If the credentials cannot be refreshed.
         FileNotFoundError: If the client secrets file (`credentials.json`) is missing.
-    
-    Example:
-        service = build_gmail_api_service()
     """
     creds = None
+    if store is not None:
+        token_json = store.load()
+        if token_json is not None:
+            creds = Credentials.from_authorized_user_info(json.loads(token_json), SCOPES)
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    if os.path.exists(GoogleAuthConstants.TOKEN_JSON):
+    elif os.path.exists(GoogleAuthConstants.TOKEN_JSON):
         creds = Credentials.from_authorized_user_file(GoogleAuthConstants.TOKEN_JSON, SCOPES)
     
     # If there are no (valid) credentials available, let the user log in.
@@ -46,11 +59,63 @@ def build_gmail_api_service():
             flow = InstalledAppFlow.from_client_secrets_file(GoogleAuthConstants.CREDENTIALS_JSON, SCOPES)
             creds = flow.run_local_server(port=0)
         # Save the credentials for the next run
-        with open(GoogleAuthConstants.TOKEN_JSON, "w") as token:
-            token.write(creds.to_json())
+        if store is not None:
+            store.save(creds.to_json())
+        else:
+            with open(GoogleAuthConstants.TOKEN_JSON, "w") as token:
+                token.write(creds.to_json())
+
+    return creds
+
+
+def build_gmail_api_service(creds: Credentials = None):
+    """
+    Builds and returns a Gmail API service instance using OAuth 2.0 credentials.
+
+    If no credentials are given they are obtained with `get_credentials`, which may prompt
+    the user to complete the OAuth 2.0 flow. Pass the same credentials to build one service
+    per worker thread without authorizing again. The service is built from the discovery
+    document bundled with google-api-python-client, so building it needs no network call.
+
+    Args:
+        creds (google.oauth2.credentials.Credentials, optional): The credentials to use.
+
+    Returns:
+        googleapiclient.discovery.Resource: A Gmail API service instance.
+
+    Raises:
+        google.auth.exceptions.RefreshError: If the credentials cannot be refreshed.
+        FileNotFoundError: If the client secrets file (`credentials.json`) is missing.
+    
+    Example:
+        service = build_gmail_api_service()
+    """
+    if creds is None:
+        creds = get_credentials()
 
     # Call the Gmail API
-    service = build("gmail", "v1", credentials=creds)
+    return build("gmail", "v1", credentials=creds, static_discovery=True)
+
+
+def shared_service_factory(creds: Credentials):
+    """
+    Return a factory that hands out one Gmail service per thread, built once from ``creds``.
+
+    Reusing the factory (and the credentials behind it) lets a whole batch of exchanges share
+    one authorized service instead of building and authorizing a new one each time.
+
+    Args:
+        creds (google.oauth2.credentials.Credentials): The credentials to build services with.
+
+    Returns:
+        Callable[[], googleapiclient.discovery.Resource]: The service factory.
+    """
+    local = threading.local()
+
+    def factory():
+        if getattr(local, "service", None) is None:
+            local.service = build_gmail_api_service(creds)
+        return local.service
 
-    return service
+    return factory
 
@@ -1,20 +1,25 @@
 
 REGULAR = 'regular'
 GAG = 'gag'
+ROUNDS = (REGULAR, GAG)
+
+# How each round is named in the emails. Other rounds are named after themselves, e.g.
+# 'white-elephant' becomes 'White Elephant Gift'
+ROUND_LABELS = {REGULAR: 'Genuine Gift', GAG: 'Gag Gift'}
 
 # TODO: update to 3.11 and use StrEnum
 class GoogleAuthConstants:
     CREDENTIALS_JSON = "credentials.json"
     TOKEN_JSON = "token.json"
+    TOKEN_STORE = "token.enc"
+    TOKEN_STORE_KEY = "token.key"
 
 MESSAGE_TEMPLATE = """Ho Ho Ho {name}!
 
 This email is from the Pollyanna (Secret Santa) Program.
 
 You drew the following names:
-    Genuine Gift: {gift_name}
-    Gag Gift: {gag_name}
-
+{draws}
 Have fun shopping!
 
 P.S. Budgets for the gifts will be sent out at a later date.
@@ -27,8 +32,7 @@ HTML_CONTENT = """
     <p>Ho Ho Ho {name}!</p>
     <p>This email is from the Pollyanna (Secret Santa) Program.</p>
     <p>You drew the following names:<br>
-    <span style="padding-left: 20px;">Genuine Gift: {gift_name}</span><br>
-    <span style="padding-left: 20px;">Gag Gift: {gag_name}</span>
+{draws}
     </p>
     <p>Have fun shopping!</p>
     <p>P.S. Budgets for the gifts will be sent out at a later date.<br>
@@ -36,4 +40,9 @@ HTML_CONTENT = """
     {img_block}
 </body>
 </html>
-"""
\ No newline at end of file
+"""
+# One line per round, filled into {draws} above
+MESSAGE_DRAW_LINE = """    {label}: {receiver}
+"""
+HTML_DRAW_LINE = """    <span style="padding-left: 20px;">{label}: {receiver}</span>"""
+HTML_DRAW_SEPARATOR = "<br>\n"
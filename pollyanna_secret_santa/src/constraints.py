@@ -0,0 +1,213 @@
+"""Compact integer-indexed structures describing who may not draw whom"""
+
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+from array import array
+
+
+class NameIndex:
+    """
+    Interns participant names to dense integer IDs.
+
+    IDs are handed out in the order names are first seen, so interning this year's participants
+    first makes a participant's ID equal to their position in the roster.
+
+    Example:
+        index = NameIndex(["Shrek", "Donkey"])
+        index.intern("Fiona")  # 2
+        index.names[1]         # "Donkey"
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self.names: List[str] = []
+        self.ids: Dict[str, int] = {}
+        for name in names:
+            self.intern(name)
+
+    def intern(self, name: str) -> int:
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = len(self.names)
+            self.ids[name] = name_id
+            self.names.append(name)
+        return name_id
+
+    def get(self, name: str) -> Optional[int]:
+        return self.ids.get(name)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name) -> bool:
+        return name in self.ids
+
+
+class AllowList:
+    """
+    The exclusions of a giver who may only draw from ``allowed``: everyone else, plus ``row``.
+
+    Supports ``in`` like a plain row, in constant time, without listing the complement.
+    """
+
+    __slots__ = ("allowed", "row")
+
+    def __init__(self, allowed: FrozenSet[int], row):
+        self.allowed = allowed
+        self.row = row
+
+    def __contains__(self, receiver) -> bool:
+        return receiver not in self.allowed or receiver in self.row
+
+
+class ForbiddenPairs:
+    """
+    Forbidden (giver, receiver) pairs for one round, stored as CSR adjacency.
+
+    Row ``g`` is ``indices[indptr[g]:indptr[g + 1]]``; ``years`` runs parallel to ``indices`` and
+    records which year each pair comes from (0 for pairs that are not history). A pair drawn in
+    several years appears once per year. Givers in ``allowed`` may additionally only draw the
+    receivers listed for them there, which keeps "only draws within this group" rules as small as
+    the group rather than as large as everyone outside it.
+
+    Indexing returns the row as an ``array`` slice, or as an ``AllowList`` for givers in
+    ``allowed``. Both support ``in``, which is what the matching engine expects for
+    ``blocked[giver]``; use ``excluded`` to list everything a giver may not draw.
+    """
+
+    __slots__ = ("indptr", "indices", "years", "allowed")
+
+    def __init__(self, indptr: array, indices: array, years: array, allowed: Dict[int, FrozenSet[int]] = None):
+        self.indptr = indptr
+        self.indices = indices
+        self.years = years
+        self.allowed = allowed or {}
+
+    @classmethod
+    def from_edges(
+        cls, num_rows: int, edges: Sequence[Tuple[int, int, int]], allowed: Dict[int, FrozenSet[int]] = None
+    ) -> "ForbiddenPairs":
+        """
+        Build the CSR arrays from ``(giver, receiver, year)`` triples with a counting sort.
+
+        Args:
+            num_rows (int): The number of givers (rows).
+            edges (Sequence[Tuple[int, int, int]]): The forbidden pairs.
+            allowed (Dict[int, FrozenSet[int]], optional): The only receivers some givers may draw.
+
+        Returns:
+            ForbiddenPairs: The compiled structure.
+        """
+        counts = array("l", bytes(array("l").itemsize * (num_rows + 1)))
+        for giver, _, _ in edges:
+            counts[giver + 1] += 1
+        for row in range(num_rows):
+            counts[row + 1] += counts[row]
+
+        indptr = array("l", counts)
+        indices = array("l", bytes(array("l").itemsize * len(edges)))
+        years = array("l", indices)
+        cursor = counts
+        for giver, receiver, year in edges:
+            slot = cursor[giver]
+            indices[slot] = receiver
+            years[slot] = year
+            cursor[giver] = slot + 1
+
+        return cls(indptr, indices, years, allowed)
+
+    @property
+    def num_rows(self) -> int:
+        return len(self.indptr) - 1
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __getitem__(self, giver: int):
+        if giver >= self.num_rows:
+            return self.indices[0:0]
+        row = self.indices[self.indptr[giver]:self.indptr[giver + 1]]
+        allowed = self.allowed.get(giver)
+        return row if allowed is None else AllowList(allowed, row)
+
+    def excluded(self, giver: int) -> set:
+        """Return every receiver ``giver`` may not draw, listing everyone outside an allow-list."""
+        excluded = set(self.indices[self.indptr[giver]:self.indptr[giver + 1]]) if giver < self.num_rows else set()
+        allowed = self.allowed.get(giver)
+        if allowed is not None:
+            excluded.update(receiver for receiver in range(self.num_rows) if receiver not in allowed)
+        return excluded
+
+    def years_for(self, giver: int, receiver: int) -> List[int]:
+        """Return the years in which ``giver`` drew ``receiver`` (ascending)."""
+        if giver >= self.num_rows:
+            return []
+        start, stop = self.indptr[giver], self.indptr[giver + 1]
+        return sorted(
+            self.years[slot] for slot in range(start, stop)
+            if self.indices[slot] == receiver and self.years[slot]
+        )
+
+    def restrict(self, ids: Sequence[Optional[int]]) -> "ForbiddenPairs":
+        """
+        Re-index the pairs onto a roster.
+
+        Args:
+            ids (Sequence[Optional[int]]): ``ids[position]`` is the interned ID of the participant at
+                that roster position, or None if they have no history.
+
+        Returns:
+            ForbiddenPairs: The pairs between roster members, with rows and columns numbered by roster
+                position. Pairs involving anyone outside the roster are dropped, and so are allow-lists,
+                which only the rules compiled for a roster have.
+        """
+        position_of = array("l", [-1]) * (max((i for i in ids if i is not None), default=-1) + 1)
+        for position, name_id in enumerate(ids):
+            if name_id is not None:
+                position_of[name_id] = position
+
+        edges = []
+        for position, name_id in enumerate(ids):
+            if name_id is None or name_id >= self.num_rows:
+                continue
+            for slot in range(self.indptr[name_id], self.indptr[name_id + 1]):
+                receiver = self.indices[slot]
+                if receiver < len(position_of) and position_of[receiver] >= 0:
+                    edges.append((position, position_of[receiver], self.years[slot]))
+
+        return ForbiddenPairs.from_edges(len(ids), edges)
+
+    def with_extra(self, extra: Sequence[Optional[int]]) -> "ForbiddenPairs":
+        """
+        Return a copy where giver ``g`` is additionally forbidden from drawing ``extra[g]``.
+
+        Used to keep later rounds edge-disjoint from earlier ones.
+        """
+        edges = [
+            (giver, self.indices[slot], self.years[slot])
+            for giver in range(self.num_rows)
+            for slot in range(self.indptr[giver], self.indptr[giver + 1])
+        ]
+        edges.extend((giver, receiver, 0) for giver, receiver in enumerate(extra) if receiver is not None)
+        return ForbiddenPairs.from_edges(max(self.num_rows, len(extra)), edges, self.allowed)
+
+    def union(self, other: "ForbiddenPairs") -> "ForbiddenPairs":
+        """Return the pairs forbidden by either structure, keeping each pair's year and intersecting allow-lists."""
+        edges = [
+            (giver, pairs.indices[slot], pairs.years[slot])
+            for pairs in (self, other)
+            for giver in range(pairs.num_rows)
+            for slot in range(pairs.indptr[giver], pairs.indptr[giver + 1])
+        ]
+        allowed = dict(self.allowed)
+        for giver, receivers in other.allowed.items():
+            allowed[giver] = allowed[giver] & receivers if giver in allowed else receivers
+        return ForbiddenPairs.from_edges(max(self.num_rows, other.num_rows), edges, allowed)
+
+    def without_history(self) -> "ForbiddenPairs":
+        """Return only the pairs that are not history (year 0) and the allow-lists."""
+        edges = [
+            (giver, self.indices[slot], 0)
+            for giver in range(self.num_rows)
+            for slot in range(self.indptr[giver], self.indptr[giver + 1])
+            if not self.years[slot]
+        ]
+        return ForbiddenPairs.from_edges(self.num_rows, edges, self.allowed)
@@ -0,0 +1,129 @@
+"""Encrypted on-disk cache for refreshable OAuth tokens"""
+
+from typing import Optional
+
+import os
+import stat
+from pathlib import Path
+
+from src.constants import GoogleAuthConstants
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+KEY_ENV_VARIABLE = "SANTA_TOKEN_KEY"
+
+
+class CredentialStore:
+    """
+    Keeps the authorized user's token encrypted on disk between runs.
+
+    The token JSON is encrypted with Fernet (AES-128-CBC with an HMAC-SHA256 tag) from the
+    `cryptography` package. The key comes from the ``SANTA_TOKEN_KEY`` environment variable, or
+    from a key file that is generated on first use. A key file in the same directory as the store
+    only keeps the token from casual reads, as anyone who copies the directory gets both, so this
+    logs a warning every time it is used. Both files are written with owner-only permissions, and
+    reading either fails if group or others can access it.
+
+    Args:
+        path (Path, optional): The encrypted store. Defaults to ``GoogleAuthConstants.TOKEN_STORE``.
+        key_path (Path, optional): The key file used when ``SANTA_TOKEN_KEY`` is not set. Defaults
+            to ``GoogleAuthConstants.TOKEN_STORE_KEY``.
+
+    Raises:
+        RuntimeError: If the `cryptography` package is not installed.
+
+    Example:
+        store = CredentialStore()
+        token_json = store.load()
+        store.save(creds.to_json())
+    """
+
+    def __init__(self, path: Path = None, key_path: Path = None):
+        try:
+            from cryptography.fernet import Fernet
+        except ImportError as error:
+            raise RuntimeError(
+                "Keeping credentials between runs requires the `cryptography` package: pip install cryptography"
+            ) from error
+
+        self.path = Path(path or GoogleAuthConstants.TOKEN_STORE)
+        self.key_path = Path(key_path or GoogleAuthConstants.TOKEN_STORE_KEY)
+        self._fernet = Fernet(self._load_key(Fernet))
+
+    def _load_key(self, fernet_class) -> bytes:
+        key = os.getenv(KEY_ENV_VARIABLE)
+        if key:
+            return key.encode()
+
+        if self.key_path.resolve().parent == self.path.resolve().parent:
+            logger.warning(
+                f"The credential key {self.key_path} sits next to the token it protects. Set {KEY_ENV_VARIABLE}, "
+                f"or keep the key file in another directory"
+            )
+
+        if self.key_path.exists():
+            return _read_private(self.key_path).strip()
+
+        key = fernet_class.generate_key()
+        _write_private(self.key_path, key)
+        logger.info(f"Generated a new credential key at {self.key_path}")
+        return key
+
+    def load(self) -> Optional[str]:
+        """
+        Return the decrypted token JSON, or None if nothing is stored or it cannot be decrypted.
+
+        Raises:
+            PermissionError: If the store is readable by anyone but its owner.
+        """
+        from cryptography.fernet import InvalidToken
+
+        if not self.path.exists():
+            return None
+        try:
+            return self._fernet.decrypt(_read_private(self.path)).decode()
+        except InvalidToken:
+            logger.warning(f"Could not decrypt {self.path} with the current key; ignoring it")
+            return None
+
+    def save(self, token_json: str) -> None:
+        """Encrypt and atomically write the token JSON."""
+        _write_private(self.path, self._fernet.encrypt(token_json.encode()))
+
+    def clear(self) -> None:
+        if self.path.exists():
+            self.path.unlink()
+
+
+def _check_private(path: Path) -> None:
+    """Refuse files that group or others can read or write."""
+    if os.name != "posix":
+        return
+    mode = path.stat().st_mode
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise PermissionError(
+            f"{path} is accessible by other users (mode {stat.filemode(mode)}). Run: chmod 600 {path}"
+        )
+
+
+def _read_private(path: Path) -> bytes:
+    _check_private(path)
+    return path.read_bytes()
+
+
+def _write_private(path: Path, data: bytes) -> None:
+    """Write ``data`` to a new owner-only file and move it into place."""
+    temporary_path = path.with_name(path.name + ".tmp")
+    # A temporary file left by an interrupted write keeps its old mode when reopened, so always start afresh
+    try:
+        temporary_path.unlink()
+    except FileNotFoundError:
+        pass
+    descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(descriptor, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
@@ -0,0 +1,457 @@
+"""Batched, rate limited delivery of the Secret Santa emails through the Gmail API"""
+
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+from dataclasses import dataclass
+
+import asyncio
+import random
+import threading
+import time
+from queue import SimpleQueue
+
+from src.instrumentation import EMAILS_FAILED, EMAILS_SENT, HTTP_ERRORS, METRICS, SEND_RETRIES, SEND_TIMEOUTS
+from src.rendering import MessageRenderer, OutgoingMessage
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# messages.send costs 100 quota units against a per-user limit of 250 units per second
+GMAIL_SENDS_PER_SECOND = 2.5
+# Gmail starts rate limiting batches larger than this
+GMAIL_BATCH_SIZE = 10
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+SENT = "sent"
+FAILED = "failed"
+
+
+@dataclass
+class DeliveryResult:
+    """The outcome of sending one participant's email."""
+
+    name: str
+    to_email: str
+    status: str
+    message_id: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = 0
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter.
+
+    Tokens refill continuously at ``rate`` per second up to ``capacity``; ``acquire`` blocks until
+    enough tokens are available and is safe to call from several threads. The clock and sleep
+    functions can be swapped out in tests.
+
+    Example:
+        bucket = TokenBucket(rate=2.5, capacity=10)
+        bucket.acquire(5)
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = capacity
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1) -> None:
+        with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                self.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+    def reserve(self, tokens: float = 1) -> float:
+        """Take tokens without blocking and return how many seconds the caller should wait first."""
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+
+def build_messages(
+    participants: Dict, secret_santa_results: Dict, gif_url: str = None, names: Iterable[str] = None,
+    processes: int = 0
+) -> Iterator[OutgoingMessage]:
+    """
+    Render every participant's email with a ``MessageRenderer``.
+
+    Args:
+        participants (Dict[str, str]): A dictionary mapping participant names to their email addresses.
+        secret_santa_results (Dict): ``{round: {giver: receiver}}``
+        gif_url (str, optional): The URL of a GIF to embed in the HTML version. Defaults to None.
+        names (Iterable[str], optional): Only render the emails of these givers. Defaults to everyone.
+        processes (int, optional): Render in this many worker processes. Defaults to 0 (in process).
+
+    Yields:
+        OutgoingMessage: One message per giver.
+    """
+    renderer = MessageRenderer(gif_url=gif_url)
+    return renderer.render(participants, secret_santa_results, names=names, processes=processes)
+
+
+def gmail_send_batched(
+    service,
+    messages: Iterable[OutgoingMessage],
+    batch_size: int = GMAIL_BATCH_SIZE,
+    rate_limiter: TokenBucket = None,
+    max_attempts: int = 5,
+    base_delay: float = 1.0,
+    sleep: Callable[[float], None] = time.sleep,
+    on_result: Callable[[DeliveryResult], None] = None,
+) -> Dict[str, DeliveryResult]:
+    """
+    Send messages through Gmail API batch requests, retrying transient failures.
+
+    Messages are grouped into ``BatchHttpRequest`` calls of ``batch_size`` requests. Every message
+    takes a token from ``rate_limiter`` before it is added to a batch. Requests that fail with 429
+    or a 5xx status are retried in a later batch after an exponential backoff with jitter; any other
+    error fails that recipient immediately. A summary of the outcomes is logged at the end.
+
+    Args:
+        service: The Gmail API service instance (or any object with the same
+            ``new_batch_http_request`` and ``users().messages().send`` interface).
+        messages (Iterable[OutgoingMessage]): The messages to send.
+        batch_size (int, optional): Requests per batch. Defaults to ``GMAIL_BATCH_SIZE``.
+        rate_limiter (TokenBucket, optional): Limits the send rate. Defaults to a bucket tuned to the
+            Gmail per-user quota.
+        max_attempts (int, optional): Attempts per recipient before giving up. Defaults to 5.
+        base_delay (float, optional): The first retry delay in seconds, doubled each retry. Defaults to 1.
+        sleep (Callable[[float], None], optional): Used to wait between retries. Defaults to ``time.sleep``.
+        on_result (Callable[[DeliveryResult], None], optional): Called once with each recipient's
+            final outcome.
+
+    Returns:
+        Dict[str, DeliveryResult]: The final outcome per participant name.
+
+    Example:
+        results = gmail_send_batched(service, build_messages(participants, secret_santa_results))
+    """
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(rate=GMAIL_SENDS_PER_SECOND, capacity=batch_size, sleep=sleep)
+
+    outcomes: Dict[str, DeliveryResult] = {}
+    pending: List[OutgoingMessage] = []
+    attempt = 0
+
+    def finish(result: DeliveryResult) -> None:
+        outcomes[result.name] = result
+        if on_result is not None:
+            on_result(result)
+
+    messages = iter(messages)
+    while True:
+        retry: List[OutgoingMessage] = []
+        for batch in _batches(pending, messages, batch_size):
+            retry.extend(_send_batch(service, batch, rate_limiter, attempt + 1, max_attempts, finish))
+
+        if not retry:
+            break
+
+        attempt += 1
+        delay = base_delay * 2 ** (attempt - 1)
+        delay += random.uniform(0, base_delay)
+        logger.warning(f"Retrying {len(retry)} messages in {delay:.1f}s (attempt {attempt + 1} of {max_attempts})")
+        sleep(delay)
+        pending, messages = retry, iter(())
+
+    log_delivery_summary(outcomes)
+    return outcomes
+
+
+def gmail_sender(service_factory: Callable[[], object]) -> Callable[[OutgoingMessage], str]:
+    """
+    Return a blocking ``send_one`` function for ``send_concurrently`` backed by the Gmail API.
+
+    Gmail service objects are not thread safe, so each worker thread lazily builds its own
+    service with ``service_factory``.
+
+    Args:
+        service_factory (Callable[[], object]): Builds a Gmail API service instance.
+
+    Returns:
+        Callable[[OutgoingMessage], str]: Sends one message and returns its message ID.
+    """
+    local = threading.local()
+
+    def send_one(message: OutgoingMessage) -> str:
+        if getattr(local, "service", None) is None:
+            local.service = service_factory()
+        response = local.service.users().messages().send(userId="me", body={"raw": message.raw}).execute()
+        return response["id"]
+
+    return send_one
+
+
+async def send_concurrently(
+    messages: Iterable[OutgoingMessage],
+    send_one: Callable[[OutgoingMessage], str],
+    concurrency: int = 4,
+    timeout: float = 30.0,
+    rate_limiter: TokenBucket = None,
+    max_attempts: int = 5,
+    base_delay: float = 1.0,
+    on_result: Callable[[DeliveryResult], None] = None,
+) -> Dict[str, DeliveryResult]:
+    """
+    Send messages through a producer/consumer pipeline with bounded concurrency.
+
+    One producer renders messages into a bounded queue while ``concurrency`` workers send them. Each
+    worker runs the blocking ``send_one`` on its own thread, with a per-request ``timeout``. 429s
+    and 5xx errors are retried with exponential backoff; any other error fails that recipient
+    immediately.
+
+    A timed out request cannot be interrupted and may still deliver the email, so it is failed
+    without a retry rather than risk sending it twice. Its worker leaves the stuck thread to finish
+    in the background and carries on with a fresh one, so a hung request never holds up the rest.
+    Send threads are daemon threads, so a request that never returns does not keep the program
+    from exiting either. Until then an abandoned request may still complete, so a recipient the
+    send journal records as failed after a timeout may in fact have been emailed.
+
+    Args:
+        messages (Iterable[OutgoingMessage]): The messages to send, rendered lazily by the producer.
+        send_one (Callable[[OutgoingMessage], str]): Sends one message and returns its message ID.
+        concurrency (int, optional): The number of concurrent sends. Defaults to 4.
+        timeout (float, optional): Seconds to wait for a single send. Defaults to 30.
+        rate_limiter (TokenBucket, optional): Limits the send rate across all workers. Defaults to a
+            bucket tuned to the Gmail per-user quota.
+        max_attempts (int, optional): Attempts per recipient before giving up. Defaults to 5.
+        base_delay (float, optional): The first retry delay in seconds, doubled each retry. Defaults to 1.
+        on_result (Callable[[DeliveryResult], None], optional): Called once with each recipient's
+            final outcome.
+
+    Returns:
+        Dict[str, DeliveryResult]: The final outcome per participant name.
+
+    Example:
+        results = asyncio.run(send_concurrently(build_messages(...), gmail_sender(factory), concurrency=8))
+    """
+    if rate_limiter is None:
+        rate_limiter = TokenBucket(rate=GMAIL_SENDS_PER_SECOND, capacity=concurrency)
+
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    outcomes: Dict[str, DeliveryResult] = {}
+
+    async def produce():
+        for message in messages:
+            await queue.put(message)
+        for _ in range(concurrency):
+            await queue.put(None)
+
+    async def consume():
+        thread = _SendThread()
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    return
+                result = await _send_with_retry(
+                    loop, thread, send_one, message, rate_limiter, timeout, max_attempts, base_delay
+                )
+                outcomes[message.name] = result
+                if on_result is not None:
+                    on_result(result)
+        finally:
+            thread.close()
+
+    workers = [asyncio.create_task(consume()) for _ in range(concurrency)]
+    await produce()
+    await asyncio.gather(*workers)
+
+    log_delivery_summary(outcomes)
+    return outcomes
+
+
+def gmail_send_concurrent(service_factory, messages: Iterable[OutgoingMessage], concurrency: int = 4,
+                          timeout: float = 30.0, **kwargs) -> Dict[str, DeliveryResult]:
+    """Blocking wrapper that runs ``send_concurrently`` with a Gmail backed ``send_one``."""
+    return asyncio.run(
+        send_concurrently(messages, gmail_sender(service_factory), concurrency=concurrency, timeout=timeout, **kwargs)
+    )
+
+
+class _SendThread:
+    """
+    One worker's send thread, replaced when a send on it times out and is abandoned.
+
+    The thread is a daemon, unlike ``ThreadPoolExecutor`` threads, which the interpreter joins on
+    exit, so an abandoned send that hangs forever cannot hold up the end of the run.
+    """
+
+    def __init__(self):
+        self._start()
+
+    def _start(self) -> None:
+        self.requests = SimpleQueue()
+        threading.Thread(target=_serve_sends, args=(self.requests,), name="santa-send", daemon=True).start()
+
+    def run(self, loop, send, message) -> asyncio.Future:
+        future = loop.create_future()
+        self.requests.put((loop, future, send, message))
+        return future
+
+    def abandon(self) -> None:
+        # The old thread exits once its send returns, or with the interpreter; nothing waits for it
+        self.close()
+        self._start()
+
+    def close(self) -> None:
+        self.requests.put(None)
+
+
+def _serve_sends(requests: SimpleQueue) -> None:
+    """Run each queued send and hand its outcome back to the event loop that asked for it."""
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        loop, future, send, message = request
+        try:
+            outcome = (send(message), None)
+        except Exception as error:
+            outcome = (None, error)
+        try:
+            loop.call_soon_threadsafe(_settle, future, *outcome)
+        except RuntimeError:
+            # An abandoned send that outlived its event loop has nobody left to tell
+            pass
+
+
+def _settle(future: asyncio.Future, result, error) -> None:
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+async def _send_with_retry(loop, thread, send, message, rate_limiter, timeout, max_attempts, base_delay) -> DeliveryResult:
+    for attempt in range(1, max_attempts + 1):
+        # Wait for the rate limiter here, so the per-request timeout only covers the send itself
+        await asyncio.sleep(rate_limiter.reserve())
+        try:
+            message_id = await asyncio.wait_for(thread.run(loop, send, message), timeout)
+        except asyncio.TimeoutError:
+            METRICS.count(SEND_TIMEOUTS)
+            thread.abandon()
+            # The request may still go through, so retrying could deliver the email twice
+            error, retryable = f"timed out after {timeout}s and may still have been sent", False
+        except Exception as exception:
+            count_http_error(exception)
+            error, retryable = str(exception), http_status(exception) in RETRYABLE_STATUSES
+        else:
+            logger.info(f"Sent Message Id: {message_id} to {message.to_email}")
+            return DeliveryResult(message.name, message.to_email, SENT, message_id=message_id, attempts=attempt)
+
+        if not retryable or attempt == max_attempts:
+            logger.error(f"Error occurred sending the email to {message.to_email}: {error}")
+            return DeliveryResult(message.name, message.to_email, FAILED, error=error, attempts=attempt)
+
+        await asyncio.sleep(base_delay * 2 ** (attempt - 1) + random.uniform(0, base_delay))
+
+
+def _batches(pending: List[OutgoingMessage], messages: Iterator[OutgoingMessage], batch_size: int):
+    """Yield lists of at most ``batch_size`` messages, retries first."""
+    batch = []
+    for message in pending:
+        batch.append(message)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    for message in messages:
+        batch.append(message)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _send_batch(service, batch, rate_limiter, attempt, max_attempts, finish) -> List[OutgoingMessage]:
+    """Send one batch and return the messages that should be retried."""
+    by_name = {message.name: message for message in batch}
+    retry = []
+
+    def callback(request_id, response, exception):
+        message = by_name[request_id]
+        if exception is None:
+            logger.info(f'Sent Message Id: {response["id"]} to {message.to_email}')
+            finish(DeliveryResult(message.name, message.to_email, SENT, message_id=response["id"], attempts=attempt))
+            return
+
+        status = count_http_error(exception)
+        if status in RETRYABLE_STATUSES and attempt < max_attempts:
+            retry.append(message)
+            return
+
+        logger.error(f"Error occurred sending the email to {message.to_email}: {exception}")
+        finish(DeliveryResult(message.name, message.to_email, FAILED, error=str(exception), attempts=attempt))
+
+    batch_request = service.new_batch_http_request(callback=callback)
+    for message in batch:
+        rate_limiter.acquire()
+        batch_request.add(
+            service.users().messages().send(userId="me", body={"raw": message.raw}),
+            request_id=message.name,
+        )
+
+    try:
+        batch_request.execute()
+    except Exception as error:
+        # The whole batch failed in transit; none of its callbacks ran
+        count_http_error(error)
+        logger.warning(f"Batch of {len(batch)} messages failed: {error}")
+        if attempt < max_attempts:
+            return list(batch)
+        for message in batch:
+            finish(DeliveryResult(message.name, message.to_email, FAILED, error=str(error), attempts=attempt))
+        return []
+
+    return retry
+
+
+def http_status(error: Exception) -> Optional[int]:
+    """Return the HTTP status of an ``HttpError`` (or lookalike), or None if it has none."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "resp", None), "status", None)
+    return int(status) if status is not None else None
+
+
+def count_http_error(error: Exception) -> Optional[int]:
+    """Count ``error`` in the run metrics if it carries an HTTP status, and return that status."""
+    status = http_status(error)
+    if status is not None:
+        METRICS.count(HTTP_ERRORS)
+        METRICS.count(f"{HTTP_ERRORS}_{status}")
+    return status
+
+
+def count_delivery(result: DeliveryResult) -> None:
+    """Count one recipient's final outcome, and the retries it took, in the run metrics."""
+    METRICS.count(EMAILS_SENT if result.status == SENT else EMAILS_FAILED)
+    METRICS.count(SEND_RETRIES, max(result.attempts - 1, 0))
+
+
+def log_delivery_summary(outcomes: Dict[str, DeliveryResult]) -> None:
+    """Log how many emails were sent and which recipients failed."""
+    sent = [result for result in outcomes.values() if result.status == SENT]
+    failed = [result for result in outcomes.values() if result.status == FAILED]
+    logger.info(f"Delivery summary: {len(sent)} sent, {len(failed)} failed")
+    for result in failed:
+        logger.error(f"  {result.name} <{result.to_email}> failed after {result.attempts} attempts: {result.error}")
@@ -0,0 +1,245 @@
+"""Check that a draw is possible before drawing, and explain why when it is not"""
+
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from dataclasses import dataclass, field
+
+import random
+
+from src.constraints import ForbiddenPairs, NameIndex
+from src.helpers import SantasMemory
+from src.matching import NoValidDrawError, solve_assignment
+from src.secret_santa import DrawSearchGaveUp, solve_disjoint_rounds
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+@dataclass
+class RoundFeasibility:
+    """The outcome of the precheck for a single round."""
+
+    round_name: str
+    feasible: bool
+    # A minimal set of givers that cannot all be matched at once
+    blocking_givers: List[str] = field(default_factory=list)
+    # (giver, receiver, years) for every exclusion that shuts the blocking givers out; no years for house rules
+    blocking_pairs: List[Tuple[str, str, List[str]]] = field(default_factory=list)
+
+
+@dataclass
+class FeasibilityReport:
+    """The outcome of the precheck for every round."""
+
+    memory_length: int
+    rounds: Dict[str, RoundFeasibility]
+    # Whether the rounds can be drawn together without anyone drawing the same person twice. The precheck
+    # leaves this to the draw (None); a draw that proves they cannot sets it with ``record_draw_failure``
+    rounds_combine: Optional[bool] = None
+    # Finds the largest exclude_last_n that still allows a draw; only run when an infeasible report is asked
+    suggest: Optional[Callable[[], Optional[int]]] = field(default=None, repr=False, compare=False)
+    _suggestion: Optional[Tuple[Optional[int]]] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def feasible(self) -> bool:
+        return self.rounds_combine is not False and all(round_result.feasible for round_result in self.rounds.values())
+
+    @property
+    def suggested_exclude_last_n(self) -> Optional[int]:
+        """The largest exclude_last_n that still allows a draw, when memory_length does not. Computed on first use."""
+        if self.feasible or self.suggest is None:
+            return None
+        if self._suggestion is None:
+            self._suggestion = (self.suggest(),)
+        return self._suggestion[0]
+
+    def record_draw_failure(self, error: NoValidDrawError) -> bool:
+        """
+        Record that a draw this report passed failed, as when the rounds cannot be combined.
+
+        Args:
+            error (NoValidDrawError): What the draw raised.
+
+        Returns:
+            bool: Whether the failure settles that the rounds cannot be combined. A search that gave
+                up (``DrawSearchGaveUp``) settles nothing, and the report is left as it was.
+        """
+        if isinstance(error, DrawSearchGaveUp):
+            return False
+        self.rounds_combine = False
+        return True
+
+    def describe(self) -> str:
+        """Render the report as a human readable message."""
+        if self.feasible:
+            return f"A valid draw exists with exclude_last_n={self.memory_length}"
+
+        lines = [f"No valid draw exists with exclude_last_n={self.memory_length}."]
+        for round_result in self.rounds.values():
+            if round_result.feasible:
+                continue
+            lines.append(
+                f"[{round_result.round_name}] These givers cannot all be matched: "
+                f"{', '.join(round_result.blocking_givers)}"
+            )
+            for giver, receiver, years in round_result.blocking_pairs:
+                reason = f"drawn in {', '.join(years)}" if years else "house rule"
+                lines.append(f"    {giver} -> {receiver} ({reason})")
+        if not self.rounds_combine:
+            lines.append(
+                f"Each of the rounds {', '.join(self.rounds)} can be drawn on its own, but not all of them "
+                "without someone drawing the same person twice."
+            )
+        if self.suggested_exclude_last_n is not None:
+            lines.append(
+                f"The largest exclude_last_n that still allows a draw is {self.suggested_exclude_last_n}."
+            )
+        return "\n".join(lines)
+
+
+def check_feasibility(
+    participants: Dict,
+    cached_results: Dict,
+    memory_length: int,
+    name_index: NameIndex = None,
+    rounds: Sequence[str] = None,
+    rules=None,
+) -> FeasibilityReport:
+    """
+    Test whether every round can be drawn before making any random draw.
+
+    For each round the allowed (giver, receiver) pairs are built from the participants and the
+    `SantasMemory` exclusions, and a matching is attempted with a fixed seed. A perfect matching
+    exists exactly when Hall's condition holds, so when the matching gets stuck the set of givers it
+    got stuck on is a Hall violator. That set is shrunk to a minimal one and reported together with the
+    history years responsible.
+
+    Whether the rounds, each drawable on its own, can also be drawn together (nobody may draw the
+    same person in two rounds) takes a full draw to settle, so it is left to the draw itself: when the
+    draw fails, pass its error to `FeasibilityReport.record_draw_failure`. Smaller memory lengths are
+    only tried, to suggest the largest `exclude_last_n` that still works, when an infeasible report's
+    `suggested_exclude_last_n` is first read.
+
+    Args:
+        participants (Dict[str, str]): A dictionary mapping participant names to their email addresses.
+        cached_results (Dict): The prior years' results, keyed by year.
+        memory_length (int): The number of prior years to exclude (`--exclude_last_n`).
+        name_index (NameIndex, optional): An index already holding the participants, such as a
+            `Roster`'s, so it is not rebuilt.
+        rounds (Sequence[str], optional): The rounds to check. Defaults to `SantasMemory.ROUNDS`.
+        rules (ExclusionRules, optional): House rules that are checked together with the history.
+
+    Returns:
+        FeasibilityReport: The per round outcome and, if infeasible, a suggested memory length.
+
+    Example:
+        report = check_feasibility(participants, prior_year_results, memory_length=3)
+        if not report.feasible:
+            print(report.describe())
+    """
+    names_list = list(participants.keys())
+    santas_memory = SantasMemory(
+        cached_results=cached_results, memory_length=memory_length, name_index=name_index, rounds=rounds,
+        rules=rules
+    )
+
+    round_results = {
+        round_name: _check_round(round_name, names_list, santas_memory.forbidden_pairs(round_name, names_list))
+        for round_name in santas_memory.rounds
+    }
+
+    def suggest() -> Optional[int]:
+        return _suggest_memory_length(
+            names_list, cached_results, memory_length, name_index, santas_memory.rounds, rules
+        )
+
+    return FeasibilityReport(memory_length=memory_length, rounds=round_results, suggest=suggest)
+
+
+def _suggest_memory_length(
+    names_list: List[str], cached_results: Dict, memory_length: int, name_index: NameIndex, rounds, rules
+) -> Optional[int]:
+    """Return the largest memory length below ``memory_length`` that allows a draw, or None if none does."""
+    for shorter_length in range(memory_length - 1, -1, -1):
+        shorter_memory = SantasMemory(
+            cached_results=cached_results, memory_length=shorter_length, name_index=name_index,
+            rounds=rounds, rules=rules
+        )
+        if all(
+            _blocking_givers(shorter_memory.forbidden_pairs(round_name, names_list)) is None
+            for round_name in shorter_memory.rounds
+        ) and _rounds_combine(shorter_memory, names_list):
+            return shorter_length
+    return None
+
+
+def _check_round(round_name: str, names_list: List[str], blocked: ForbiddenPairs) -> RoundFeasibility:
+    blocking = _blocking_givers(blocked)
+    if blocking is None:
+        return RoundFeasibility(round_name=round_name, feasible=True)
+
+    blocking = _minimize_violator(len(names_list), blocked, blocking)
+
+    # Receivers that no blocking giver may draw. Self pairs are never reported; house rule pairs
+    # are reported without a year.
+    shut_out = set.intersection(*({giver, *blocked.excluded(giver)} for giver in blocking))
+    blocking_pairs = []
+    for giver in blocking:
+        for receiver in sorted(shut_out):
+            if receiver == giver:
+                continue
+            drawn_in = [str(year) for year in blocked.years_for(giver, receiver)]
+            blocking_pairs.append((names_list[giver], names_list[receiver], drawn_in))
+
+    return RoundFeasibility(
+        round_name=round_name,
+        feasible=False,
+        blocking_givers=[names_list[giver] for giver in blocking],
+        blocking_pairs=blocking_pairs,
+    )
+
+
+def _blocking_givers(blocked: ForbiddenPairs) -> Optional[List[int]]:
+    """Return a Hall violator for the round, or None if a perfect matching exists."""
+    try:
+        solve_assignment(blocked.num_rows, blocked, rng=random.Random(0))
+    except NoValidDrawError as error:
+        return error.blocking_givers
+    return None
+
+
+def _rounds_combine(santas_memory: SantasMemory, names_list: List[str]) -> bool:
+    """Return whether the rounds, each drawable on its own, can be drawn together edge-disjoint."""
+    if len(santas_memory.rounds) < 2:
+        return True
+    blocked = {
+        round_name: santas_memory.forbidden_pairs(round_name, names_list) for round_name in santas_memory.rounds
+    }
+    try:
+        solve_disjoint_rounds(len(names_list), santas_memory.rounds, blocked, rng=random.Random(0))
+    except DrawSearchGaveUp as error:
+        # Undecided: let the draw itself try, with its own randomness
+        logger.warning(error)
+    except NoValidDrawError:
+        return False
+    return True
+
+
+def _minimize_violator(n: int, blocked: ForbiddenPairs, givers: List[int]) -> List[int]:
+    """
+    Shrink a Hall violator until removing any further giver would satisfy Hall's condition.
+
+    A giver may draw everyone except themselves and their exclusions, so a set of givers can reach
+    every receiver except those excluded for all of them at once.
+    """
+    def violates(candidate):
+        if not candidate:
+            return False
+        shut_out = set.intersection(*({giver, *blocked.excluded(giver)} for giver in candidate))
+        return n - len(shut_out) < len(candidate)
+
+    minimal = list(givers)
+    for giver in list(givers):
+        candidate = [g for g in minimal if g != giver]
+        if violates(candidate):
+            minimal = candidate
+    return minimal
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Iterable, Sequence, Tuple
 
 import json
 from pathlib import Path
@@ -7,15 +7,20 @@ import base64
 from datetime import datetime
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from googleapiclient.errors import HttpError
 
 from src.constants import (
     HTML_CONTENT,
+    HTML_DRAW_LINE,
+    HTML_DRAW_SEPARATOR,
+    MESSAGE_DRAW_LINE,
     MESSAGE_TEMPLATE,
+    ROUND_LABELS,
+    ROUNDS,
     GoogleAuthConstants,
     REGULAR,
     GAG
 )
+from src.constraints import ForbiddenPairs, NameIndex
 
 from logging import getLogger
 
@@ -28,89 +33,101 @@ class YearAllocator:
 
 
 class SantasMemory:
-
-    def __init__(self, cached_results: dict, memory_length: int = 3):
-        years_to_load = [str(YearAllocator.YEAR - i) for i in range(1, memory_length + 1)]
-        
-        past_regular_gift_assignments = {}
-        past_gag_gift_assignments = {}
-        
-        for year in years_to_load:
-            years_assignment: dict = cached_results.get(year)
-
-            if years_assignment is not None:
-                regular_assignment = years_assignment.get(REGULAR)
-                for gift_giver in regular_assignment:
-                    gift_receiver = regular_assignment[gift_giver]
-                    past_regular_gift_assignments[gift_giver] = past_regular_gift_assignments.get(gift_giver, set())
-                    past_regular_gift_assignments[gift_giver].add(gift_receiver)
-
-                gag_assignment = years_assignment.get(GAG, [])
-                for gift_giver in gag_assignment:
-                    gift_receiver = gag_assignment[gift_giver]
-                    past_gag_gift_assignments[gift_giver] = past_gag_gift_assignments.get(gift_giver, set())
-                    past_gag_gift_assignments[gift_giver].add(gift_receiver)
-
-        self.past_regular_gift_assignments = past_regular_gift_assignments
-        self.past_gag_gift_assignments = past_gag_gift_assignments
-
-    def get_past_regular_gift_recievers(self, participants_name: str) -> set:
-        return self.past_regular_gift_assignments.get(participants_name, set())
-
-    def get_past_gag_gift_recievers(self, participants_name: str) -> set:
-        return self.past_gag_gift_assignments.get(participants_name, set())
-
-
-def save_results_to_cache(prior_year_results: Dict, results: Dict, cache_file_path: Path) -> None:
     """
-    Save the results dictionary to a JSON file.
+    The assignments from the last ``memory_length`` years, compiled once into integer indexed form.
 
-    This function takes a dictionary of results and saves it to the specified 
-    file path in JSON format. If the file already exists, it will be overwritten.
+    Names are interned to integer IDs in a shared ``NameIndex`` and every round's past pairs are
+    stored as CSR adjacency (``ForbiddenPairs``), so building the exclusions for a draw is a row
+    slice per giver rather than a set difference over names.
 
     Args:
-        results (Dict): The dictionary containing the results to be cached.
-        cache_file_path (Path): The file path where the results will be saved.
-
-    Returns:
-        None
-
-    Example:
-        results = {"status": "success", "data": [1, 2, 3]}
-        save_results_to_cache(results, Path("/path/to/cache.json"))
+        cached_results (dict): The prior years' results, keyed by year.
+        memory_length (int, optional): How many prior years to remember. Defaults to 3.
+        name_index (NameIndex, optional): The index to intern names into. Pass one seeded with this
+            year's participants so their IDs match their roster positions.
+        rounds (Iterable[str], optional): The rounds to remember, each with its own history.
+            Defaults to ``ROUNDS`` (regular and gag).
+        rules (ExclusionRules, optional): House rules that apply every year. They are compiled once
+            for the roster and added to every round's exclusions.
     """
-    prior_year_results[YearAllocator.YEAR] = results
 
-    with open(cache_file_path, 'w') as file:
-        json.dump(prior_year_results, file, indent=4)
+    ROUNDS = ROUNDS
 
+    def __init__(
+        self,
+        cached_results: dict,
+        memory_length: int = 3,
+        name_index: NameIndex = None,
+        rounds: Iterable[str] = None,
+        rules=None,
+    ):
+        years_to_load = [str(YearAllocator.YEAR - i) for i in range(1, memory_length + 1)]
 
-def load_results_from_cache(cache_file_path: Path) -> Dict:
-    """
-    Load the prior year results from the specified JSON file, if it exists.
+        self.memory_length = memory_length
+        self.rounds = tuple(rounds) if rounds is not None else self.ROUNDS
+        self.rules = rules
+        self._compiled_rules = None
+        self._compiled_pairs = {}
+        self.name_index = name_index if name_index is not None else NameIndex()
+        intern = self.name_index.intern
 
-    This function attempts to load results from a JSON file at the given file path. 
-    If the file exists, it logs the event and returns the results as a dictionary. 
-    If the file does not exist, an empty dictionary is returned.
+        past_edges = {round_name: [] for round_name in self.rounds}
+        for year in years_to_load:
+            years_assignment: dict = cached_results.get(year)
 
-    Args:
-        cache_file_path (Path): The file path where the cached results are stored.
+            if years_assignment is not None:
+                for round_name in self.rounds:
+                    round_assignment = years_assignment.get(round_name) or {}
+                    round_edges = past_edges[round_name]
+                    for gift_giver, gift_receiver in round_assignment.items():
+                        round_edges.append((intern(gift_giver), intern(gift_receiver), int(year)))
+
+        self.past_assignments = {
+            round_name: ForbiddenPairs.from_edges(len(self.name_index), edges)
+            for round_name, edges in past_edges.items()
+        }
+
+    def forbidden_pairs(self, round_name: str, names: Sequence[str]) -> ForbiddenPairs:
+        """
+        Return the round's past pairs between ``names``, indexed by position in ``names``.
+
+        Args:
+            round_name (str): The round to look up, e.g. ``REGULAR`` or ``GAG``.
+            names (Sequence[str]): This year's participants, in draw order.
+
+        Returns:
+            ForbiddenPairs: Row ``i`` holds the positions participant ``i`` drew in the remembered years,
+                plus the positions the rules forbid (with year 0).
+        """
+        # Compiled once per round and roster, so the draw and the validation of its result share the work
+        names = tuple(names)
+        compiled = self._compiled_pairs.get(round_name)
+        if compiled is None or compiled[0] != names:
+            pairs = self.past_assignments[round_name].restrict([self.name_index.get(name) for name in names])
+            if self.rules:
+                pairs = pairs.union(self.rule_pairs(names))
+            compiled = self._compiled_pairs[round_name] = (names, pairs)
+        return compiled[1]
+
+    def rule_pairs(self, names: Sequence[str]) -> ForbiddenPairs:
+        """Return the pairs the rules forbid between ``names``, compiled once per roster."""
+        names = tuple(names)
+        if self._compiled_rules is None or self._compiled_rules[0] != names:
+            self._compiled_rules = (names, self.rules.compile(names))
+        return self._compiled_rules[1]
+
+    def get_past_recievers(self, round_name: str, participants_name: str) -> set:
+        name_id = self.name_index.get(participants_name)
+        if name_id is None:
+            return set()
+        names = self.name_index.names
+        return {names[receiver] for receiver in self.past_assignments[round_name][name_id]}
 
-    Returns:
-        Dict: A dictionary containing the cached results, or an empty dictionary if the file does not exist.
+    def get_past_regular_gift_recievers(self, participants_name: str) -> set:
+        return self.get_past_recievers(REGULAR, participants_name)
 
-    Example:
-        results = load_results_from_cache(Path("/path/to/cache.json"))
-    
-    Logs:
-        - Info level log is generated if the file exists or not.
-    """
-    if cache_file_path.exists():
-        logger.info("JSON from prior year exists. Loading...")
-        return load_info_from_json(json_path=cache_file_path)
-    
-    logger.info("No prior year results")
-    return {}
+    def get_past_gag_gift_recievers(self, participants_name: str) -> set:
+        return self.get_past_recievers(GAG, participants_name)
 
 
 def load_info_from_json(json_path: Path) -> Dict:
@@ -137,18 +154,51 @@ def load_info_from_json(json_path: Path) -> Dict:
         return json.load(file)
 
 
-def create_html_content(name: str, gift_name: str, gag_name: str, gif_url: str = None) -> str:
+def create_img_block(gif_url: str = None) -> str:
+    """Return the HTML ``<img>`` block for the GIF, or an empty string if there is no GIF."""
+    return f'<p><img src="{gif_url}" alt="Christmas GIF" width="480" height="269"></p>' if gif_url else ""
+
+
+def round_label(round_name: str) -> str:
+    """Return how a round is named in the emails, e.g. ``'Gag Gift'`` for ``'gag'``."""
+    label = ROUND_LABELS.get(round_name)
+    if label is None:
+        label = round_name.replace("-", " ").replace("_", " ").title() + " Gift"
+    return label
+
+
+def format_draws(draws: Dict[str, str]) -> Tuple[str, str]:
     """
-    Create and return an HTML content string using the provided name, gift, gag, and optional GIF URL.
+    Render the ``{draws}`` block of the text and HTML templates.
+
+    Args:
+        draws (Dict[str, str]): The name drawn in each round, in round order.
+
+    Returns:
+        Tuple[str, str]: The plain text and the HTML block.
+    """
+    text = "".join(
+        MESSAGE_DRAW_LINE.format(label=round_label(round_name), receiver=receiver)
+        for round_name, receiver in draws.items()
+    )
+    html = HTML_DRAW_SEPARATOR.join(
+        HTML_DRAW_LINE.format(label=round_label(round_name), receiver=receiver)
+        for round_name, receiver in draws.items()
+    )
+    return text, html
+
+
+def create_html_content(name: str, draws: Dict[str, str], gif_url: str = None) -> str:
+    """
+    Create and return an HTML content string using the provided name, draws, and optional GIF URL.
 
     This function generates an HTML content string by formatting predefined HTML with the provided
-    name, gift name, gag gift name, and an optional GIF image URL. If the GIF URL is provided, an 
+    name, the name drawn in each round and an optional GIF image URL. If the GIF URL is provided, an
     image block will be included in the HTML; otherwise, no image will be included.
 
     Args:
         name (str): The recipient's name to be included in the HTML content.
-        gift_name (str): The name of the primary gift.
-        gag_name (str): The name of the gag gift.
+        draws (Dict[str, str]): The name drawn in each round, e.g. ``{'regular': 'Fiona', 'gag': 'Donkey'}``.
         gif_url (str, optional): The URL for a GIF image to be embedded in the HTML content. 
                                  Defaults to None.
 
@@ -158,20 +208,83 @@ def create_html_content(name: str, gift_name: str, gag_name: str, gif_url: str =
     Example:
         html = create_html_content(
             name="John", 
-            gift_name="Smartwatch", 
-            gag_name="Rubber Chicken", 
+            draws={"regular": "Fiona", "gag": "Donkey"},
             gif_url="https://example.com/image.gif"
         )
     """
-    img_block = f'<p><img src="{gif_url}" alt="Christmas GIF" width="480" height="269"></p>' if gif_url else ""
+    img_block = create_img_block(gif_url)
     
     html_content = HTML_CONTENT.format(
-        name=name, gift_name=gift_name, gag_name=gag_name, img_block=img_block
+        name=name, draws=format_draws(draws)[1], img_block=img_block
     )
     
     return html_content
 
 
+def iter_assignments(secret_santa_results: Dict):
+    """
+    Yield ``(name, draws)`` for every giver in a draw, where ``draws`` maps each round to the name drawn.
+
+    Args:
+        secret_santa_results (Dict): ``{round: {giver: receiver}}``, e.g. ``{'regular': {...}, 'gag': {...}}``
+
+    Example:
+        for name, draws in iter_assignments(results):
+            ...
+    """
+    rounds = list(secret_santa_results.items())
+    if not rounds:
+        return
+    for name in rounds[0][1]:
+        yield name, {round_name: round_assignment.get(name) for round_name, round_assignment in rounds}
+
+
+def create_email_message(
+    name: str, to_email: str, draws: Dict[str, str], gif_url: str = None, year: int = None
+) -> MIMEMultipart:
+    """
+    Create the multipart (plain text + HTML) Secret Santa email for one participant.
+
+    Args:
+        name (str): The recipient's name.
+        to_email (str): The recipient's email address.
+        draws (Dict[str, str]): The name drawn in each round, in round order.
+        gif_url (str, optional): The URL of a GIF to embed in the HTML version. Defaults to None.
+        year (int, optional): The year shown in the subject. Defaults to the current year.
+
+    Returns:
+        MIMEMultipart: The email message.
+    """
+    year = year if year is not None else datetime.now().year
+
+    # Create a multipart email message (HTML + Text)
+    message = MIMEMultipart("alternative")
+
+    # Text version (for non-HTML clients)
+    text_content = MESSAGE_TEMPLATE.format(
+        name=name, draws=format_draws(draws)[0]
+    )
+
+    # HTML version with embedded GIF
+    html_content = create_html_content(
+        name=name, draws=draws, gif_url=gif_url
+    )
+
+    # Attach both plain text and HTML content
+    message.attach(MIMEText(text_content, "plain"))
+    message.attach(MIMEText(html_content, "html"))
+
+    message["To"] = to_email
+    message["Subject"] = f"SECRET EMAIL for SECRET SANTA! ({year})"
+
+    return message
+
+
+def encode_message(message: MIMEMultipart) -> str:
+    """Encode a message as the URL safe base64 ``raw`` payload the Gmail API expects."""
+    return base64.urlsafe_b64encode(message.as_bytes()).decode()
+
+
 def gmail_send_messages(service, participants, secret_santa_results, gif_url: str = None) -> None:
     """
     Create and send an email message with an embedded GIF to participants of Secret Santa.
@@ -183,8 +296,7 @@ def gmail_send_messages(service, participants, secret_santa_results, gif_url: st
     Args:
         service: The Gmail API service instance used to send the email.
         participants (Dict[str, str]): A dictionary mapping participant names to their email addresses.
-        secret_santa_results (Dict[str, Tuple[str, str]]): A dictionary containing the participant's name 
-            as the key and a tuple of gift name and gag gift name as the value.
+        secret_santa_results (Dict[str, Dict[str, str]]): The draw, ``{round: {giver: receiver}}``.
         gif_url (str, optional): The URL of a GIF image to be embedded in the HTML version of the email. 
                                  Defaults to None.
 
@@ -201,34 +313,17 @@ def gmail_send_messages(service, participants, secret_santa_results, gif_url: st
         - Info level log for each successfully sent email (including the message ID and recipient email).
         - Error level log if sending the email fails for any recipient.
     """
+    # Imported here so the draw does not pay for loading the Google client
+    from googleapiclient.errors import HttpError
+
     the_year = datetime.now().year
-    for name, (gift_name, gag_name) in secret_santa_results.items():
+    for name, draws in iter_assignments(secret_santa_results):
         to_email = participants[name]
         try:
-            # Create a multipart email message (HTML + Text)
-            message = MIMEMultipart("alternative")
-
-            # Text version (for non-HTML clients)
-            text_content = MESSAGE_TEMPLATE.format(
-                name=name, gift_name=gift_name, gag_name=gag_name
-            )
-
-            # HTML version with embedded GIF
-            html_content = create_html_content(
-                name=name, gift_name=gift_name, gag_name=gag_name, gif_url=gif_url
-            )
-
-            # Attach both plain text and HTML content
-            message.attach(MIMEText(text_content, "plain"))
-            message.attach(MIMEText(html_content, "html"))
-
-            message["To"] = to_email
-            message["Subject"] = f"SECRET EMAIL for SECRET SANTA! ({the_year})"
+            message = create_email_message(name, to_email, draws, gif_url, the_year)
 
             # Encode the message in base64 for Gmail API
-            encoded_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-
-            create_message = {"raw": encoded_message}
+            create_message = {"raw": encode_message(message)}
 
             # Send the email message via the Gmail API
             send_message = (
@@ -0,0 +1,152 @@
+"""Year partitioned store for prior years' Secret Santa results"""
+
+from typing import Dict, Iterable, Optional
+
+import sqlite3
+from pathlib import Path
+
+from src.helpers import YearAllocator, load_info_from_json
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assignments (
+    year INTEGER NOT NULL,
+    round TEXT NOT NULL,
+    giver TEXT NOT NULL,
+    receiver TEXT NOT NULL,
+    PRIMARY KEY (year, round, giver)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS markers (
+    name TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+# Set in the same transaction as the import, so it exists only once every legacy year is in the table
+LEGACY_JSON_MIGRATED = "legacy_json_migrated"
+
+
+class HistoryStore:
+    """
+    Prior years' results kept in a local SQLite table, one row per (year, round, giver).
+
+    Saving a year only touches that year's rows inside a single transaction, and loading reads
+    only the requested years through the primary key index, so neither cost grows with the
+    number of years on record.
+
+    Args:
+        db_path (Path): The SQLite database file. It is created if it does not exist.
+
+    Example:
+        history = HistoryStore.open(Path("resources/santa_history.sqlite3"))
+        prior_year_results = history.load_recent(3)
+        history.save_year(2024, results)
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.connection = sqlite3.connect(self.db_path)
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def open(cls, db_path: Path, legacy_json_path: Optional[Path] = None) -> "HistoryStore":
+        """
+        Open the store, importing the legacy JSON cache if it has not been imported yet.
+
+        Args:
+            db_path (Path): The SQLite database file.
+            legacy_json_path (Path, optional): The `prior_year_santa_results.json` written by older
+                versions. It is imported once; a marker row records that the import completed.
+
+        Returns:
+            HistoryStore: The opened store.
+        """
+        store = cls(db_path)
+        legacy_pending = legacy_json_path is not None and Path(legacy_json_path).exists()
+        if legacy_pending and not store.has_marker(LEGACY_JSON_MIGRATED):
+            store.migrate_from_json(legacy_json_path)
+        return store
+
+    def migrate_from_json(self, json_path: Path) -> None:
+        """
+        Import every year from a legacy JSON cache of the form ``{year: {round: {giver: receiver}}}``.
+
+        The import runs in one transaction together with setting the ``LEGACY_JSON_MIGRATED`` marker,
+        so an interrupted import leaves neither rows nor marker behind and is simply retried on the
+        next ``open``. Years the store already holds are kept, as they may have been repaired since.
+
+        Args:
+            json_path (Path): The JSON file to import. It is left in place.
+        """
+        cached_results = load_info_from_json(json_path=json_path)
+        with self.connection:
+            stored = {year for year, in self.connection.execute("SELECT DISTINCT year FROM assignments")}
+            imported = 0
+            for year, years_assignment in cached_results.items():
+                if int(year) not in stored:
+                    self._write_year(int(year), years_assignment)
+                    imported += 1
+            self.connection.execute("INSERT OR IGNORE INTO markers (name) VALUES (?)", (LEGACY_JSON_MIGRATED,))
+        logger.info(f"Migrated {imported} years of history from {json_path} to {self.db_path}")
+
+    def has_marker(self, name: str) -> bool:
+        """Return whether the marker row ``name`` has been set."""
+        return self.connection.execute("SELECT 1 FROM markers WHERE name = ?", (name,)).fetchone() is not None
+
+    def save_year(self, year: int, results: Dict) -> None:
+        """
+        Atomically write one year's results, replacing any earlier results for that year.
+
+        Args:
+            year (int): The year the results belong to.
+            results (Dict): ``{round: {giver: receiver}}`` for that year.
+        """
+        with self.connection:
+            self._write_year(year, results)
+
+    def _write_year(self, year: int, results: Dict) -> None:
+        """Replace one year's rows inside the caller's transaction."""
+        rows = [
+            (int(year), round_name, giver, receiver)
+            for round_name, round_assignment in results.items()
+            for giver, receiver in round_assignment.items()
+        ]
+        self.connection.execute("DELETE FROM assignments WHERE year = ?", (int(year),))
+        self.connection.executemany(
+            "INSERT INTO assignments (year, round, giver, receiver) VALUES (?, ?, ?, ?)", rows
+        )
+
+    def load(self, years: Iterable[int]) -> Dict:
+        """
+        Load the results for the given years.
+
+        Args:
+            years (Iterable[int]): The years to read.
+
+        Returns:
+            Dict: ``{str(year): {round: {giver: receiver}}}`` for each year that has results, the same
+                shape as the legacy JSON cache.
+        """
+        years = [int(year) for year in years]
+        if not years:
+            return {}
+
+        placeholders = ", ".join("?" for _ in years)
+        cursor = self.connection.execute(
+            f"SELECT year, round, giver, receiver FROM assignments WHERE year IN ({placeholders})", years
+        )
+
+        results = {}
+        for year, round_name, giver, receiver in cursor:
+            results.setdefault(str(year), {}).setdefault(round_name, {})[giver] = receiver
+        return results
+
+    def load_recent(self, memory_length: int) -> Dict:
+        """Load the last ``memory_length`` years before the current one."""
+        return self.load(YearAllocator.YEAR - i for i in range(1, memory_length + 1))
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,212 @@
+"""Timing spans, counters and profiling for a run, written out as a JSON report or Prometheus textfile"""
+
+from typing import Dict, Iterator, List
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Counter names, so the draw, the delivery code and the report agree on them
+DRAW_ATTEMPTS = "draw_attempts"
+DRAW_COLLISIONS = "draw_collisions"
+EMAILS_SENT = "emails_sent"
+EMAILS_FAILED = "emails_failed"
+SEND_RETRIES = "send_retries"
+SEND_TIMEOUTS = "send_timeouts"
+HTTP_ERRORS = "http_errors"
+
+PROMETHEUS_PREFIX = "secret_santa"
+PROFILE_TOP_FUNCTIONS = 25
+
+
+class RunMetrics:
+    """
+    Collects how long each phase of a run took and how often things happened during it.
+
+    Spans nest: a span opened inside another is recorded as ``outer/inner``, so the report shows
+    both the phase totals and where inside a phase the time went. Counters are plain integers
+    keyed by name. Both are safe to update from worker threads.
+
+    Args:
+        clock (Callable[[], float], optional): Returns the current time in seconds. Defaults to
+            ``time.perf_counter``.
+
+    Example:
+        with METRICS.span("draw"):
+            results = generate_secret_santa_results(...)
+        METRICS.count(DRAW_ATTEMPTS)
+        METRICS.write_report(Path("resources/run_report.json"))
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget every span and counter and restart the run clock."""
+        with self._lock:
+            self.started = self.clock()
+            self.started_at = datetime.now(timezone.utc)
+            self.spans: List[Dict] = []
+            self.counters: Dict[str, int] = defaultdict(int)
+            self.details: Dict = {}
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as the phase ``name``, even if it raises."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(name)
+        path = "/".join(stack)
+        started = self.clock()
+        try:
+            yield
+        finally:
+            seconds = self.clock() - started
+            stack.pop()
+            with self._lock:
+                self.spans.append({"name": path, "start": started - self.started, "seconds": seconds})
+            logger.debug(f"{path} took {seconds * 1000:.1f} ms")
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add ``amount`` to the counter ``name``."""
+        with self._lock:
+            self.counters[name] += amount
+
+    def annotate(self, **details) -> None:
+        """Record facts about the run, such as the draw's seed, in the report."""
+        with self._lock:
+            self.details.update(details)
+
+    def phase_seconds(self) -> Dict[str, float]:
+        """Return the total time spent in each phase, summed over repeated spans of the same name."""
+        totals: Dict[str, float] = defaultdict(float)
+        with self._lock:
+            for span in self.spans:
+                totals[span["name"]] += span["seconds"]
+        return dict(totals)
+
+    def report(self, **extra) -> Dict:
+        """
+        Build the run report.
+
+        Args:
+            **extra: Additional top level fields, such as the outcome or the options used.
+
+        Returns:
+            Dict: The start time, total duration, anything recorded with ``annotate``, per-phase
+                totals, every span in the order it finished, and the counters.
+        """
+        phases = self.phase_seconds()
+        with self._lock:
+            return {
+                "started_at": self.started_at.isoformat(),
+                "duration_seconds": self.clock() - self.started,
+                **self.details,
+                **extra,
+                "phases": phases,
+                "spans": list(self.spans),
+                "counters": dict(self.counters),
+            }
+
+    def write_report(self, path: Path, **extra) -> Dict:
+        """Write ``report(**extra)`` to ``path`` as JSON and return it."""
+        report = self.report(**extra)
+        _write_atomically(Path(path), json.dumps(report, indent=4, default=str))
+        logger.info(f"Wrote the run report to {path}")
+        return report
+
+    def write_prometheus(self, path: Path, success: bool) -> None:
+        """
+        Write the run as a Prometheus textfile, for node_exporter's textfile collector.
+
+        The file holds gauges describing the last run only: its phase durations, its counters, when
+        it finished and whether it succeeded. It is replaced atomically so a scrape never reads a
+        half written file.
+
+        Args:
+            path (Path): The ``.prom`` file to write.
+            success (bool): Whether the run succeeded.
+        """
+        report = self.report()
+        lines = [
+            f"# HELP {PROMETHEUS_PREFIX}_phase_seconds Wall time of each phase of the last run.",
+            f"# TYPE {PROMETHEUS_PREFIX}_phase_seconds gauge",
+        ]
+        for phase, seconds in sorted(report["phases"].items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_phase_seconds{{phase="{_escape_label(phase)}"}} {seconds:.6f}')
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f"# HELP {PROMETHEUS_PREFIX}_{name} The last run's {name.replace('_', ' ')}.")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{name} gauge")
+            lines.append(f"{PROMETHEUS_PREFIX}_{name} {value}")
+        lines.extend([
+            f"# HELP {PROMETHEUS_PREFIX}_last_run_duration_seconds Wall time of the last run.",
+            f"# TYPE {PROMETHEUS_PREFIX}_last_run_duration_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_last_run_duration_seconds {report['duration_seconds']:.6f}",
+            f"# HELP {PROMETHEUS_PREFIX}_last_run_timestamp_seconds When the last run finished.",
+            f"# TYPE {PROMETHEUS_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds {time.time():.0f}",
+            f"# HELP {PROMETHEUS_PREFIX}_last_run_success Whether the last run succeeded.",
+            f"# TYPE {PROMETHEUS_PREFIX}_last_run_success gauge",
+            f"{PROMETHEUS_PREFIX}_last_run_success {int(success)}",
+        ])
+        _write_atomically(Path(path), "\n".join(lines) + "\n")
+        logger.info(f"Wrote the Prometheus metrics to {path}")
+
+
+# The run's metrics, shared by every module so deep code can count events without threading an object through
+METRICS = RunMetrics()
+
+
+@contextmanager
+def profiled(path: Path) -> Iterator[cProfile.Profile]:
+    """
+    Profile the enclosed block with cProfile, save the stats to ``path`` and log the slowest functions.
+
+    The saved stats can be explored with ``python -m pstats`` or a viewer such as snakeviz.
+
+    Args:
+        path (Path): Where to write the profile.
+
+    Example:
+        with profiled(Path("resources/run_profile.prof")):
+            run(args)
+    """
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        profile.dump_stats(str(path))
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+        logger.info(f"Wrote the profile to {path}. Slowest functions by cumulative time:\n{summary.getvalue()}")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomically(path: Path, content: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f".{path.name}.tmp")
+    temporary_path.write_text(content)
+    os.replace(temporary_path, path)
@@ -0,0 +1,174 @@
+"""Durable per-run journal of the draw and of each recipient's send state"""
+
+from typing import Dict, List, Optional
+
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+
+from src.delivery import DeliveryResult, SENT
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+PENDING = "pending"
+UNCHANGED = "unchanged"  # Kept their assignment in a repaired draw, so their earlier email still holds
+
+DRAW_RECORD = "draw"
+SEND_RECORD = "send"
+COMPLETE_RECORD = "complete"
+SUPERSEDED_RECORD = "superseded"  # Replaced by a newer draw of the same year before anything was sent
+
+
+class SendJournal:
+    """
+    An append-only JSON lines journal for one run.
+
+    The first record holds the draw and the participants' email addresses; every later record is
+    a recipient's send outcome, flushed and fsynced as soon as it is known. Replaying the file
+    gives each recipient's latest state (pending, sent or failed), so a crashed or partially
+    failed run can be resumed without a new draw and without resending delivered emails.
+
+    Example:
+        journal = SendJournal.create(journal_dir, year, secret_santa_results, participants)
+        gmail_send_batched(service, messages, on_result=journal.record)
+        journal = SendJournal.latest_unfinished(journal_dir)  # on the next run
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.year: Optional[int] = None
+        self.seed: Optional[int] = None
+        self.results: Dict = {}
+        self.participants: Dict[str, str] = {}
+        self.states: Dict[str, Dict] = {}
+        self.complete = False
+        self.superseded = False
+        self._ends_mid_line = False
+        if self.path.exists():
+            self._replay()
+
+    @classmethod
+    def create(
+        cls, directory: Path, year: int, results: Dict, participants: Dict, pending: List[str] = None,
+        seed: int = None
+    ) -> "SendJournal":
+        """
+        Start a new journal for a fresh draw.
+
+        Args:
+            directory (Path): The directory holding the journals. Created if missing.
+            year (int): The year of the draw.
+            results (Dict): The draw, ``{round: {giver: receiver}}``.
+            participants (Dict[str, str]): A dictionary mapping participant names to their email addresses.
+            pending (List[str], optional): The givers who need an email. Defaults to every giver; the
+                others are recorded as unchanged, as after a repair.
+            seed (int, optional): The seed the draw was made with, recorded so it can be replayed.
+
+        Returns:
+            SendJournal: The new journal.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        journal = cls(Path(directory, f"run-{datetime.now():%Y%m%dT%H%M%S%f}.jsonl"))
+        givers = {name: participants[name] for name in next(iter(results.values()), {})}
+        record = {"type": DRAW_RECORD, "year": year, "results": results, "participants": givers}
+        if pending is not None:
+            record["pending"] = list(pending)
+        if seed is not None:
+            record["seed"] = seed
+        journal._append(record)
+        journal._apply_draw(year, results, givers, pending, seed)
+        return journal
+
+    @classmethod
+    def latest_unfinished(cls, directory: Path) -> Optional["SendJournal"]:
+        """Return the most recent journal that was neither completed nor superseded, or None."""
+        directory = Path(directory)
+        if not directory.exists():
+            return None
+        for path in sorted(directory.glob("run-*.jsonl"), reverse=True):
+            journal = cls(path)
+            if not journal.complete and not journal.superseded:
+                return journal
+        return None
+
+    @classmethod
+    def for_year(cls, directory: Path, year: int) -> List["SendJournal"]:
+        """Return every journal of a year's draws, oldest first."""
+        return [journal for journal in cls.all(directory) if journal.year == year]
+
+    @classmethod
+    def all(cls, directory: Path) -> List["SendJournal"]:
+        """Return every journal in ``directory``, oldest first."""
+        directory = Path(directory)
+        if not directory.exists():
+            return []
+        return [cls(path) for path in sorted(directory.glob("run-*.jsonl"))]
+
+    def record(self, result: DeliveryResult) -> None:
+        """Durably record one recipient's send outcome."""
+        state = {"status": result.status, "message_id": result.message_id, "error": result.error}
+        self._append({"type": SEND_RECORD, "name": result.name, **state})
+        self.states[result.name] = state
+
+    def mark_complete(self) -> None:
+        self._append({"type": COMPLETE_RECORD})
+        self.complete = True
+
+    def mark_superseded(self) -> None:
+        """Record that a newer draw replaced this one, so ``latest_unfinished`` never resumes it."""
+        self._append({"type": SUPERSEDED_RECORD})
+        self.superseded = True
+
+    def any_sent(self) -> bool:
+        """Return whether any email of this draw went out."""
+        return any(state["status"] == SENT for state in self.states.values())
+
+    def unfinished(self) -> List[str]:
+        """Return the givers whose email has not been sent yet (pending or failed)."""
+        return [name for name, state in self.states.items() if state["status"] not in (SENT, UNCHANGED)]
+
+    def _apply_draw(self, year, results, participants, pending=None, seed=None) -> None:
+        self.year = year
+        self.seed = seed
+        self.results = results
+        self.participants = participants
+        pending = set(pending) if pending is not None else participants
+        self.states = {
+            name: {"status": PENDING if name in pending else UNCHANGED, "message_id": None, "error": None}
+            for name in participants
+        }
+
+    def _replay(self) -> None:
+        with open(self.path, "r") as file:
+            for line in file:
+                self._ends_mid_line = not line.endswith("\n")
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave the last line half written
+                    logger.warning(f"Ignoring a truncated record in {self.path}")
+                    continue
+                if record["type"] == DRAW_RECORD:
+                    self._apply_draw(record["year"], record["results"], record["participants"], record.get("pending"), record.get("seed"))
+                elif record["type"] == SEND_RECORD:
+                    self.states[record["name"]] = {
+                        "status": record["status"], "message_id": record["message_id"], "error": record["error"]
+                    }
+                elif record["type"] == COMPLETE_RECORD:
+                    self.complete = True
+                elif record["type"] == SUPERSEDED_RECORD:
+                    self.superseded = True
+
+    def _append(self, record: Dict) -> None:
+        with open(self.path, "a") as file:
+            if self._ends_mid_line:
+                # Start after the half written line left by a crash instead of extending it
+                file.write("\n")
+                self._ends_mid_line = False
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
@@ -0,0 +1,281 @@
+"""Randomized bipartite matching engine used to draw Secret Santa assignments"""
+
+from typing import Container, List, Optional, Sequence
+from collections import deque
+
+import math
+import random
+
+from src.constraints import AllowList
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Rejection sampling gives up after this many receiver picks per giver (and at least the minimum)
+UNIFORM_SAMPLE_PICKS_PER_GIVER = 32
+UNIFORM_SAMPLE_MIN_PICKS = 10000
+
+
+class NoValidDrawError(RuntimeError):
+    """
+    Raised when the constraints leave no valid assignment at all.
+
+    Attributes:
+        blocking_givers (list): The givers that cannot all be matched at the same time. Every
+            receiver they are allowed to draw is already claimed by another giver in this list.
+        reachable_receivers (list): The receivers the blocking givers are allowed to draw.
+    """
+
+    def __init__(self, message: str, blocking_givers: Sequence = (), reachable_receivers: Sequence = ()):
+        super().__init__(message)
+        self.blocking_givers = list(blocking_givers)
+        self.reachable_receivers = list(reachable_receivers)
+
+
+def solve_assignment(
+    n: int,
+    blocked: Sequence[Container[int]],
+    rng=None,
+    initial: Optional[Sequence[Optional[int]]] = None,
+    partial: bool = False,
+) -> List[int]:
+    """
+    Assign every giver ``0..n-1`` a distinct receiver ``0..n-1`` while avoiding forbidden pairs.
+
+    The draw is treated as a perfect matching in the bipartite graph of allowed (giver, receiver)
+    pairs. Self pairs are always forbidden, so the result is a derangement.
+
+    Without ``initial`` the assignment is first drawn by ``sample_assignment``, which makes every
+    valid assignment equally likely. Only when valid assignments are too rare a fraction of all
+    permutations for that (very tight history or house rules) does the engine fall back to
+    repairing a random start. The fallback always finds an assignment if one exists, but it is not
+    uniform: assignments close to many random starts come up more often than others.
+
+    The repair starts from a random permutation (or from ``initial``; see ``_random_initial``), drops every pair that breaks a constraint and then
+    repairs each unmatched giver with a shortest augmenting path. The allowed graph is never built:
+    the breadth-first search walks the complement of the (small) forbidden sets, touching each
+    receiver at most once per search. With a handful of exclusions per giver only a few givers
+    need repairing, so a draw costs roughly O(n + number of forbidden pairs). A giver whose row is
+    an ``AllowList`` only has their allowed receivers scanned.
+
+    Args:
+        n (int): The number of participants.
+        blocked (Sequence[Container[int]]): ``blocked[g]`` holds the receivers giver ``g`` may not draw.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+        initial (Sequence[Optional[int]], optional): A partial assignment to keep where it is still
+            valid. Givers mapped to ``None`` (or to a forbidden or already taken receiver) are redrawn.
+        partial (bool, optional): Leave givers that cannot be matched as ``None`` instead of raising,
+            which gives a maximum matching. Defaults to False.
+
+    Returns:
+        List[int]: ``result[g]`` is the receiver drawn by giver ``g``.
+
+    Raises:
+        NoValidDrawError: If no assignment satisfies the constraints. The error names the
+            blocking givers (a set violating Hall's condition).
+
+    Example:
+        solve_assignment(3, [set(), set(), {0}])  # e.g. [2, 0, 1]
+    """
+    rng = rng if rng is not None else random
+
+    giver_to_receiver: List[Optional[int]] = [None] * n
+    receiver_to_giver: List[Optional[int]] = [None] * n
+
+    if initial is None:
+        sampled = sample_assignment(n, blocked, rng)
+        if sampled is not None:
+            return sampled
+        logger.debug(f"Valid draws are too rare to sample uniformly; repairing a random start for {n} givers")
+        initial = _random_initial(n, blocked, rng)
+
+    unmatched = []
+    for giver, receiver in enumerate(initial):
+        if (
+            receiver is None
+            or receiver == giver
+            or receiver in blocked[giver]
+            or receiver_to_giver[receiver] is not None
+        ):
+            unmatched.append(giver)
+            continue
+        giver_to_receiver[giver] = receiver
+        receiver_to_giver[receiver] = giver
+
+    # Randomize the repair order so ties are not always broken the same way. Each search scans the
+    # receivers from a random point of one shuffled order, rather than paying for a shuffle per giver
+    rng.shuffle(unmatched)
+    receiver_order = list(range(n))
+    rng.shuffle(receiver_order)
+    for giver in unmatched:
+        try:
+            _augment(giver, n, blocked, giver_to_receiver, receiver_to_giver, rng, receiver_order)
+        except NoValidDrawError:
+            # A giver with no augmenting path now never gets one later, so skipping it is safe
+            if not partial:
+                raise
+
+    return giver_to_receiver
+
+
+def sample_assignment(n: int, blocked: Sequence[Container[int]], rng=None, max_picks: int = None) -> Optional[List[int]]:
+    """
+    Draw a uniformly random valid assignment by rejection sampling, or return None if that takes too long.
+
+    Receivers are dealt to the givers one at a time as in a Fisher-Yates shuffle, and the deal
+    starts over as soon as a giver is dealt themselves or someone they may not draw. A completed
+    deal is a uniform random permutation that happens to be valid, so every valid assignment is
+    equally likely. The most constrained givers are dealt first, so a doomed deal is usually given
+    up after a pick or two.
+
+    Before dealing, the chance that a random permutation is valid is estimated as the product of
+    each giver's share of allowed receivers. If the expected number of deals is beyond the budget
+    no deal is made at all.
+
+    Args:
+        n (int): The number of participants.
+        blocked (Sequence[Container[int]]): ``blocked[g]`` holds the receivers giver ``g`` may not draw.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+        max_picks (int, optional): How many receivers to deal in total before giving up. Defaults to
+            ``UNIFORM_SAMPLE_PICKS_PER_GIVER`` per giver, and at least ``UNIFORM_SAMPLE_MIN_PICKS``.
+
+    Returns:
+        Optional[List[int]]: ``result[g]`` is the receiver drawn by giver ``g``, or None if the
+            budget ran out (which does not mean no assignment exists).
+    """
+    rng = rng if rng is not None else random
+    if max_picks is None:
+        max_picks = max(UNIFORM_SAMPLE_PICKS_PER_GIVER * n, UNIFORM_SAMPLE_MIN_PICKS)
+
+    rows = [blocked[giver] for giver in range(n)]
+    allowed_counts = [_allowed_count(n, giver, row) for giver, row in enumerate(rows)]
+    if min(allowed_counts, default=1) <= 0:
+        return None
+    if -sum(math.log(count / n) for count in allowed_counts) > math.log(max_picks):
+        return None
+
+    order = sorted(range(n), key=allowed_counts.__getitem__)
+    order_rows = [rows[giver] for giver in order]
+    receivers = list(range(n))
+    assignment = [0] * n
+    uniform = rng.random
+    picks = 0
+    while picks < max_picks:
+        for position, giver in enumerate(order):
+            # Any arrangement of the undealt receivers is a fine start, so a given up deal needs no reset
+            pick = position + int(uniform() * (n - position))
+            receiver = receivers[pick]
+            if receiver == giver or receiver in order_rows[position]:
+                picks += position + 1
+                break
+            receivers[pick] = receivers[position]
+            receivers[position] = receiver
+            assignment[giver] = receiver
+        else:
+            return assignment
+    return None
+
+
+def _allowed_count(n: int, giver: int, row) -> int:
+    """Estimate how many receivers ``giver`` may draw, for ordering and budgeting ``sample_assignment``."""
+    if isinstance(row, AllowList):
+        return len(row.allowed) - (giver in row.allowed)
+    try:
+        return n - 1 - len(row)
+    except TypeError:
+        return n - 1
+
+
+def _random_initial(n: int, blocked, rng) -> List[Optional[int]]:
+    """
+    Return a random permutation to start the matching from.
+
+    When ``blocked`` has allow-lists (see ``ForbiddenPairs``), those givers are first each given a
+    random free receiver from their list and the rest of the receivers are shuffled among everyone
+    else. Otherwise nearly every such giver would start on a receiver outside their list and need
+    an augmenting path of their own.
+    """
+    allowed = getattr(blocked, "allowed", None)
+    if not allowed:
+        initial = list(range(n))
+        rng.shuffle(initial)
+        return initial
+
+    initial: List[Optional[int]] = [None] * n
+    taken = bytearray(n)
+    restricted = list(allowed)
+    rng.shuffle(restricted)
+    for giver in restricted:
+        row = blocked[giver]
+        free = [receiver for receiver in row.allowed if not taken[receiver] and receiver not in row and receiver != giver]
+        if free:
+            receiver = rng.choice(free)
+            initial[giver] = receiver
+            taken[receiver] = 1
+
+    receivers = iter(rng.sample([receiver for receiver in range(n) if not taken[receiver]], n - sum(taken)))
+    for giver in range(n):
+        if giver not in allowed:
+            initial[giver] = next(receivers)
+    return initial
+
+
+def _augment(start, n, blocked, giver_to_receiver, receiver_to_giver, rng, receiver_order) -> None:
+    """Match ``start`` along a shortest augmenting path, or raise ``NoValidDrawError``."""
+    offset = rng.randrange(n) if n else 0
+    unvisited = receiver_order[offset:] + receiver_order[:offset]
+
+    reached_from = {}
+    queue = deque([start])
+    visited_givers = [start]
+
+    while queue:
+        giver = queue.popleft()
+        forbidden = blocked[giver]
+
+        if isinstance(forbidden, AllowList):
+            # Only the allowed receivers can be reached; the full scan below skips the ones reached here
+            candidates = [
+                receiver for receiver in forbidden.allowed
+                if receiver not in reached_from and receiver != giver and receiver not in forbidden.row
+            ]
+            rng.shuffle(candidates)
+            still_unvisited = None
+        else:
+            candidates = unvisited
+            still_unvisited = []
+
+        for receiver in candidates:
+            if still_unvisited is not None and (receiver == giver or receiver in forbidden):
+                still_unvisited.append(receiver)
+                continue
+            if receiver in reached_from:
+                continue
+
+            reached_from[receiver] = giver
+            owner = receiver_to_giver[receiver]
+            if owner is None:
+                # Flip the alternating path back to the start
+                while receiver is not None:
+                    giver = reached_from[receiver]
+                    previous = giver_to_receiver[giver]
+                    giver_to_receiver[giver] = receiver
+                    receiver_to_giver[receiver] = giver
+                    receiver = previous
+                return
+
+            queue.append(owner)
+            visited_givers.append(owner)
+
+        if still_unvisited is not None:
+            unvisited = still_unvisited
+
+    # Every receiver the visited givers may draw is already held by one of them: Hall's
+    # condition fails for this set, so no perfect assignment exists.
+    raise NoValidDrawError(
+        f"No valid assignment exists: {len(visited_givers)} givers can only draw "
+        f"{len(reached_from)} receivers between them",
+        blocking_givers=visited_givers,
+        reachable_receivers=list(reached_from),
+    )
@@ -0,0 +1,295 @@
+"""Lowest-cost draw for when the history exclusions leave no valid draw at all"""
+
+from typing import Dict, List, Sequence
+from dataclasses import dataclass, field
+
+import random
+import time
+
+from src.constraints import ForbiddenPairs
+from src.helpers import YearAllocator
+from src.matching import NoValidDrawError, solve_assignment
+from src.secret_santa import assignments_to_names, iter_disjoint_rounds, search_disjoint_rounds
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+INFINITY = float("inf")
+
+
+@dataclass
+class AllowedRepeat:
+    """A pairing from the remembered years that the draw had to repeat."""
+
+    round_name: str
+    giver: str
+    receiver: str
+    years: List[int]
+    cost: float
+
+
+@dataclass
+class MinCostDraw:
+    """The lowest-cost draw and the repeats it allows."""
+
+    results: Dict
+    repeats: List[AllowedRepeat] = field(default_factory=list)
+
+    @property
+    def cost(self) -> float:
+        return sum(repeat.cost for repeat in self.repeats)
+
+    def describe(self) -> str:
+        """Render the allowed repeats as a human readable message."""
+        if not self.repeats:
+            return "The draw did not need to repeat any remembered pairing"
+        lines = [f"The draw had to repeat {len(self.repeats)} remembered pairing(s) (total cost {self.cost:g}):"]
+        for repeat in self.repeats:
+            lines.append(
+                f"    [{repeat.round_name}] {repeat.giver} -> {repeat.receiver} "
+                f"(drawn in {', '.join(map(str, repeat.years))})"
+            )
+        return "\n".join(lines)
+
+
+def min_cost_assignment(
+    n: int, costs: Sequence[Dict[int, float]], rng=None
+) -> List[int]:
+    """
+    Assign every giver a distinct receiver, minimizing the total cost of the chosen pairs.
+
+    Pairs not listed in ``costs`` cost nothing and self pairs are forbidden. Because almost every
+    pair is free, the solve starts from a maximum matching over the free pairs (found with the
+    randomized matching engine) with all dual potentials at zero, which already satisfies the
+    Hungarian algorithm's invariants. Only the givers that matching could not place are then added,
+    each with a Dijkstra-style shortest augmenting path over reduced costs. Each of those costs
+    O(n) per giver visited, so the solve stays cheap when only a few givers are over-constrained.
+
+    Args:
+        n (int): The number of participants.
+        costs (Sequence[Dict[int, float]]): ``costs[g][r]`` is the cost of giver ``g`` drawing
+            receiver ``r``. Use ``INFINITY`` for pairs that are never allowed.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+
+    Returns:
+        List[int]: ``result[g]`` is the receiver drawn by giver ``g``.
+
+    Raises:
+        NoValidDrawError: If even with every finite cost pair allowed no assignment exists.
+
+    Example:
+        min_cost_assignment(3, [{1: 5}, {}, {}])  # [2, 0, 1]: the cheapest way around 0 -> 1
+    """
+    rng = rng if rng is not None else random
+
+    giver_to_receiver = solve_assignment(n, costs, rng=rng, partial=True)
+    receiver_to_giver = [None] * n
+    for giver, receiver in enumerate(giver_to_receiver):
+        if receiver is not None:
+            receiver_to_giver[receiver] = giver
+
+    giver_potential = [0.0] * n
+    receiver_potential = [0.0] * n
+    # Scanning receivers in a random order breaks ties between equally cheap receivers at random
+    receivers = list(range(n))
+    rng.shuffle(receivers)
+
+    for start in [giver for giver in range(n) if giver_to_receiver[giver] is None]:
+        min_slack = [INFINITY] * n
+        reached_from = [-1] * n  # The receiver whose owner reached this receiver, -1 for ``start``
+        used = [False] * n
+        visited_givers = [start]
+        receiver, giver = -1, start
+
+        while True:
+            row, giver_offset = costs[giver], giver_potential[giver]
+            delta, closest = INFINITY, -1
+            for candidate in receivers:
+                if used[candidate]:
+                    continue
+                cost = INFINITY if candidate == giver else row.get(candidate, 0.0)
+                slack = cost - giver_offset - receiver_potential[candidate]
+                if slack < min_slack[candidate]:
+                    min_slack[candidate] = slack
+                    reached_from[candidate] = receiver
+                if min_slack[candidate] < delta:
+                    delta, closest = min_slack[candidate], candidate
+
+            if delta == INFINITY:
+                raise NoValidDrawError(
+                    f"No valid assignment exists: {len(visited_givers)} givers have no allowed receiver left",
+                    blocking_givers=visited_givers,
+                )
+
+            for visited in visited_givers:
+                giver_potential[visited] += delta
+            for candidate in range(n):
+                if used[candidate]:
+                    receiver_potential[candidate] -= delta
+                else:
+                    min_slack[candidate] -= delta
+
+            used[closest] = True
+            receiver = closest
+            giver = receiver_to_giver[receiver]
+            if giver is None:
+                break
+            visited_givers.append(giver)
+
+        # Flip the alternating path back to the start
+        while receiver != -1:
+            previous = reached_from[receiver]
+            giver = start if previous == -1 else receiver_to_giver[previous]
+            receiver_to_giver[receiver] = giver
+            giver_to_receiver[giver] = receiver
+            receiver = previous
+
+    return giver_to_receiver
+
+
+def repeat_costs(blocked: ForbiddenPairs, memory_length: int) -> List[Dict[int, float]]:
+    """
+    Price every remembered pairing by how recent it is.
+
+    A pairing from last year costs ``memory_length``, one from the oldest remembered year costs 1,
+    and a pairing repeated in several years costs the sum. Pairs that are not history (year 0, such
+    as another round's receiver) can never be drawn.
+
+    Args:
+        blocked (ForbiddenPairs): The round's exclusions, as returned by ``SantasMemory.forbidden_pairs``.
+        memory_length (int): The number of remembered years.
+
+    Returns:
+        List[Dict[int, float]]: ``costs[g][r]`` for every excluded pair. A giver with an allow-list
+            gets an ``_AllowListCosts`` row, which also prices everyone outside it at ``INFINITY``.
+    """
+    costs = []
+    for giver in range(blocked.num_rows):
+        row = {}
+        for slot in range(blocked.indptr[giver], blocked.indptr[giver + 1]):
+            receiver, year = blocked.indices[slot], blocked.years[slot]
+            if not year:
+                row[receiver] = INFINITY
+            else:
+                row[receiver] = row.get(receiver, 0.0) + max(memory_length - (YearAllocator.YEAR - year) + 1, 1)
+        allowed = blocked.allowed.get(giver)
+        costs.append(row if allowed is None else _AllowListCosts(allowed, row))
+    return costs
+
+
+class _AllowListCosts(dict):
+    """A cost row that prices every receiver outside ``allowed`` at ``INFINITY`` without listing them."""
+
+    def __init__(self, allowed, costs: Dict[int, float]):
+        super().__init__(costs)
+        self.allowed = allowed
+
+    def __contains__(self, receiver) -> bool:
+        return receiver not in self.allowed or super().__contains__(receiver)
+
+    def get(self, receiver, default=None):
+        return INFINITY if receiver not in self.allowed else super().get(receiver, default)
+
+
+def min_cost_secret_santa(participants, santas_memory, rng=None) -> MinCostDraw:
+    """
+    Draw every round with history repeats allowed, choosing the cheapest repeats.
+
+    Each round is solved as a min-cost assignment priced by ``repeat_costs``, so a draw without
+    repeats is returned whenever one exists, and otherwise older repeats are preferred over recent
+    ones. Nobody ever draws themselves, and no round repeats an earlier round's pairs. If the rounds
+    cannot be solved one at a time around each other, they are searched together with only the house
+    rules enforced, which still gives a valid draw but not necessarily the cheapest.
+
+    Args:
+        participants (dict): A dictionary mapping participant names to their email addresses.
+        santas_memory (SantasMemory): The memory of prior years' assignments.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+
+    Returns:
+        MinCostDraw: The draw, ``{round: {giver: receiver}}``, and the repeats it allows.
+
+    Raises:
+        NoValidDrawError: If the group is too small to draw at all.
+
+    Example:
+        draw = min_cost_secret_santa(participants, santas_memory)
+        logger.warning(draw.describe())
+    """
+    started = time.perf_counter()
+
+    names_list = list(participants.keys())
+    rounds = santas_memory.rounds
+    blocked = {round_name: santas_memory.forbidden_pairs(round_name, names_list) for round_name in rounds}
+
+    def solve_round(round_name, round_blocked):
+        return _min_cost_round(names_list, round_blocked, santas_memory.memory_length, rng)
+
+    def to_draw(assignments):
+        return MinCostDraw(
+            results=assignments_to_names(names_list, assignments),
+            repeats=[
+                repeat
+                for round_name in rounds
+                for repeat in _allowed_repeats(
+                    round_name, names_list, blocked[round_name], assignments[round_name], santas_memory.memory_length
+                )
+            ],
+        )
+
+    best = None
+    try:
+        for assignments in iter_disjoint_rounds(rounds, blocked, solve_round, rng=rng):
+            draw = to_draw(assignments)
+            if best is None or draw.cost < best.cost:
+                best = draw
+            if not draw.repeats:
+                break
+    except NoValidDrawError:
+        # The rules and the other rounds' receivers could not be kept to one round at a time. Search every
+        # round together under those alone; the draw is valid, but its repeats are not minimized
+        logger.warning("The min-cost rounds got stuck around each other; searching every round together")
+        try:
+            best = to_draw(search_disjoint_rounds(
+                len(names_list), rounds, {round_name: pairs.without_history() for round_name, pairs in blocked.items()},
+                rng=rng
+            ))
+        except NoValidDrawError as error:
+            raise NoValidDrawError(
+                str(error), blocking_givers=[names_list[i] for i in error.blocking_givers]
+            ) from error
+
+    logger.info(
+        f"Min-cost draw for {len(names_list)} participants solved in {(time.perf_counter() - started) * 1000:.1f} ms "
+        f"with {len(best.repeats)} repeats"
+    )
+    return best
+
+
+def _min_cost_round(names_list, blocked: ForbiddenPairs, memory_length: int, rng) -> List[int]:
+    try:
+        return min_cost_assignment(len(names_list), repeat_costs(blocked, memory_length), rng=rng)
+    except NoValidDrawError as error:
+        raise NoValidDrawError(
+            str(error), blocking_givers=[names_list[i] for i in error.blocking_givers]
+        ) from error
+
+
+def _allowed_repeats(
+    round_name: str, names_list, blocked: ForbiddenPairs, assignment: List[int], memory_length: int
+) -> List[AllowedRepeat]:
+    repeats = []
+    costs = None
+    for giver, receiver in enumerate(assignment):
+        if receiver not in blocked[giver]:
+            continue
+        costs = costs if costs is not None else repeat_costs(blocked, memory_length)
+        repeats.append(AllowedRepeat(
+            round_name=round_name,
+            giver=names_list[giver],
+            receiver=names_list[receiver],
+            years=blocked.years_for(giver, receiver),
+            cost=costs[giver][receiver],
+        ))
+    return repeats
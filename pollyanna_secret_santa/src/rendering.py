@@ -0,0 +1,164 @@
+"""Render Secret Santa emails from templates and MIME skeletons compiled once per run"""
+
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import base64
+import random
+import string
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email.header import Header
+from itertools import islice
+
+from src.constants import HTML_CONTENT, MESSAGE_TEMPLATE
+from src.helpers import create_img_block, format_draws, iter_assignments
+
+# Rows handed to each worker process at a time
+RENDER_CHUNK_SIZE = 1000
+
+
+class OutgoingMessage(NamedTuple):
+    """A rendered email ready to send."""
+
+    name: str
+    to_email: str
+    data: bytes  # The full MIME message
+
+    @property
+    def raw(self) -> str:
+        """The message as the URL safe base64 payload the Gmail API expects."""
+        return base64.urlsafe_b64encode(self.data).decode()
+
+
+def _compile_template(template: str, **static) -> List[Tuple[str, Optional[str]]]:
+    """
+    Split a ``str.format`` template into ``(literal, field)`` pieces, filling in ``static`` fields now.
+
+    Returns:
+        List[Tuple[str, Optional[str]]]: Pieces to join; ``field`` is None when only a literal remains.
+    """
+    pieces = []
+    literal = ""
+    for text, field_name, format_spec, conversion in string.Formatter().parse(template):
+        literal += text
+        if field_name is None:
+            continue
+        if field_name in static:
+            literal += format(static[field_name], format_spec or "")
+            continue
+        pieces.append((literal, field_name))
+        literal = ""
+    pieces.append((literal, None))
+    return pieces
+
+
+def _fill(pieces: List[Tuple[str, Optional[str]]], values: Dict[str, str]) -> str:
+    return "".join(literal + values[field] if field is not None else literal for literal, field in pieces)
+
+
+class MessageRenderer:
+    """
+    Renders every participant's email from precompiled pieces.
+
+    The text and HTML templates are split into literal and field pieces once, with the GIF block
+    filled in up front, and the MIME headers, part headers and boundary are built once as bytes.
+    Rendering a recipient only substitutes their name and draws, encodes the two bodies and joins
+    the precomputed bytes. The output matches what ``create_email_message`` produces.
+
+    Args:
+        gif_url (str, optional): The URL of a GIF to embed in the HTML version. Defaults to None.
+        year (int, optional): The year shown in the subject. Defaults to the current year.
+
+    Example:
+        renderer = MessageRenderer(gif_url=gif_url)
+        for message in renderer.render(participants, secret_santa_results):
+            ...
+    """
+
+    def __init__(self, gif_url: str = None, year: int = None):
+        year = year if year is not None else datetime.now().year
+
+        self.text_pieces = _compile_template(MESSAGE_TEMPLATE)
+        self.html_pieces = _compile_template(HTML_CONTENT, img_block=create_img_block(gif_url))
+
+        boundary = "=" * 15 + str(random.randrange(sys.maxsize)) + "=="
+        separator = f"\n--{boundary}\n".encode()
+        self.head = (
+            f'Content-Type: multipart/alternative;\n boundary="{boundary}"\n'
+            "MIME-Version: 1.0\n"
+            "To: "
+        ).encode()
+        self.subject = f"\nSubject: SECRET EMAIL for SECRET SANTA! ({year})\n".encode()
+        self.part_headers = {
+            (subtype, ascii_only): separator + (
+                f'Content-Type: text/{subtype}; charset="{"us-ascii" if ascii_only else "utf-8"}"\n'
+                "MIME-Version: 1.0\n"
+                f"Content-Transfer-Encoding: {'7bit' if ascii_only else 'base64'}\n\n"
+            ).encode()
+            for subtype in ("plain", "html")
+            for ascii_only in (True, False)
+        }
+        self.tail = f"\n--{boundary}--\n".encode()
+
+    def _part(self, subtype: str, content: str) -> bytes:
+        if content.isascii():
+            return self.part_headers[(subtype, True)] + content.encode()
+        return self.part_headers[(subtype, False)] + base64.encodebytes(content.encode())
+
+    def render_one(self, name: str, to_email: str, draws: Dict[str, str]) -> OutgoingMessage:
+        """Render one participant's email; ``draws`` maps each round to the name drawn."""
+        text_draws, html_draws = format_draws(draws)
+        to_header = to_email if to_email.isascii() else Header(to_email, "utf-8").encode()
+        data = b"".join((
+            self.head,
+            to_header.encode(),
+            self.subject,
+            self._part("plain", _fill(self.text_pieces, {"name": name, "draws": text_draws})),
+            self._part("html", _fill(self.html_pieces, {"name": name, "draws": html_draws})),
+            self.tail,
+        ))
+        return OutgoingMessage(name=name, to_email=to_email, data=data)
+
+    def render_rows(self, rows: List[Tuple[str, str, Dict[str, str]]]) -> List[OutgoingMessage]:
+        """Render a chunk of ``(name, to_email, draws)`` rows; used by worker processes."""
+        return [self.render_one(*row) for row in rows]
+
+    def render(
+        self, participants: Dict, secret_santa_results: Dict, names: Iterable[str] = None, processes: int = 0
+    ) -> Iterator[OutgoingMessage]:
+        """
+        Render every participant's email as a stream.
+
+        Args:
+            participants (Dict[str, str]): A dictionary mapping participant names to their email addresses.
+            secret_santa_results (Dict): ``{round: {giver: receiver}}``
+            names (Iterable[str], optional): Only render the emails of these givers. Defaults to everyone.
+            processes (int, optional): Render in this many worker processes, in chunks of
+                ``RENDER_CHUNK_SIZE``. Worthwhile only for very large batches. Defaults to 0 (in process).
+
+        Yields:
+            OutgoingMessage: One message per giver, in draw order.
+        """
+        names = set(names) if names is not None else None
+        rows = (
+            (name, participants[name], draws)
+            for name, draws in iter_assignments(secret_santa_results)
+            if names is None or name in names
+        )
+
+        if processes <= 1:
+            for row in rows:
+                yield self.render_one(*row)
+            return
+
+        # Keep a bounded number of chunks in flight so memory stays flat however large the batch
+        chunks = iter(lambda: list(islice(rows, RENDER_CHUNK_SIZE)), [])
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            in_flight = deque(executor.submit(self.render_rows, chunk) for chunk in islice(chunks, processes * 2))
+            while in_flight:
+                rendered = in_flight.popleft().result()
+                for chunk in islice(chunks, 1):
+                    in_flight.append(executor.submit(self.render_rows, chunk))
+                yield from rendered
@@ -0,0 +1,117 @@
+"""Repair a finished draw after participants join or drop out, changing as few pairs as possible"""
+
+from typing import Dict, List, NamedTuple, Optional
+
+import time
+
+from src.matching import NoValidDrawError
+from src.secret_santa import _named_error, _solve, assignments_to_names, iter_disjoint_rounds, search_disjoint_rounds
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class RepairResult(NamedTuple):
+    """
+    A repaired draw.
+
+    Attributes:
+        results (Dict): The repaired draw, ``{round: {giver: receiver}}``.
+        changed_givers (List[str]): Current participants whose receiver changed in any round,
+            including everyone who joined. Only they need a new email.
+        joined (List[str]): Participants who were not in the original draw.
+        left (List[str]): Givers of the original draw who are no longer participating.
+    """
+
+    results: Dict
+    changed_givers: List[str]
+    joined: List[str]
+    left: List[str]
+
+
+def repair_secret_santa_results(participants, previous_results: Dict, santas_memory, rng=None) -> RepairResult:
+    """
+    Update an existing draw for a changed roster, keeping every pair that is still valid.
+
+    Pairs whose giver or receiver left are dropped, and the givers left without a receiver (those
+    who drew someone who left, and everyone who joined) are matched with shortest augmenting paths
+    starting from the existing assignment. Each path reassigns only the givers along it, so the
+    number of changed pairs grows with the number of roster changes rather than with the group size.
+    The repaired rounds still avoid the ``SantasMemory`` exclusions and stay edge-disjoint, so nobody
+    draws the same person twice. The rounds are repaired in every rotation of their order and the
+    one changing the fewest givers is kept. If no order can be repaired one round at a time, every
+    round is searched together starting from the old draw (see ``search_disjoint_rounds``).
+
+    Args:
+        participants (dict): This year's participants after the change, mapping names to email addresses.
+        previous_results (Dict): The draw being repaired, ``{round: {giver: receiver}}``.
+        santas_memory (SantasMemory): The memory of prior years' assignments.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+
+    Returns:
+        RepairResult: The repaired draw and who needs to be emailed again.
+
+    Raises:
+        NoValidDrawError: If the changed roster cannot be drawn at all.
+
+    Example:
+        repair = repair_secret_santa_results(participants, this_years_results, santas_memory)
+        messages = build_messages(participants, repair.results, names=repair.changed_givers)
+    """
+    started = time.perf_counter()
+
+    names_list = list(participants.keys())
+    name_to_index = {name: index for index, name in enumerate(names_list)}
+    rounds = santas_memory.rounds
+    blocked = {round_name: santas_memory.forbidden_pairs(round_name, names_list) for round_name in rounds}
+    previous = {
+        round_name: _previous_assignment(previous_results.get(round_name) or {}, names_list, name_to_index)
+        for round_name in rounds
+    }
+
+    def solve_round(round_name, round_blocked):
+        return _solve(names_list, round_blocked, rng, initial=previous[round_name])
+
+    def changed_givers(assignments):
+        return [
+            index for index in range(len(names_list))
+            if any(assignments[round_name][index] != previous[round_name][index] for round_name in rounds)
+        ]
+
+    best = None
+    try:
+        for assignments in iter_disjoint_rounds(rounds, blocked, solve_round, rng=rng):
+            changed = changed_givers(assignments)
+            if best is None or len(changed) < len(best[1]):
+                best = (assignments, changed)
+    except NoValidDrawError:
+        # The rounds could not be repaired one at a time, so search them together, starting from the old draw
+        try:
+            assignments = search_disjoint_rounds(len(names_list), rounds, blocked, rng=rng, initial=previous)
+        except NoValidDrawError as error:
+            raise _named_error(names_list, error) from error
+        best = (assignments, changed_givers(assignments))
+
+    assignments, changed = best
+    previous_givers = next(iter(previous_results.values()), {})
+    repair = RepairResult(
+        results=assignments_to_names(names_list, assignments),
+        changed_givers=[names_list[index] for index in changed],
+        joined=[name for name in names_list if name not in previous_givers],
+        left=[name for name in previous_givers if name not in name_to_index],
+    )
+    logger.info(
+        f"Repaired the draw for {len(repair.joined)} joined and {len(repair.left)} left in "
+        f"{(time.perf_counter() - started) * 1000:.1f} ms: {len(repair.changed_givers)} givers changed"
+    )
+    return repair
+
+
+def _previous_assignment(round_results: Dict, names_list, name_to_index) -> List[Optional[int]]:
+    """Return ``assignment[giver]`` for the current roster, None where the old pair no longer exists."""
+    assignment = []
+    for name in names_list:
+        receiver = round_results.get(name)
+        assignment.append(name_to_index.get(receiver) if receiver is not None else None)
+    return assignment
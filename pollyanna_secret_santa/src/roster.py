@@ -0,0 +1,296 @@
+"""Stream participant rosters from JSON, NDJSON or CSV, validating them in a single pass"""
+
+from typing import Dict, Iterator, List, Mapping, TextIO, Tuple
+
+import csv
+import json
+import re
+from pathlib import Path
+
+from src.constraints import NameIndex
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+JSON = "json"
+NDJSON = "ndjson"
+CSV = "csv"
+ROSTER_FORMATS = (JSON, NDJSON, CSV)
+
+FORMAT_BY_SUFFIX = {".json": JSON, ".ndjson": NDJSON, ".jsonl": NDJSON, ".csv": CSV}
+
+# Only the first problems are kept, so a badly broken file cannot use unbounded memory
+MAX_REPORTED_PROBLEMS = 20
+
+READ_CHUNK_SIZE = 1 << 16
+NUMBER_CHARACTERS = "0123456789+-.eE"
+WHITESPACE = re.compile(r"[ \t\r\n]*")
+
+# A pragmatic check, not full RFC 5322: one @, no whitespace, and a dotted domain
+EMAIL_PATTERN = re.compile(r"[^@\s]+@[^@\s.]+(\.[^@\s.]+)+")
+
+
+class RosterValidationError(ValueError):
+    """
+    Raised when a roster has malformed rows, invalid emails or duplicates.
+
+    Attributes:
+        problems (List[str]): The first ``MAX_REPORTED_PROBLEMS`` problems, with their line or entry number.
+        problem_count (int): How many problems were found in total.
+    """
+
+    def __init__(self, path: Path, problems: List[str], problem_count: int):
+        self.problems = problems
+        self.problem_count = problem_count
+        lines = [f"{path} has {problem_count} problem(s):", *(f"  {problem}" for problem in problems)]
+        if problem_count > len(problems):
+            lines.append(f"  ... and {problem_count - len(problems)} more")
+        super().__init__("\n".join(lines))
+
+
+class Roster(Mapping):
+    """
+    This year's participants, mapping names to email addresses.
+
+    Names are interned into a ``NameIndex`` in roster order, so a participant's ID is their
+    position in the draw and the same index can be handed to ``SantasMemory`` instead of building
+    a second one. The roster only keeps the index and a list of emails, and behaves like the
+    ``{name: email}`` dict the rest of the program expects.
+
+    Args:
+        name_index (NameIndex): The index holding the participants' names as its first entries.
+        emails (List[str]): ``emails[i]`` is the address of the participant with ID ``i``.
+
+    Example:
+        participants = load_roster(Path("resources/participants.csv"))
+        santas_memory = SantasMemory(prior_year_results, name_index=participants.index)
+    """
+
+    def __init__(self, name_index: NameIndex, emails: List[str]):
+        self.index = name_index
+        self.emails = emails
+
+    def __getitem__(self, name: str) -> str:
+        name_id = self.index.get(name)
+        if name_id is None or name_id >= len(self.emails):
+            raise KeyError(name)
+        return self.emails[name_id]
+
+    def __iter__(self) -> Iterator[str]:
+        # The shared index may have grown past the roster with names that only appear in history
+        return iter(self.index.names[:len(self.emails)])
+
+    def __len__(self) -> int:
+        return len(self.emails)
+
+    def __contains__(self, name) -> bool:
+        name_id = self.index.get(name)
+        return name_id is not None and name_id < len(self.emails)
+
+    def __repr__(self) -> str:
+        return f"Roster({len(self)} participants)"
+
+
+def load_roster(path: Path, roster_format: str = None) -> Roster:
+    """
+    Stream a roster from disk, validating every row as it is read.
+
+    Supported formats:
+        - ``json``: the original ``{"name": "email", ...}`` object, parsed entry by entry.
+        - ``ndjson``: one ``{"name": ..., "email": ...}`` object per line. Blank lines are skipped.
+        - ``csv``: a header row with ``name`` and ``email`` columns.
+
+    Every email must look like an address, and no name or email (compared case-insensitively) may
+    appear twice. All problems are collected in the same pass and raised together.
+
+    Args:
+        path (Path): The roster file.
+        roster_format (str, optional): One of ``ROSTER_FORMATS``. Defaults to the format implied by
+            the file suffix.
+
+    Returns:
+        Roster: The validated participants.
+
+    Raises:
+        RosterValidationError: If any row is malformed, has an invalid email or is a duplicate.
+        ValueError: If the format cannot be determined.
+
+    Example:
+        participants = load_roster(Path("resources/participants.ndjson"))
+    """
+    path = Path(path)
+    roster_format = roster_format or FORMAT_BY_SUFFIX.get(path.suffix.lower())
+    if roster_format not in ROSTER_FORMATS:
+        raise ValueError(f"Cannot tell the roster format of {path}, expected one of {', '.join(ROSTER_FORMATS)}")
+
+    readers = {JSON: _read_json, NDJSON: _read_ndjson, CSV: _read_csv}
+    name_index = NameIndex()
+    emails: List[str] = []
+    first_seen_email: Dict[str, str] = {}
+    problems: List[str] = []
+    problem_count = 0
+
+    def problem(where: str, message: str) -> None:
+        nonlocal problem_count
+        problem_count += 1
+        if len(problems) < MAX_REPORTED_PROBLEMS:
+            problems.append(f"{where}: {message}")
+
+    # utf-8-sig also reads the byte-order mark Excel writes at the start of a UTF-8 CSV
+    with open(path, "r", newline="" if roster_format == CSV else None, encoding="utf-8-sig") as file:
+        for where, row in readers[roster_format](file):
+            if isinstance(row, str):
+                problem(where, row)
+                continue
+            name, email = row
+            if not isinstance(name, str) or not name.strip():
+                problem(where, "missing name")
+                continue
+            if not isinstance(email, str) or not EMAIL_PATTERN.fullmatch(email.strip()):
+                problem(where, f"invalid email {email!r} for {name!r}")
+                continue
+            email = email.strip()
+
+            if name in name_index:
+                problem(where, f"duplicate name {name!r}")
+                continue
+            email_key = email.lower()
+            if email_key in first_seen_email:
+                problem(where, f"{email!r} is already used by {first_seen_email[email_key]!r}")
+                continue
+
+            first_seen_email[email_key] = name
+            name_index.intern(name)
+            emails.append(email)
+
+    if problem_count:
+        raise RosterValidationError(path, problems, problem_count)
+
+    logger.info(f"Loaded {len(emails)} participants from {path}")
+    return Roster(name_index, emails)
+
+
+# Each reader yields (location, (name, email)) for a row, or (location, message) for a malformed row
+
+def _read_ndjson(file: TextIO) -> Iterator[Tuple[str, object]]:
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        where = f"line {line_number}"
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as error:
+            yield where, f"invalid JSON ({error.msg})"
+            continue
+        if not isinstance(record, dict):
+            yield where, "expected an object with name and email"
+            continue
+        yield where, (record.get("name"), record.get("email"))
+
+
+def _read_csv(file: TextIO) -> Iterator[Tuple[str, object]]:
+    reader = csv.DictReader(file)
+    columns = {column.strip().lower(): column for column in reader.fieldnames or []}
+    if "name" not in columns or "email" not in columns:
+        yield "line 1", "the header must have name and email columns"
+        return
+    name_column, email_column = columns["name"], columns["email"]
+    for row in reader:
+        yield f"line {reader.line_num}", (row.get(name_column), row.get(email_column))
+
+
+def _read_json(file: TextIO) -> Iterator[Tuple[str, object]]:
+    try:
+        for entry_number, (name, email) in enumerate(_iter_json_object(file), start=1):
+            yield f"entry {entry_number}", (name, email)
+    except json.JSONDecodeError as error:
+        yield f"character {error.pos}", f"invalid JSON ({error.msg})"
+
+
+def _iter_json_object(file: TextIO, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Tuple[str, object]]:
+    """
+    Yield the ``(key, value)`` pairs of a top level JSON object without loading the whole file.
+
+    The file is read in chunks and each key and value is decoded with ``JSONDecoder.raw_decode``
+    as soon as it is complete, so memory stays proportional to the chunk size rather than the file.
+
+    Raises:
+        json.JSONDecodeError: If the file is not a JSON object. ``pos`` is the offset in the file.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0  # Position in the buffer
+    consumed = 0  # Characters of the file dropped from the front of the buffer
+    at_eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, consumed, at_eof
+        if at_eof:
+            return False
+        chunk = file.read(chunk_size)
+        if not chunk:
+            at_eof = True
+            return False
+        buffer = buffer[position:] + chunk
+        consumed += position
+        position = 0
+        return True
+
+    def error(message: str) -> json.JSONDecodeError:
+        return json.JSONDecodeError(message, buffer, position)
+
+    def next_char() -> str:
+        """Skip whitespace and return the next character without consuming it, or "" at the end."""
+        nonlocal position
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position < len(buffer) or not fill():
+                return buffer[position:position + 1]
+
+    def expect(char: str) -> None:
+        nonlocal position
+        if next_char() != char:
+            raise json.JSONDecodeError(f"Expecting {char!r}", buffer, position)
+        position += 1
+
+    def decode():
+        nonlocal position
+        while True:
+            next_char()
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The value may just be cut off at the end of the chunk
+                if fill():
+                    continue
+                raise
+            # A number cut off at the end of the chunk (``1.5`` of ``1.5e10``) still decodes, so
+            # read on while everything after the value could be the rest of a number
+            if not buffer[end:].strip(NUMBER_CHARACTERS) and fill():
+                continue
+            position = end
+            return value
+
+    try:
+        expect("{")
+        if next_char() == "}":
+            position += 1
+            return
+        while True:
+            if next_char() != '"':
+                raise error("Expecting property name enclosed in double quotes")
+            key = decode()
+            expect(":")
+            yield key, decode()
+            separator = next_char()
+            position += 1
+            if separator == "}":
+                break
+            if separator != ",":
+                position -= 1
+                raise error("Expecting ',' delimiter")
+        if next_char():
+            raise error("Extra data")
+    except json.JSONDecodeError as decode_error:
+        raise json.JSONDecodeError(decode_error.msg, decode_error.doc, consumed + decode_error.pos) from None
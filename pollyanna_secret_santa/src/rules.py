@@ -0,0 +1,125 @@
+"""House rules about who may draw whom, compiled into forbidden pairs"""
+
+from typing import Dict, FrozenSet, List, Sequence, Tuple
+
+from pathlib import Path
+
+from src.constraints import ForbiddenPairs
+from src.helpers import load_info_from_json
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class ExclusionRules:
+    """
+    Rules that hold every year, on top of the history exclusions.
+
+    The rules file is a JSON object with any of these keys:
+
+        {
+            "households": [["Shrek", "Fiona"], ["Donkey", "Dragon"]],
+            "couples": [["Puss", "Kitty"]],
+            "never": [["Farquaad", "Fiona"]],
+            "groups": {"kids": ["Farkle", "Fergus", "Felicia"]},
+            "only_within": {"Farkle": "kids"}
+        }
+
+    Members of a household (or a couple) never draw each other, a ``never`` pair stops the first
+    person drawing the second, and a person listed in ``only_within`` only draws members of that
+    group. The rules apply to every round. ``compile`` turns them into a ``ForbiddenPairs`` for a
+    roster once, so the draw and the feasibility check treat them exactly like history exclusions.
+    ``only_within`` is compiled into an allow-list of the group rather than a pair for everyone
+    outside it, so it costs as much as the group is large. Names that are not participating this
+    year are ignored.
+
+    Args:
+        households (Sequence[Sequence[str]], optional): Groups whose members never draw each other.
+        never (Sequence[Tuple[str, str]], optional): ``(giver, receiver)`` pairs that are never drawn.
+        groups (Dict[str, Sequence[str]], optional): Named groups for ``only_within``.
+        only_within (Dict[str, str], optional): Maps a person to the only group they may draw from.
+
+    Example:
+        rules = ExclusionRules.load(Path("resources/rules.json"))
+        santas_memory = SantasMemory(prior_year_results, rules=rules)
+    """
+
+    def __init__(
+        self,
+        households: Sequence[Sequence[str]] = (),
+        never: Sequence[Tuple[str, str]] = (),
+        groups: Dict[str, Sequence[str]] = None,
+        only_within: Dict[str, str] = None,
+    ):
+        self.households = [list(household) for household in households]
+        self.never = [tuple(pair) for pair in never]
+        self.groups = {name: list(members) for name, members in (groups or {}).items()}
+        self.only_within = dict(only_within or {})
+
+        for pair in self.never:
+            if len(pair) != 2:
+                raise ValueError(f"A never rule needs exactly a giver and a receiver, got {list(pair)}")
+        for person, group in self.only_within.items():
+            if group not in self.groups:
+                raise ValueError(f"{person} may only draw within {group!r}, but there is no such group")
+
+    @classmethod
+    def from_dict(cls, rules: Dict) -> "ExclusionRules":
+        """Build the rules from the parsed rules file."""
+        unknown = set(rules) - {"households", "couples", "never", "groups", "only_within"}
+        if unknown:
+            raise ValueError(f"Unknown rule types: {', '.join(sorted(unknown))}")
+        for couple in rules.get("couples", []):
+            if len(couple) != 2:
+                raise ValueError(f"A couple must have exactly two people, got {couple}")
+        return cls(
+            households=[*rules.get("households", []), *rules.get("couples", [])],
+            never=rules.get("never", []),
+            groups=rules.get("groups"),
+            only_within=rules.get("only_within"),
+        )
+
+    @classmethod
+    def load(cls, rules_path: Path) -> "ExclusionRules":
+        """Load the rules from a JSON file."""
+        rules = cls.from_dict(load_info_from_json(rules_path))
+        logger.info(f"Loaded {len(rules)} rules from {rules_path}")
+        return rules
+
+    def __len__(self) -> int:
+        return len(self.households) + len(self.never) + len(self.only_within)
+
+    def compile(self, names: Sequence[str]) -> ForbiddenPairs:
+        """
+        Compile the rules into forbidden pairs between ``names``.
+
+        Args:
+            names (Sequence[str]): This year's participants, in draw order.
+
+        Returns:
+            ForbiddenPairs: The pairs the rules forbid, indexed by position in ``names``, with year 0
+                since they do not come from the history, and the ``only_within`` allow-lists.
+        """
+        position = {name: index for index, name in enumerate(names)}
+        edges: List[Tuple[int, int, int]] = []
+        allowed: Dict[int, FrozenSet[int]] = {}
+        group_positions: Dict[str, FrozenSet[int]] = {}
+
+        for household in self.households:
+            members = [position[name] for name in household if name in position]
+            edges.extend((giver, receiver, 0) for giver in members for receiver in members if giver != receiver)
+
+        for giver, receiver in self.never:
+            if giver in position and receiver in position:
+                edges.append((position[giver], position[receiver], 0))
+
+        for person, group in self.only_within.items():
+            giver = position.get(person)
+            if giver is None:
+                continue
+            if group not in group_positions:
+                group_positions[group] = frozenset(position[name] for name in self.groups[group] if name in position)
+            allowed[giver] = group_positions[group]
+
+        return ForbiddenPairs.from_edges(len(names), edges, allowed)
@@ -1,111 +1,504 @@
-from typing import Dict, Callable
+from typing import Dict, Callable, Iterator, List, Optional, Sequence, Tuple
 
 import random
-import copy
-
+import time
 from logging import getLogger
 
+from src.constants import REGULAR, GAG
+from src.constraints import ForbiddenPairs
+from src.instrumentation import DRAW_ATTEMPTS, DRAW_COLLISIONS, METRICS
+from src.matching import NoValidDrawError, sample_assignment, solve_assignment
+
 logger = getLogger(__name__)
 
+TOO_CONSTRAINED_MESSAGE = (
+    'You have exceeded the programs ability to pick unique candidates. Please redeuce the exclude_last_n integer or remove years from the history json'
+)
+
+# How often every round is redrawn because two rounds gave someone the same receiver, before sampling gives up
+DISJOINT_SAMPLE_RESTARTS = 100
+# How often the rounds are redrawn in a random order once every rotation got stuck
+DISJOINT_ROUND_RESTARTS = 20
+# How many pairs the search over every round together may fix before giving up
+DISJOINT_SEARCH_STEPS = 20000
+
+
+class DrawSearchGaveUp(NoValidDrawError):
+    """Raised when the search over every round together gives up before finding a draw or proving there is none."""
+
+
+def secret_santa(participants, santas_memory, get_past_recipients: Callable[[str], set], rng=None) -> Dict:
+    """
+    Draw one round of Secret Santa assignments.
 
-def secret_santa(participants, santas_memory, get_past_recipients: Callable[[str], set]) -> Dict:
+    Nobody draws themselves or anyone returned by ``get_past_recipients``. The draw is solved as a
+    randomized bipartite matching (see ``src.matching.solve_assignment``), so it only fails when no
+    valid assignment exists at all.
+
+    Args:
+        participants (dict): A dictionary mapping participant names to their email addresses.
+        santas_memory (SantasMemory): The memory of prior years' assignments.
+        get_past_recipients (Callable[[str], set]): Returns the names a participant may not draw.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+
+    Returns:
+        dict: A dictionary mapping each giver's name to the name they drew.
+
+    Raises:
+        NoValidDrawError: If the exclusions leave no valid assignment.
+    """
     names_list = list(participants.keys())
-    remaining = copy.copy(names_list)
-    result = {}
+    name_to_index = {name: index for index, name in enumerate(names_list)}
+    blocked = _blocked_indices(names_list, name_to_index, get_past_recipients)
 
-    for name in names_list:
-        available_names = {n for n in remaining if n != name}
+    assignment = _solve(names_list, blocked, rng)
+
+    return {name: names_list[receiver] for name, receiver in zip(names_list, assignment)}
+
+
+def joint_secret_santa(participants, santas_memory, rng=None) -> Dict:
+    """
+    Draw every round together as edge-disjoint assignments.
+
+    "Nobody draws the same person twice" is a constraint of one solve over every round (see
+    ``solve_disjoint_rounds``), so the draw fails only when no edge-disjoint assignments exist.
+
+    Args:
+        participants (dict): A dictionary mapping participant names to their email addresses.
+        santas_memory (SantasMemory): The memory of prior years' assignments. Its ``rounds`` are drawn.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+
+    Returns:
+        dict: ``{round: {giver: receiver}}``, e.g. ``{'regular': {...}, 'gag': {...}}``
+
+    Raises:
+        NoValidDrawError: If no set of edge-disjoint assignments exists, or the search gave up (see
+            ``search_disjoint_rounds``).
+    """
+    started = time.perf_counter()
+
+    names_list = list(participants.keys())
+    blocked = {
+        round_name: santas_memory.forbidden_pairs(round_name, names_list) for round_name in santas_memory.rounds
+    }
+    try:
+        assignments = solve_disjoint_rounds(len(names_list), santas_memory.rounds, blocked, rng)
+    except NoValidDrawError as error:
+        raise _named_error(names_list, error) from error
+
+    logger.info(
+        f"Joint draw of {len(assignments)} rounds for {len(names_list)} participants solved in "
+        f"{(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+    return assignments_to_names(names_list, assignments)
+
+
+def solve_disjoint_rounds(
+    n: int,
+    round_names: Sequence[str],
+    blocked: Dict[str, ForbiddenPairs],
+    rng=None,
+    initial: Dict[str, Sequence[Optional[int]]] = None,
+) -> Dict[str, List[int]]:
+    """
+    Draw edge-disjoint assignments for every round, uniformly when possible and exhaustively when not.
+
+    Without ``initial`` the draw is first made by ``sample_disjoint_rounds``, which makes every
+    valid draw equally likely. Groups too constrained for that are solved one round after another
+    with ``iter_disjoint_rounds``, with each round's exclusions extended by the earlier rounds'
+    receivers; that is fast but favours some draws over others. The few groups it gets stuck on are
+    handed to ``search_disjoint_rounds``, which settles whether any edge-disjoint assignments exist
+    at all.
+
+    Args:
+        n (int): The number of participants.
+        round_names (Sequence[str]): The rounds, in their preferred order.
+        blocked (Dict[str, ForbiddenPairs]): Each round's exclusions, indexed by roster position.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+        initial (Dict[str, Sequence[Optional[int]]], optional): A draw to keep as much of as
+            possible, as for ``solve_assignment``.
+
+    Returns:
+        Dict[str, List[int]]: ``assignments[round][giver]`` for every round, in ``round_names`` order.
+
+    Raises:
+        NoValidDrawError: If no edge-disjoint assignments exist, or the search gave up.
+    """
+    initial = initial or {}
+    if not initial:
+        sampled = sample_disjoint_rounds(n, round_names, blocked, rng)
+        if sampled is not None:
+            return sampled
+        logger.info(f"Valid draws of {len(round_names)} rounds are too rare to sample uniformly; solving round by round")
+
+    def solve_round(round_name, round_blocked):
+        return solve_assignment(n, round_blocked, rng=rng, initial=initial.get(round_name))
+
+    try:
+        return next(iter_disjoint_rounds(round_names, blocked, solve_round, rng=rng))
+    except NoValidDrawError:
+        logger.info(f"Solving {len(round_names)} rounds one at a time got stuck; searching every round together")
+    return search_disjoint_rounds(n, round_names, blocked, rng=rng, initial=initial)
+
+
+def sample_disjoint_rounds(
+    n: int,
+    round_names: Sequence[str],
+    blocked: Dict[str, ForbiddenPairs],
+    rng=None,
+    restarts: int = DISJOINT_SAMPLE_RESTARTS,
+) -> Optional[Dict[str, List[int]]]:
+    """
+    Draw a uniformly random set of edge-disjoint assignments, or return None if that takes too long.
+
+    Every round is drawn uniformly with ``sample_assignment``, independently of the others, and if
+    any giver drew the same receiver in two rounds every round is drawn again. Redrawing only the
+    round that collided would favour earlier rounds that leave the later ones more room; starting
+    over keeps every valid draw equally likely. Two rounds collide in about 63% of draws, so the
+    default ``restarts`` almost never runs out for the classic regular and gag pair.
+
+    Args:
+        n (int): The number of participants.
+        round_names (Sequence[str]): The rounds to draw.
+        blocked (Dict[str, ForbiddenPairs]): Each round's exclusions, indexed by roster position.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+        restarts (int, optional): How many times to start over after a collision. Defaults to
+            ``DISJOINT_SAMPLE_RESTARTS``.
+
+    Returns:
+        Optional[Dict[str, List[int]]]: ``assignments[round][giver]`` for every round, or None if a
+            round is too constrained to sample or every restart collided.
+    """
+    for _ in range(restarts + 1):
+        METRICS.count(DRAW_ATTEMPTS)
+        assignments = {}
+        for round_name in round_names:
+            assignment = sample_assignment(n, blocked[round_name], rng)
+            if assignment is None:
+                return None
+            if any(
+                any(receiver == earlier_receiver for receiver, earlier_receiver in zip(assignment, earlier))
+                for earlier in assignments.values()
+            ):
+                METRICS.count(DRAW_COLLISIONS)
+                break
+            assignments[round_name] = assignment
+        else:
+            return assignments
+    return None
+
+
+def iter_disjoint_rounds(
+    round_names: Sequence[str],
+    blocked: Dict[str, ForbiddenPairs],
+    solve_round: Callable[[str, ForbiddenPairs], List[int]],
+    rng=None,
+    restarts: int = DISJOINT_ROUND_RESTARTS,
+) -> Iterator[Dict[str, List[int]]]:
+    """
+    Solve the rounds one after another so that no giver draws the same receiver in two rounds.
+
+    Every rotation of the round order is tried in turn, yielding the assignments of each rotation
+    that succeeds. Callers that only need a draw take the first one; callers that prefer some draws
+    over others (such as the smallest repair) can compare them. If no rotation succeeds, the rounds
+    are redrawn up to ``restarts`` times in a random order, since different earlier rounds can leave
+    room for a later one. This is a heuristic: it can fail on groups that do have a draw, which
+    ``search_disjoint_rounds`` settles.
+
+    Args:
+        round_names (Sequence[str]): The rounds, in their preferred order.
+        blocked (Dict[str, ForbiddenPairs]): Each round's exclusions, indexed by roster position.
+        solve_round (Callable[[str, ForbiddenPairs], List[int]]): Solves one round given its exclusions,
+            which already include the receivers of the earlier rounds.
+        rng (random.Random, optional): Orders the restarts. Defaults to the global ``random`` module.
+        restarts (int, optional): How many random restarts to make once every rotation failed.
+            Defaults to ``DISJOINT_ROUND_RESTARTS``.
+
+    Yields:
+        Dict[str, List[int]]: ``assignments[round][giver]`` for every round, in ``round_names`` order.
 
-        # Remove the names from prior years
+    Raises:
+        NoValidDrawError: The last solve error, if no rotation or restart succeeds.
+    """
+    rng = rng if rng is not None else random
+    round_names = list(round_names)
+    orders = [round_names[shift:] + round_names[:shift] for shift in range(len(round_names))]
+
+    last_error, found = None, False
+    for attempt in range(len(orders) + restarts):
+        if attempt < len(orders):
+            order = orders[attempt]
+        elif found:
+            break
+        else:
+            order = rng.sample(round_names, len(round_names))
+
+        METRICS.count(DRAW_ATTEMPTS)
+        assignments = {}
+        try:
+            for round_name in order:
+                round_blocked = blocked[round_name]
+                for earlier_assignment in assignments.values():
+                    round_blocked = round_blocked.with_extra(earlier_assignment)
+                assignments[round_name] = solve_round(round_name, round_blocked)
+        except NoValidDrawError as error:
+            last_error = error
+            continue
+        found = True
+        yield {round_name: assignments[round_name] for round_name in round_names}
+
+    if not found and last_error is not None:
+        raise last_error
+
+
+def search_disjoint_rounds(
+    n: int,
+    round_names: Sequence[str],
+    blocked: Dict[str, ForbiddenPairs],
+    rng=None,
+    initial: Dict[str, Sequence[Optional[int]]] = None,
+    max_steps: int = DISJOINT_SEARCH_STEPS,
+) -> Dict[str, List[int]]:
+    """
+    Search every round together for edge-disjoint assignments, backtracking until one is found or none can exist.
+
+    Each step fixes some givers' receivers and solves every round around them as a bipartite
+    matching, where a giver's fixed receivers in the other rounds are extra exclusions. If some
+    round has no perfect matching, no draw extends the fixed pairs and the search backtracks. If
+    the rounds' matchings happen to be edge-disjoint, they are the draw. Otherwise a giver who drew
+    the same receiver in two rounds is picked and each receiver they may draw in one of those rounds
+    is fixed in turn. Every branch fixes one more pair, and the branches of a step cover every
+    receiver that giver could draw, so the search is complete: it fails only when no draw exists.
+
+    Args:
+        n (int): The number of participants.
+        round_names (Sequence[str]): The rounds to draw.
+        blocked (Dict[str, ForbiddenPairs]): Each round's exclusions, indexed by roster position.
+        rng (random.Random, optional): Source of randomness. Defaults to the global ``random`` module.
+        initial (Dict[str, Sequence[Optional[int]]], optional): A draw to start the matchings from.
+        max_steps (int, optional): How many pairs to try fixing before giving up. Defaults to
+            ``DISJOINT_SEARCH_STEPS``.
+
+    Returns:
+        Dict[str, List[int]]: ``assignments[round][giver]`` for every round, in ``round_names`` order.
+
+    Raises:
+        NoValidDrawError: If no edge-disjoint assignments exist.
+        DrawSearchGaveUp: If the search gave up after ``max_steps`` without deciding.
+    """
+    rng = rng if rng is not None else random
+    round_names = list(round_names)
+    fixed = {round_name: [None] * n for round_name in round_names}
+    hints = dict(initial or {})
+
+    # Each frame is (round, giver, receivers left to try) for a pair being fixed
+    stack: List[Tuple[str, int, List[int]]] = []
+    root_error, steps = None, 0
+    while True:
+        matchings, error = _match_rounds(n, round_names, blocked, fixed, hints, rng)
+        if error is not None and not stack:
+            root_error = error
+        if matchings is not None:
+            collision = _find_collision(n, round_names, matchings, fixed)
+            if collision is None:
+                logger.info(f"Searching every round together found a draw after fixing {steps} pairs")
+                return matchings
+
+            round_name, giver = collision
+            taken = {receiver for receiver in fixed[round_name] if receiver is not None}
+            taken.update(fixed[other][giver] for other in round_names if fixed[other][giver] is not None)
+            round_blocked = blocked[round_name][giver]
+            candidates = [
+                receiver for receiver in range(n)
+                if receiver != giver and receiver not in taken and receiver not in round_blocked
+            ]
+            rng.shuffle(candidates)
+            stack.append((round_name, giver, candidates))
+            hints = matchings
+
+        while stack and not stack[-1][2]:
+            round_name, giver, _ = stack.pop()
+            fixed[round_name][giver] = None
+        if not stack:
+            if root_error is not None:
+                raise root_error
+            raise NoValidDrawError(
+                f"No valid assignment exists: the {len(round_names)} rounds cannot be drawn without someone "
+                "drawing the same person twice"
+            )
+
+        steps += 1
+        if steps > max_steps:
+            raise DrawSearchGaveUp(
+                f"Gave up searching for a draw of {len(round_names)} rounds after fixing {max_steps} pairs. "
+                "A draw may still exist; try again with another seed"
+            )
+        round_name, giver, candidates = stack[-1]
+        fixed[round_name][giver] = candidates.pop()
+        METRICS.count(DRAW_ATTEMPTS)
+
+
+class _OnlyReceiver:
+    """The exclusions of a giver whose receiver is fixed: everyone else."""
+
+    __slots__ = ("receiver",)
+
+    def __init__(self, receiver: int):
+        self.receiver = receiver
+
+    def __contains__(self, receiver) -> bool:
+        return receiver != self.receiver
+
+
+class _WithExtra:
+    """A giver's exclusions plus the receivers fixed for them in other rounds."""
+
+    __slots__ = ("row", "extra")
+
+    def __init__(self, row, extra: set):
+        self.row = row
+        self.extra = extra
+
+    def __contains__(self, receiver) -> bool:
+        return receiver in self.extra or receiver in self.row
+
+
+def _match_rounds(n, round_names, blocked, fixed, hints, rng):
+    """Solve every round around the fixed pairs, returning ``(matchings, None)`` or ``(None, error)``."""
+    matchings = {}
+    for round_name in round_names:
+        round_fixed, round_blocked, hint = fixed[round_name], blocked[round_name], hints.get(round_name)
+        exclusions, initial = [], []
+        for giver in range(n):
+            receiver = round_fixed[giver]
+            if receiver is not None:
+                exclusions.append(_OnlyReceiver(receiver))
+                initial.append(receiver)
+                continue
+            extra = {fixed[other][giver] for other in round_names if fixed[other][giver] is not None}
+            exclusions.append(_WithExtra(round_blocked[giver], extra) if extra else round_blocked[giver])
+            initial.append(hint[giver] if hint is not None else None)
+        try:
+            matchings[round_name] = solve_assignment(n, exclusions, rng=rng, initial=initial)
+        except NoValidDrawError as error:
+            return None, error
+    return matchings, None
+
+
+def _find_collision(n, round_names, matchings, fixed) -> Optional[Tuple[str, int]]:
+    """
+    Return ``(round, giver)`` for a giver who drew the same receiver in two rounds, or None.
+
+    The round returned is one where the giver's receiver is not fixed yet. There always is one,
+    since a giver's fixed receivers are excluded from their other rounds.
+    """
+    for giver in range(n):
+        seen = {}
+        for round_name in round_names:
+            receiver = matchings[round_name][giver]
+            other = seen.get(receiver)
+            if other is not None:
+                return (round_name if fixed[round_name][giver] is None else other), giver
+            seen[receiver] = round_name
+    return None
+
+
+def assignments_to_names(names_list: List[str], assignments: Dict[str, List[int]]) -> Dict:
+    """Translate ``{round: [receiver index per giver]}`` into ``{round: {giver: receiver}}``."""
+    return {
+        round_name: {name: names_list[assignment[index]] for index, name in enumerate(names_list)}
+        for round_name, assignment in assignments.items()
+    }
+
+
+def _blocked_indices(names_list, name_to_index, get_past_recipients: Callable[[str], set]) -> List[set]:
+    """Translate each participant's excluded names into a set of participant indices."""
+    blocked = []
+    for name in names_list:
         past_assignments = get_past_recipients(name)
-        choices = list(available_names.difference(past_assignments))
-        chosen = random.choice(choices)
-        result[name] = chosen
-        remaining.remove(chosen)
+        blocked.append({name_to_index[n] for n in past_assignments if n in name_to_index})
+    return blocked
 
-    return result
 
-def regular_secret_santa(participants, santas_memory) -> Dict:
-    return secret_santa(participants, santas_memory, santas_memory.get_past_regular_gift_recievers)
+def _solve(names_list, blocked, rng, initial=None) -> List[int]:
+    """Run the matching engine, reporting blocking givers by name rather than index."""
+    try:
+        return solve_assignment(len(names_list), blocked, rng=rng, initial=initial)
+    except NoValidDrawError as error:
+        raise _named_error(names_list, error) from error
 
-def gag_gift_secret_santa(participants, santas_memory) -> Dict:
-    return secret_santa(participants, santas_memory, santas_memory.get_past_gag_gift_recievers)
 
+def _named_error(names_list, error: NoValidDrawError) -> NoValidDrawError:
+    """Return ``error`` with its blocking givers and reachable receivers named rather than indexed."""
+    return NoValidDrawError(
+        str(error),
+        blocking_givers=[names_list[i] for i in error.blocking_givers],
+        reachable_receivers=[names_list[i] for i in error.reachable_receivers],
+    )
 
-def generate_secret_santa_results(participants: Dict, prior_year: Dict, santas_memory):
+
+def round_secret_santa(participants, santas_memory, round_name: str, rng=None) -> Dict:
+    """Draw one round using the compiled exclusions ``santas_memory`` holds for it."""
+    names_list = list(participants.keys())
+    assignment = _solve(names_list, santas_memory.forbidden_pairs(round_name, names_list), rng)
+    return {name: names_list[receiver] for name, receiver in zip(names_list, assignment)}
+
+def regular_secret_santa(participants, santas_memory, rng=None) -> Dict:
+    return round_secret_santa(participants, santas_memory, REGULAR, rng)
+
+def gag_gift_secret_santa(participants, santas_memory, rng=None) -> Dict:
+    return round_secret_santa(participants, santas_memory, GAG, rng)
+
+
+def generate_secret_santa_results(participants: Dict, prior_year: Dict, santas_memory, rng=None):
     """
     Generates a Secret Santa pairing result for a group of participants while avoiding
     conflicts based on previous years' results and preventing a person from drawing themselves.
 
-    This function aims to assign two names (a "Genuine Gift" and a "Gag Gift") to each participant
-    such that:
-    1. No participant is assigned themselves for either gift.
-    2. No participant receives the same person they had in the prior year (for either gift).
+    Every round in ``santas_memory.rounds`` is drawn (by default a "Genuine Gift" round and a
+    "Gag Gift" round) such that:
+    1. No participant is assigned themselves in any round.
+    2. No participant draws anyone they drew in the remembered years (for the same round), or
+       anyone the house rules forbid.
+    3. No participant draws the same person in two rounds.
 
-    The function ensures that the assignments are valid by repeatedly generating random
-    assignments until all conflicts are resolved.
+    All three are constraints of a single solve over every round (see ``joint_secret_santa``), so
+    the draw fails only if no valid draw exists. Every valid draw is equally likely unless the
+    exclusions leave so few that ``solve_disjoint_rounds`` has to fall back to solving round by
+    round.
 
     Args:
         participants (dict): A dictionary where the keys are the names of participants and 
                              the values are their email addresses.
                              Example: {'Alice': 'alice@example.com', 'Bob': 'bob@example.com'}
         
-        prior_year (dict): A dictionary where the keys are participant names and the values are lists
-                           of names that the participant had in previous years (for both the genuine and gag gifts).
-                           Example: {'Alice': ['Bob', 'Charlie'], 'Bob': ['Alice', 'David']}
+        prior_year (dict): The prior years' results, keyed by year, as loaded from the history.
+                           Example: {'2023': {'regular': {'Alice': 'Bob', ...}, 'gag': {'Alice': 'Charlie', ...}}}
+
+        santas_memory (SantasMemory): The memory of prior years' assignments to exclude. Its ``rounds``
+                                      are the rounds drawn.
+
+        rng (random.Random, optional): Source of randomness, e.g. ``random.Random(seed)`` to make the draw
+                                       reproducible. Defaults to the global ``random`` module.
 
     Returns:
-        dict: A dictionary where each key is a participant's name and the value is a list with 
-              two names [genuine gift, gag gift], representing the people they will be gifting.
-              Example: {'Alice': ['Charlie', 'David'], 'Bob': ['Alice', 'Eve']}
-
-    The algorithm works as follows:
-    1. It repeatedly generates two sets of gift assignments: one for the genuine gift and one for the gag gift.
-    2. It checks if any participant has been assigned themselves for either gift, or if a participant has received 
-       the same person they gifted in the previous year.
-    3. If conflicts are found, the process is restarted. Otherwise, the result is returned.
-    """    
-    # Flag to indicate if a valid assignment has been found
-    finished = False
-    
-    # Dictionary to store the final valid results
-    result = {}
-
-    # Repeat until a valid result is generated
-    while not finished:
-        # Generate two separate Secret Santa assignments
-        try:
-            gift_givers = regular_secret_santa(participants, santas_memory)  # Assigns participants for genuine gifts
-            gag_givers = gag_gift_secret_santa(participants, santas_memory)   # Assigns participants for gag gifts
-        except IndexError as e:
-            logger.error(e)
-            raise RuntimeError('You have exceeded the programs ability to pick unique candidates. Please redeuce the exclude_last_n integer or remove years from the history json')
-
-        # Assume no conflicts initially
-        is_conflict = False
-        
-        # Temporary dictionary to store the generated pairings
-        temp_result = {
-            'regular': {},
-            'gag': {}
-        }
-
-        # Iterate over participants and their assigned gift recipients (both genuine and gag)
-        for person, (gift, gag) in zip(gift_givers.keys(), zip(gift_givers.values(), gag_givers.values())):
-            # Check if the participant has drawn the same person
-            if gift == gag:
-                is_conflict = True
-                break 
-            
-            # No conflicts for this participant, store the pairing
-            #temp_result[person] = [gift, gag]
-            temp_result['regular'][person] = gift
-            temp_result['gag'][person] = gag
-
-        # If no conflicts are found for all participants, the result is valid
-        if not is_conflict:
-            result = temp_result
-            finished = True  # Mark the process as finished, we have valid assignments
-
-    # Return the final Secret Santa assignments
-    return result
\ No newline at end of file
+        dict: ``{round: {giver: receiver}}`` with one entry per round, in round order.
+              Example: {'regular': {'Alice': 'Charlie', 'Bob': 'Alice'}, 'gag': {'Alice': 'David', 'Bob': 'Eve'}}
+
+    Raises:
+        NoValidDrawError: If the exclusions leave no valid draw.
+    """
+    return _joint_or_too_constrained(participants, santas_memory, rng)
+
+
+def _joint_or_too_constrained(participants, santas_memory, rng) -> Dict:
+    try:
+        return joint_secret_santa(participants, santas_memory, rng)
+    except NoValidDrawError as e:
+        logger.error(e)
+        # Keeps DrawSearchGaveUp apart, since a search that gave up has not shown that no draw exists
+        raise type(e)(
+            TOO_CONSTRAINED_MESSAGE,
+            blocking_givers=e.blocking_givers,
+            reachable_receivers=e.reachable_receivers,
+        ) from e
@@ -0,0 +1,124 @@
+"""Seeds for reproducible draws, and a multi-start search that races derived seeds in a process pool"""
+
+from typing import Dict, List, Optional, Tuple
+
+import hashlib
+import multiprocessing
+import os
+import random
+import secrets
+import time
+
+from src.matching import NoValidDrawError
+from src.secret_santa import DrawSearchGaveUp, generate_secret_santa_results
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Short enough to read out or type when replaying a disputed draw
+SEED_BITS = 32
+
+# Set in each multi-start worker by ``_start_worker``, so the roster and history are pickled once per worker
+_worker_draw: Optional[Tuple] = None
+
+
+def new_seed() -> int:
+    """Return a fresh random seed for a draw that was not given one."""
+    return secrets.randbits(SEED_BITS)
+
+
+def derive_seed(seed: int, start: int) -> int:
+    """
+    Derive the seed of one start of a multi-start search from the run's seed.
+
+    The derivation is a hash, so the starts' random streams are independent of each other and of
+    the run's seed, and the same run seed always yields the same start seeds.
+
+    Args:
+        seed (int): The run's seed.
+        start (int): The start's number, from 0.
+
+    Returns:
+        int: The start's seed, a ``SEED_BITS`` bit integer.
+    """
+    digest = hashlib.sha256(f"{seed}:{start}".encode("ascii")).digest()
+    return int.from_bytes(digest[:SEED_BITS // 8], "big")
+
+
+def seeded_secret_santa_results(participants: Dict, prior_year: Dict, santas_memory, seed: int) -> Dict:
+    """
+    Draw with ``generate_secret_santa_results`` using a random stream seeded with ``seed``.
+
+    The same participants (in the same order), history, rules, settings and seed always give the
+    same draw, so a draw can be replayed from its recorded seed.
+    """
+    return generate_secret_santa_results(participants, prior_year, santas_memory, rng=random.Random(seed))
+
+
+def multi_start_secret_santa(
+    participants: Dict, prior_year: Dict, santas_memory, seed: int, starts: int, processes: int = None
+) -> Tuple[Dict, int]:
+    """
+    Draw from several derived seeds in parallel and keep the first valid draw to finish.
+
+    Each start runs ``seeded_secret_santa_results`` with its own seed from ``derive_seed`` in a
+    worker process. On heavily constrained rosters the time a single draw takes varies a lot with
+    its random stream, so racing independent starts cuts the tail latency. Which start finishes
+    first depends on timing, but each start is fully determined by its own seed: the returned seed
+    replays the exact draw in a single start.
+
+    Args:
+        participants (dict): A dictionary mapping participant names to their email addresses.
+        prior_year (dict): The prior years' results, keyed by year.
+        santas_memory (SantasMemory): The memory of prior years' assignments.
+        seed (int): The run's seed, from which every start's seed is derived.
+        starts (int): How many starts to race.
+        processes (int, optional): The number of worker processes. Defaults to ``starts``, at most
+            one per CPU.
+
+    Returns:
+        Tuple[Dict, int]: The draw, ``{round: {giver: receiver}}``, and the seed that produced it.
+
+    Raises:
+        NoValidDrawError: If every start failed; ``DrawSearchGaveUp`` if every start gave up.
+
+    Example:
+        results, draw_seed = multi_start_secret_santa(participants, prior_year, santas_memory, seed=1234, starts=8)
+        assert results == seeded_secret_santa_results(participants, prior_year, santas_memory, draw_seed)
+    """
+    started = time.perf_counter()
+    seeds = [derive_seed(seed, start) for start in range(starts)]
+    processes = processes or min(starts, os.cpu_count() or 1)
+
+    errors: List[Tuple[str, List[str], bool]] = []
+    # Leaving the pool terminates the starts still running once one has succeeded
+    with multiprocessing.Pool(
+        processes, initializer=_start_worker, initargs=(participants, prior_year, santas_memory)
+    ) as pool:
+        for start_seed, results, error in pool.imap_unordered(_run_start, seeds):
+            if error is None:
+                logger.info(
+                    f"Start with seed {start_seed} finished first of {starts} in "
+                    f"{(time.perf_counter() - started) * 1000:.1f} ms"
+                )
+                return results, start_seed
+            errors.append(error)
+
+    message, blocking_givers, _ = errors[-1]
+    error_type = DrawSearchGaveUp if all(gave_up for _, _, gave_up in errors) else NoValidDrawError
+    raise error_type(f"All {starts} starts failed. {message}", blocking_givers=blocking_givers)
+
+
+def _start_worker(participants, prior_year, santas_memory) -> None:
+    global _worker_draw
+    _worker_draw = (participants, prior_year, santas_memory)
+
+
+def _run_start(seed: int):
+    """Run one start in a worker, returning ``(seed, results, error)`` without raising across processes."""
+    participants, prior_year, santas_memory = _worker_draw
+    try:
+        return seed, seeded_secret_santa_results(participants, prior_year, santas_memory, seed), None
+    except NoValidDrawError as error:
+        return seed, None, (str(error), error.blocking_givers, isinstance(error, DrawSearchGaveUp))
@@ -0,0 +1,263 @@
+"""Interchangeable email transports: the Gmail API, SMTP and a local outbox"""
+
+from typing import Callable, Dict, Iterable
+
+import asyncio
+import mailbox
+import smtplib
+import threading
+from pathlib import Path
+
+from src.delivery import (
+    DeliveryResult,
+    OutgoingMessage,
+    TokenBucket,
+    FAILED,
+    GMAIL_BATCH_SIZE,
+    GMAIL_SENDS_PER_SECOND,
+    SENT,
+    gmail_send_batched,
+    gmail_send_concurrent,
+    log_delivery_summary,
+    send_concurrently,
+)
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+GMAIL = "gmail"
+SMTP = "smtp"
+OUTBOX = "outbox"
+TRANSPORTS = (GMAIL, SMTP, OUTBOX)
+
+MAILDIR = "maildir"
+MBOX = "mbox"
+
+
+class Transport:
+    """
+    Delivers rendered messages.
+
+    Subclasses implement ``send``; ``close`` releases any connections. Transports are context
+    managers so connections are closed even if sending fails.
+    """
+
+    def send(
+        self, messages: Iterable[OutgoingMessage], on_result: Callable[[DeliveryResult], None] = None
+    ) -> Dict[str, DeliveryResult]:
+        """
+        Send every message.
+
+        Args:
+            messages (Iterable[OutgoingMessage]): The messages to send.
+            on_result (Callable[[DeliveryResult], None], optional): Called once with each recipient's
+                final outcome.
+
+        Returns:
+            Dict[str, DeliveryResult]: The final outcome per participant name.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GmailApiTransport(Transport):
+    """
+    Sends through the Gmail API, in batch requests or with concurrent workers.
+
+    Every ``send`` on the same transport draws from one rate limiter, so several exchanges sent
+    one after another still stay inside the Gmail quota together.
+
+    Args:
+        service_factory (Callable[[], object]): Builds a Gmail API service instance.
+        concurrency (int, optional): Above 1, send with that many concurrent workers instead of batch
+            requests. Defaults to 1.
+        timeout (float, optional): Seconds to wait for a single send when concurrent. Defaults to 30.
+        rate_limiter (TokenBucket, optional): Limits the send rate. Defaults to a bucket tuned to the
+            Gmail per-user quota.
+    """
+
+    def __init__(self, service_factory: Callable[[], object], concurrency: int = 1, timeout: float = 30.0,
+                 rate_limiter: TokenBucket = None):
+        self.service_factory = service_factory
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or TokenBucket(
+            rate=GMAIL_SENDS_PER_SECOND, capacity=max(concurrency, GMAIL_BATCH_SIZE)
+        )
+
+    def send(self, messages, on_result=None):
+        if self.concurrency > 1:
+            return gmail_send_concurrent(
+                self.service_factory, messages, concurrency=self.concurrency, timeout=self.timeout,
+                rate_limiter=self.rate_limiter, on_result=on_result,
+            )
+        return gmail_send_batched(
+            self.service_factory(), messages, rate_limiter=self.rate_limiter, on_result=on_result
+        )
+
+
+class SmtpTransport(Transport):
+    """
+    Sends over SMTP, reusing authenticated connections across messages.
+
+    With ``pool_size`` 1 every message goes over one connection. Larger pools send concurrently,
+    each worker thread holding its own connection. A connection the server dropped is reopened
+    once before the message is failed.
+
+    Args:
+        host (str): The SMTP server.
+        port (int, optional): The SMTP port. Defaults to 587.
+        username (str, optional): Login user. No login is attempted without one.
+        password (str, optional): Login password.
+        from_addr (str, optional): The envelope sender, also added as the ``From`` header.
+        use_ssl (bool, optional): Connect with implicit TLS (usually port 465). Defaults to False.
+        starttls (bool, optional): Upgrade plain connections with STARTTLS when the server offers it, failing
+            the connection rather than logging in unencrypted if the upgrade is refused. Defaults to True.
+        pool_size (int, optional): The number of connections. Defaults to 1.
+        timeout (float, optional): Socket timeout in seconds. Defaults to 30.
+    """
+
+    def __init__(self, host: str, port: int = 587, username: str = None, password: str = None,
+                 from_addr: str = None, use_ssl: bool = False, starttls: bool = True,
+                 pool_size: int = 1, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.from_addr = from_addr or username or ""
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    def _connect(self) -> smtplib.SMTP:
+        if self.use_ssl:
+            connection = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            if not self.use_ssl and self.starttls:
+                # The server only lists its extensions in reply to EHLO
+                connection.ehlo()
+                if connection.has_extn("starttls"):
+                    connection.starttls()
+            if self.username:
+                connection.login(self.username, self.password or "")
+        except BaseException:
+            connection.close()
+            raise
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+
+    def _connection(self) -> smtplib.SMTP:
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = self._connect()
+        return self._local.connection
+
+    def _payload(self, message: OutgoingMessage) -> bytes:
+        data = message.data.replace(b"\r\n", b"\n").replace(b"\n", b"\r\n")
+        if self.from_addr:
+            data = f"From: {self.from_addr}\r\n".encode() + data
+        return data
+
+    def send_one(self, message: OutgoingMessage) -> str:
+        """Send one message over this thread's connection. Returns the recipient, as SMTP has no message ID."""
+        payload = self._payload(message)
+        try:
+            self._connection().sendmail(self.from_addr, [message.to_email], payload)
+        except smtplib.SMTPServerDisconnected:
+            logger.warning("SMTP connection dropped, reconnecting")
+            self._local.connection = self._connect()
+            self._local.connection.sendmail(self.from_addr, [message.to_email], payload)
+        return message.to_email
+
+    def send(self, messages, on_result=None):
+        if self.pool_size > 1:
+            return asyncio.run(send_concurrently(
+                messages,
+                self.send_one,
+                concurrency=self.pool_size,
+                timeout=self.timeout,
+                rate_limiter=TokenBucket(rate=float(1 << 30), capacity=self.pool_size),
+                max_attempts=1,
+                on_result=on_result,
+            ))
+
+        outcomes = {}
+        for message in messages:
+            try:
+                message_id = self.send_one(message)
+            except (smtplib.SMTPException, OSError) as error:
+                logger.error(f"Error occurred sending the email to {message.to_email}: {error}")
+                result = DeliveryResult(message.name, message.to_email, FAILED, error=str(error), attempts=1)
+            else:
+                logger.info(f"Sent email to {message.to_email} over SMTP")
+                result = DeliveryResult(message.name, message.to_email, SENT, message_id=message_id, attempts=1)
+            outcomes[message.name] = result
+            if on_result is not None:
+                on_result(result)
+
+        log_delivery_summary(outcomes)
+        return outcomes
+
+    def close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, OSError):
+                connection.close()
+
+
+class OutboxTransport(Transport):
+    """
+    Writes messages to a local Maildir or mbox instead of sending them, for dry runs.
+
+    Args:
+        path (Path): The Maildir directory or mbox file. Created if missing.
+        mailbox_format (str, optional): ``"maildir"`` or ``"mbox"``. Defaults to ``"maildir"``.
+    """
+
+    def __init__(self, path: Path, mailbox_format: str = MAILDIR):
+        self.path = Path(path)
+        if mailbox_format == MAILDIR:
+            self.box = mailbox.Maildir(self.path, factory=None, create=True)
+        elif mailbox_format == MBOX:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.box = mailbox.mbox(self.path, factory=None, create=True)
+        else:
+            raise ValueError(f"Unknown outbox format {mailbox_format!r}, expected {MAILDIR!r} or {MBOX!r}")
+
+    def send(self, messages, on_result=None):
+        outcomes = {}
+        self.box.lock()
+        try:
+            for message in messages:
+                key = self.box.add(message.data)
+                result = DeliveryResult(message.name, message.to_email, SENT, message_id=key, attempts=1)
+                outcomes[message.name] = result
+                if on_result is not None:
+                    on_result(result)
+            self.box.flush()
+        finally:
+            self.box.unlock()
+
+        logger.info(f"Wrote {len(outcomes)} emails to the outbox at {self.path}")
+        return outcomes
+
+    def close(self):
+        self.box.close()
@@ -0,0 +1,411 @@
+"""Check a finished draw before it is sent or saved, and measure how evenly the draw engine picks draws"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+
+import itertools
+import math
+import random
+import time
+from array import array
+
+from src.roster import MAX_REPORTED_PROBLEMS
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Below this many draws per allowed pair (or per valid draw) the chi-square approximation is unreliable
+MIN_EXPECTED_COUNT = 5
+# Up to this many givers every valid draw can be listed, from each round's n! permutations
+EXACT_MAX_GIVERS = 8
+
+
+class InvalidDrawError(ValueError):
+    """
+    Raised when a draw breaks a rule it must satisfy.
+
+    Attributes:
+        problems (List[str]): The first ``MAX_REPORTED_PROBLEMS`` problems.
+        problem_count (int): How many problems were found in total.
+    """
+
+    def __init__(self, problems: List[str], problem_count: int):
+        self.problems = problems
+        self.problem_count = problem_count
+        lines = [f"The draw is invalid, with {problem_count} problem(s):", *(f"  {problem}" for problem in problems)]
+        if problem_count > len(problems):
+            lines.append(f"  ... and {problem_count - len(problems)} more")
+        super().__init__("\n".join(lines))
+
+
+def validate_draw(participants, results: Dict, santas_memory=None, allow_history: bool = False) -> None:
+    """
+    Check that a draw is valid before anyone is emailed or it is saved to the history.
+
+    Every round is translated into an integer array ``receiver[giver]`` over roster positions, and
+    then checked in a single pass each, so the whole check is O(n) plus the number of exclusions
+    and handles 100k participant rosters in well under a second:
+
+    1. each round is a permutation of the participants: everyone gives once and receives once,
+    2. nobody draws themselves,
+    3. no pair breaks the round's exclusions from ``santas_memory`` (history and house rules),
+    4. nobody draws the same person in two rounds.
+
+    Args:
+        participants (dict): This year's participants, mapping names to email addresses.
+        results (Dict): The draw, ``{round: {giver: receiver}}``.
+        santas_memory (SantasMemory, optional): The exclusions the draw had to respect. Without it
+            only checks 1, 2 and 4 are made, e.g. for a draw reloaded from a journal.
+        allow_history (bool, optional): Accept repeated history pairs, as a min-cost draw
+            deliberately makes them. House rules are still enforced. Defaults to False.
+
+    Raises:
+        InvalidDrawError: Listing the problems, if there are any.
+
+    Example:
+        validate_draw(participants, secret_santa_results, santas_memory)
+    """
+    started = time.perf_counter()
+    names_list = list(participants.keys())
+    position = {name: index for index, name in enumerate(names_list)}
+    n = len(names_list)
+
+    problems: List[str] = []
+    problem_count = 0
+
+    def problem(message: str) -> None:
+        nonlocal problem_count
+        problem_count += 1
+        if len(problems) < MAX_REPORTED_PROBLEMS:
+            problems.append(message)
+
+    receivers_by_round: Dict[str, array] = {}
+    for round_name, round_results in results.items():
+        receivers = array("l", [-1]) * n
+        received = bytearray(n)
+        for giver, receiver in round_results.items():
+            giver_position, receiver_position = position.get(giver), position.get(receiver)
+            if giver_position is None:
+                problem(f"[{round_name}] {giver} gives a gift but is not participating")
+            elif receiver_position is None:
+                problem(f"[{round_name}] {giver} drew {receiver}, who is not participating")
+            elif receiver_position == giver_position:
+                problem(f"[{round_name}] {giver} drew themselves")
+            elif received[receiver_position]:
+                problem(f"[{round_name}] {receiver} is drawn by more than one giver")
+            else:
+                received[receiver_position] = 1
+                receivers[giver_position] = receiver_position
+
+        # A missing giver leaves a -1, and since every receiver is counted once, someone goes without a gift
+        for giver in range(n):
+            if receivers[giver] < 0 and names_list[giver] not in round_results:
+                problem(f"[{round_name}] {names_list[giver]} did not draw anyone")
+        if received.count(0):
+            problem(f"[{round_name}] {received.count(0)} participant(s) will not receive a gift")
+        receivers_by_round[round_name] = receivers
+
+    if santas_memory is not None:
+        for round_name, receivers in receivers_by_round.items():
+            if round_name not in santas_memory.rounds:
+                problem(f"[{round_name}] is not one of the rounds being drawn: {', '.join(santas_memory.rounds)}")
+                continue
+            blocked = santas_memory.forbidden_pairs(round_name, names_list)
+            indptr, indices, years = blocked.indptr, blocked.indices, blocked.years
+            for giver, allowed in blocked.allowed.items():
+                receiver = receivers[giver]
+                if receiver >= 0 and receiver not in allowed:
+                    problem(
+                        f"[{round_name}] {names_list[giver]} drew {names_list[receiver]}, which is excluded (house rule)"
+                    )
+            for giver in range(n):
+                start, stop, receiver = indptr[giver], indptr[giver + 1], receivers[giver]
+                # The slice and membership test run in C; only a hit needs a closer look
+                if start == stop or receiver not in indices[start:stop]:
+                    continue
+                broken = [years[slot] for slot in range(start, stop) if indices[slot] == receiver]
+                if allow_history and all(broken):
+                    continue
+                reason = "house rule" if not all(broken) else f"drawn in {', '.join(map(str, sorted(broken)))}"
+                problem(f"[{round_name}] {names_list[giver]} drew {names_list[receiver]}, which is excluded ({reason})")
+
+    round_names = list(receivers_by_round)
+    for first_index, first_round in enumerate(round_names):
+        first = receivers_by_round[first_round]
+        for second_round in round_names[first_index + 1:]:
+            second = receivers_by_round[second_round]
+            for giver, (first_receiver, second_receiver) in enumerate(zip(first, second)):
+                if first_receiver == second_receiver and first_receiver >= 0:
+                    problem(
+                        f"{names_list[giver]} drew {names_list[first_receiver]} in both {first_round} and {second_round}"
+                    )
+
+    if problem_count:
+        raise InvalidDrawError(problems, problem_count)
+    logger.info(
+        f"Validated the draw of {len(results)} rounds for {n} participants in "
+        f"{(time.perf_counter() - started) * 1000:.1f} ms"
+    )
+
+
+@dataclass
+class RoundUniformity:
+    """How far one round's pair frequencies are from uniform."""
+
+    round_name: str
+    chi_square: float
+    degrees_of_freedom: int
+    p_value: float
+    # The most over-drawn pair: (giver, receiver, times drawn, times expected)
+    most_frequent: Optional[Tuple[str, str, int, float]] = None
+    # With exclusions a uniform draw does not give uniform pairs, so the p-value is no verdict
+    constrained: bool = False
+
+
+@dataclass
+class DrawUniformity:
+    """How far the frequencies of whole draws are from uniform over every valid draw."""
+
+    valid_draws: int
+    chi_square: float
+    degrees_of_freedom: int
+    p_value: float
+    # Valid draws that never came up, and draws that came up but are not valid
+    unseen: int = 0
+    invalid: int = 0
+    # The most over-drawn draw: (times drawn, times expected)
+    most_frequent: Optional[Tuple[int, float]] = None
+
+
+@dataclass
+class UniformityReport:
+    """The outcome of ``check_uniformity``."""
+
+    draws: int
+    givers: int
+    rounds: Dict[str, RoundUniformity] = field(default_factory=dict)
+    whole_draws: Optional[DrawUniformity] = None
+
+    def biased(self, significance: float = 0.01) -> Optional[bool]:
+        """Whether the draws look biased, or None if the report cannot tell (see ``check_uniformity``)."""
+        if self.whole_draws is not None:
+            return self.whole_draws.invalid > 0 or self.whole_draws.p_value < significance
+        verdicts = [result.p_value < significance for result in self.rounds.values() if not result.constrained]
+        if len(verdicts) < len(self.rounds):
+            return None
+        return any(verdicts)
+
+    def describe(self, significance: float = 0.01) -> str:
+        """Render the report as a human readable message."""
+        lines = []
+        whole = self.whole_draws
+        if whole is not None:
+            verdict = "looks biased" if whole.p_value < significance or whole.invalid else "consistent with uniform"
+            lines.append(
+                f"Frequencies of {self.draws} draws over all {whole.valid_draws} valid draws: chi-square "
+                f"{whole.chi_square:.1f} with {whole.degrees_of_freedom} degrees of freedom, p = {whole.p_value:.4f} "
+                f"({verdict})"
+            )
+            if whole.most_frequent is not None:
+                count, expected = whole.most_frequent
+                lines.append(f"    Most frequent draw: {count} times (expected {expected:.1f}); {whole.unseen} never drawn")
+            if whole.invalid:
+                lines.append(f"    {whole.invalid} draws were not valid")
+
+        lines.append(f"Pair frequencies of {self.draws} draws for {self.givers} givers:")
+        for result in self.rounds.values():
+            if result.constrained:
+                verdict = "no verdict: exclusions make some pairs more likely even in a uniform draw"
+            else:
+                verdict = "looks biased" if result.p_value < significance else "consistent with uniform"
+            lines.append(
+                f"[{result.round_name}] chi-square {result.chi_square:.1f} with {result.degrees_of_freedom} degrees of "
+                f"freedom, p = {result.p_value:.4f} ({verdict})"
+            )
+            if result.most_frequent is not None:
+                giver, receiver, count, expected = result.most_frequent
+                lines.append(f"    Most frequent pair: {giver} -> {receiver}, {count} times (expected {expected:.1f})")
+        return "\n".join(lines)
+
+
+def chi_square_p_value(chi_square: float, degrees_of_freedom: int) -> float:
+    """
+    Return the upper tail probability of a chi-square statistic.
+
+    Uses the Wilson–Hilferty approximation, under which ``(chi_square / df) ** (1/3)`` is roughly
+    normal with mean ``1 - 2 / (9 df)`` and variance ``2 / (9 df)``. It is accurate to a few
+    decimal places for the large degrees of freedom the frequency tests usually have, and only
+    rough below about three.
+    """
+    if degrees_of_freedom <= 0:
+        return 1.0
+    variance = 2 / (9 * degrees_of_freedom)
+    z = ((chi_square / degrees_of_freedom) ** (1 / 3) - (1 - variance)) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def check_uniformity(
+    participants,
+    santas_memory,
+    draw: Callable[[random.Random], Dict],
+    draws: int = 1000,
+    sample_givers: int = 1000,
+    rng: random.Random = None,
+) -> UniformityReport:
+    """
+    Run many draws and test whether every valid draw comes up equally often.
+
+    On small groups (up to ``EXACT_MAX_GIVERS`` givers, with few enough valid draws that each is
+    expected ``MIN_EXPECTED_COUNT`` times) every valid draw is listed, and how often each whole draw
+    came up is compared with a uniform spread over that list with a chi-square test. This is the
+    real test: it sees a bias in which combinations come up even when every single pair comes up
+    equally often, and it holds with any history and house rules.
+
+    Larger groups have too many valid draws to count, so only pairs are tested. For every sampled
+    giver and round the receivers drawn are counted and compared with a uniform spread over the
+    receivers the giver is allowed, using ``sum(observed ** 2 / expected) - draws`` per giver so
+    unobserved pairs cost nothing. Without exclusions a uniform draw gives every pair the same odds,
+    so a small p-value means the engine is biased. The converse does not hold: an engine can favour
+    some whole draws while every pair stays even. With exclusions in any round even a uniform draw
+    makes some pairs more likely, in every round since the rounds are drawn edge-disjoint, so the
+    rounds are marked ``constrained`` and get no verdict; compare their statistic between engines or
+    settings instead.
+
+    Args:
+        participants (dict): This year's participants, mapping names to email addresses.
+        santas_memory (SantasMemory): The exclusions the draws respect.
+        draw (Callable[[random.Random], Dict]): Makes one draw, ``{round: {giver: receiver}}``, from an rng.
+        draws (int, optional): How many draws to run. Defaults to 1000.
+        sample_givers (int, optional): How many givers to count, sampled at random, to bound the
+            memory used on very large groups. Defaults to 1000.
+        rng (random.Random, optional): Seeds the draws and the giver sample. Defaults to a fresh ``random.Random()``.
+
+    Returns:
+        UniformityReport: The test result for every round, and for whole draws on small groups.
+
+    Example:
+        report = check_uniformity(participants, santas_memory, lambda rng: generate_secret_santa_results(
+            participants, prior_year_results, santas_memory, rng=rng), draws=2000)
+        logger.info(report.describe())
+    """
+    rng = rng if rng is not None else random.Random()
+    names_list = list(participants.keys())
+    position = {name: index for index, name in enumerate(names_list)}
+    givers = rng.sample(names_list, min(sample_givers, len(names_list)))
+    counts = {round_name: {giver: {} for giver in givers} for round_name in santas_memory.rounds}
+    blocked_by_round = {
+        round_name: santas_memory.forbidden_pairs(round_name, names_list) for round_name in santas_memory.rounds
+    }
+
+    valid_draws = _valid_draws(len(names_list), list(blocked_by_round.values()), draws // MIN_EXPECTED_COUNT)
+    if valid_draws is None and len(names_list) <= EXACT_MAX_GIVERS:
+        logger.warning(
+            f"Too many valid draws to expect each {MIN_EXPECTED_COUNT} times in {draws} draws; only testing pairs"
+        )
+    draw_counts: Dict[Tuple, int] = {}
+
+    started = time.perf_counter()
+    for _ in range(draws):
+        results = draw(rng)
+        for round_name, round_counts in counts.items():
+            round_results = results[round_name]
+            for giver, giver_counts in round_counts.items():
+                receiver = round_results[giver]
+                giver_counts[receiver] = giver_counts.get(receiver, 0) + 1
+        if valid_draws is not None:
+            key = tuple(
+                tuple(position[results[round_name][name]] for name in names_list) for round_name in blocked_by_round
+            )
+            draw_counts[key] = draw_counts.get(key, 0) + 1
+    logger.info(f"Ran {draws} draws in {time.perf_counter() - started:.1f}s")
+
+    # Rounds are drawn edge-disjoint, so exclusions in one round skew the pairs of every other round too
+    constrained = any(len(blocked.indices) or blocked.allowed for blocked in blocked_by_round.values())
+    report = UniformityReport(draws=draws, givers=len(givers))
+    if valid_draws is not None:
+        report.whole_draws = _draw_uniformity(valid_draws, draw_counts, draws)
+    for round_name, round_counts in counts.items():
+        blocked = blocked_by_round[round_name]
+        chi_square, degrees_of_freedom, most_frequent, sparse = 0.0, 0, None, 0
+        for giver, giver_counts in round_counts.items():
+            giver_position = position[giver]
+            excluded = blocked.excluded(giver_position)
+            excluded.discard(giver_position)
+            allowed = len(names_list) - 1 - len(excluded)
+            if allowed < 2:
+                continue
+            expected = draws / allowed
+            sparse += expected < MIN_EXPECTED_COUNT
+            chi_square += sum(count * count for count in giver_counts.values()) / expected - draws
+            degrees_of_freedom += allowed - 1
+
+            receiver, count = max(giver_counts.items(), key=lambda item: item[1])
+            if most_frequent is None or count / expected > most_frequent[2] / most_frequent[3]:
+                most_frequent = (giver, receiver, count, expected)
+
+        if sparse:
+            logger.warning(
+                f"[{round_name}] {sparse} givers expect fewer than {MIN_EXPECTED_COUNT} draws per receiver; "
+                "run more draws for a reliable p-value"
+            )
+        report.rounds[round_name] = RoundUniformity(
+            round_name=round_name,
+            chi_square=chi_square,
+            degrees_of_freedom=degrees_of_freedom,
+            p_value=chi_square_p_value(chi_square, degrees_of_freedom),
+            most_frequent=most_frequent,
+            constrained=constrained,
+        )
+    return report
+
+
+def _valid_draws(n: int, blocked_by_round: List, limit: int) -> Optional[set]:
+    """
+    List every valid draw as a tuple of each round's receivers, or return None if there are more than ``limit``.
+
+    Only rosters of up to ``EXACT_MAX_GIVERS`` are listed. Each round's valid permutations are
+    found first, then combined round by round, keeping the rounds edge-disjoint.
+    """
+    if n > EXACT_MAX_GIVERS or limit < 1:
+        return None
+    per_round = [
+        [
+            permutation for permutation in itertools.permutations(range(n))
+            if all(receiver != giver and receiver not in blocked[giver] for giver, receiver in enumerate(permutation))
+        ]
+        for blocked in blocked_by_round
+    ]
+
+    valid = set()
+
+    def extend(chosen: Tuple) -> bool:
+        if len(chosen) == len(per_round):
+            valid.add(chosen)
+            return len(valid) <= limit
+        for permutation in per_round[len(chosen)]:
+            if all(permutation[giver] != earlier[giver] for earlier in chosen for giver in range(n)):
+                if not extend(chosen + (permutation,)):
+                    return False
+        return True
+
+    return valid if extend(()) else None
+
+
+def _draw_uniformity(valid_draws: set, draw_counts: Dict[Tuple, int], draws: int) -> DrawUniformity:
+    """Compare how often each whole draw came up with a uniform spread over ``valid_draws``."""
+    if not valid_draws:
+        return DrawUniformity(0, 0.0, 0, 1.0, invalid=draws)
+    expected = draws / len(valid_draws)
+    observed = [draw_counts.get(key, 0) for key in valid_draws]
+    chi_square = sum((count - expected) ** 2 / expected for count in observed)
+    most = max(observed)
+    return DrawUniformity(
+        valid_draws=len(valid_draws),
+        chi_square=chi_square,
+        degrees_of_freedom=len(valid_draws) - 1,
+        p_value=chi_square_p_value(chi_square, len(valid_draws) - 1),
+        unseen=observed.count(0),
+        invalid=draws - sum(observed),
+        most_frequent=(most, expected),
+    )
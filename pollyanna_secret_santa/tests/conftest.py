@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The modules import each other as `src.*`, relative to the package directory, as `main.py` runs them
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
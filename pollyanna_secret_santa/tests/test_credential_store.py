@@ -0,0 +1,69 @@
+"""Tests of the encrypted token store and its owner-only files"""
+
+import os
+import stat
+
+import pytest
+
+from src.credential_store import KEY_ENV_VARIABLE, _read_private, _write_private
+
+posix_only = pytest.mark.skipif(os.name != "posix", reason="file modes are only checked on POSIX")
+
+
+def mode(path) -> int:
+    return stat.S_IMODE(path.stat().st_mode)
+
+
+@posix_only
+def test_a_leftover_temporary_file_does_not_lend_its_mode(tmp_path):
+    path = tmp_path / "token.enc"
+    leftover = tmp_path / "token.enc.tmp"
+    leftover.write_bytes(b"half written")
+    leftover.chmod(0o644)
+
+    _write_private(path, b"secret")
+
+    assert path.read_bytes() == b"secret"
+    assert mode(path) == 0o600
+    assert not leftover.exists()
+
+
+@posix_only
+def test_files_others_can_read_are_refused(tmp_path):
+    path = tmp_path / "token.key"
+    _write_private(path, b"key")
+    assert _read_private(path) == b"key"
+
+    path.chmod(0o640)
+    with pytest.raises(PermissionError):
+        _read_private(path)
+
+
+@pytest.fixture
+def fernet():
+    return pytest.importorskip("cryptography.fernet").Fernet
+
+
+def test_a_key_next_to_the_store_is_warned_about(tmp_path, monkeypatch, caplog, fernet):
+    from src.credential_store import CredentialStore
+
+    monkeypatch.delenv(KEY_ENV_VARIABLE, raising=False)
+    with caplog.at_level("WARNING", logger="src.credential_store"):
+        store = CredentialStore(tmp_path / "token.enc", tmp_path / "token.key")
+    store.save('{"token": "t"}')
+
+    assert any(KEY_ENV_VARIABLE in message for message in caplog.messages)
+    assert CredentialStore(tmp_path / "token.enc", tmp_path / "token.key").load() == '{"token": "t"}'
+
+
+def test_a_key_from_the_environment_stays_off_disk(tmp_path, monkeypatch, caplog, fernet):
+    from src.credential_store import CredentialStore
+
+    monkeypatch.setenv(KEY_ENV_VARIABLE, fernet.generate_key().decode())
+    with caplog.at_level("WARNING", logger="src.credential_store"):
+        store = CredentialStore(tmp_path / "token.enc", tmp_path / "token.key")
+    store.save('{"token": "t"}')
+
+    assert caplog.messages == []
+    assert not (tmp_path / "token.key").exists()
+    assert store.load() == '{"token": "t"}'
@@ -0,0 +1,180 @@
+"""End to end tests of the concurrent send pipeline against a local stub mail server"""
+
+import asyncio
+import json
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from src.delivery import FAILED, SENT, TokenBucket, build_messages, send_concurrently
+
+PARTICIPANTS = {f"Person {index}": f"person{index}@example.com" for index in range(12)}
+NAMES = list(PARTICIPANTS)
+RESULTS = {
+    "regular": {giver: NAMES[(index + 1) % len(NAMES)] for index, giver in enumerate(NAMES)},
+    "gag": {giver: NAMES[(index + 2) % len(NAMES)] for index, giver in enumerate(NAMES)},
+}
+
+
+class StubHttpError(Exception):
+    """Carries the status like the Gmail client's ``HttpError``, so the pipeline can classify it."""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class StubMailServer(ThreadingHTTPServer):
+    """
+    Accepts ``POST /send`` with the recipient in the ``To`` header and records every request.
+
+    ``fail_once`` recipients get one 503 before they succeed, and ``hang`` recipients are answered
+    only after ``hang_seconds``.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fail_once=(), hang=(), hang_seconds=0.0, delay=0.02):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.fail_once = set(fail_once)
+        self.hang = set(hang)
+        self.hang_seconds = hang_seconds
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/send"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        to_email = self.headers["To"]
+        self.rfile.read(int(self.headers["Content-Length"]))
+        with server.lock:
+            server.requests.append(to_email)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            fail = to_email in server.fail_once
+            server.fail_once.discard(to_email)
+        try:
+            time.sleep(server.hang_seconds if to_email in server.hang else server.delay)
+            status, body = (503, {}) if fail else (200, {"id": f"id-{to_email}"})
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(**options) -> StubMailServer:
+        server = StubMailServer(**options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def http_sender(url: str):
+    """A blocking ``send_one`` that posts the MIME message to the stub server."""
+
+    def send_one(message) -> str:
+        request = urllib.request.Request(url, data=message.data, headers={"To": message.to_email}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                return json.load(response)["id"]
+        except urllib.error.HTTPError as error:
+            raise StubHttpError(error.code) from None
+
+    return send_one
+
+
+def send(server, **options):
+    return asyncio.run(send_concurrently(
+        build_messages(PARTICIPANTS, RESULTS),
+        http_sender(server.url),
+        rate_limiter=TokenBucket(rate=1000.0, capacity=100),
+        base_delay=0.01,
+        **options,
+    ))
+
+
+def test_every_email_is_sent_once_within_the_concurrency_limit(start_server):
+    server = start_server(fail_once={"person3@example.com", "person7@example.com"})
+
+    outcomes = send(server, concurrency=4, timeout=5.0)
+
+    assert {name: result.status for name, result in outcomes.items()} == {name: SENT for name in NAMES}
+    assert outcomes["Person 0"].message_id == "id-person0@example.com"
+    assert outcomes["Person 3"].attempts == 2
+    assert outcomes["Person 0"].attempts == 1
+    # Every recipient was delivered exactly once, the two 503s aside
+    assert sorted(server.requests) == sorted(list(PARTICIPANTS.values()) + ["person3@example.com", "person7@example.com"])
+    assert 1 < server.max_in_flight <= 4
+
+
+def test_a_timed_out_send_is_not_retried_and_does_not_block_the_rest(start_server):
+    server = start_server(hang={"person0@example.com"}, hang_seconds=1.5)
+
+    started = time.perf_counter()
+    outcomes = send(server, concurrency=1, timeout=0.3)
+
+    assert outcomes["Person 0"].status == FAILED
+    assert outcomes["Person 0"].attempts == 1
+    assert "timed out" in outcomes["Person 0"].error
+    assert all(outcomes[name].status == SENT for name in NAMES[1:])
+    # The hung request was sent once, and the worker moved on without waiting for it to finish
+    assert server.requests.count("person0@example.com") == 1
+    assert time.perf_counter() - started < 1.5
+
+
+def test_a_send_that_never_returns_does_not_hold_up_exit():
+    # Run in a fresh interpreter, as the stuck thread outlives the test until the interpreter exits
+    script = textwrap.dedent("""
+        import asyncio, threading
+        from src.delivery import FAILED, SENT, TokenBucket, build_messages, send_concurrently
+
+        def send_one(message):
+            if message.name == "Person 0":
+                threading.Event().wait()
+            return "id"
+
+        participants = {"Person 0": "person0@example.com", "Person 1": "person1@example.com"}
+        outcomes = asyncio.run(send_concurrently(
+            build_messages(participants, {"regular": {"Person 0": "Person 1", "Person 1": "Person 0"}}),
+            send_one, concurrency=1, timeout=0.2, rate_limiter=TokenBucket(rate=1000.0, capacity=10),
+        ))
+        assert (outcomes["Person 0"].status, outcomes["Person 1"].status) == (FAILED, SENT)
+    """)
+    completed = subprocess.run(
+        [sys.executable, "-c", script], cwd=Path(__file__).resolve().parent.parent, capture_output=True, timeout=20
+    )
+
+    assert completed.returncode == 0, completed.stderr.decode()
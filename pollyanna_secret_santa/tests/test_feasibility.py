@@ -0,0 +1,87 @@
+"""Tests of the precheck that a draw exists, and of its explanation when none does"""
+
+import random
+
+import pytest
+
+import src.feasibility as feasibility
+from src.feasibility import check_feasibility
+from src.helpers import SantasMemory, YearAllocator
+from src.matching import NoValidDrawError
+from src.secret_santa import DrawSearchGaveUp, generate_secret_santa_results
+
+NAMES = ["Ann", "Bob", "Cat", "Dan"]
+PARTICIPANTS = {name: f"{name.lower()}@example.com" for name in NAMES}
+
+
+@pytest.fixture
+def combined_solves(monkeypatch):
+    """Count the full draws of every round together that the precheck makes."""
+    calls = []
+    solve = feasibility.solve_disjoint_rounds
+
+    def counting(*args, **kwargs):
+        calls.append(args)
+        return solve(*args, **kwargs)
+
+    monkeypatch.setattr(feasibility, "solve_disjoint_rounds", counting)
+    return calls
+
+
+def test_a_feasible_group_is_checked_round_by_round_only(combined_solves):
+    report = check_feasibility(PARTICIPANTS, {}, memory_length=3)
+
+    assert report.feasible
+    assert report.rounds_combine is None
+    assert report.suggested_exclude_last_n is None
+    assert combined_solves == []
+
+
+def test_a_blocked_round_names_its_givers_and_the_years_behind_them():
+    # Three years in which everyone drew each of the others once leave nobody to draw; the last two still leave a draw
+    history = {
+        str(YearAllocator.YEAR - 1): {"regular": {"Ann": "Bob", "Bob": "Ann", "Cat": "Dan", "Dan": "Cat"}},
+        str(YearAllocator.YEAR - 2): {"regular": {"Ann": "Dan", "Dan": "Ann", "Bob": "Cat", "Cat": "Bob"}},
+        str(YearAllocator.YEAR - 3): {"regular": {"Ann": "Cat", "Cat": "Ann", "Bob": "Dan", "Dan": "Bob"}},
+    }
+    report = check_feasibility(PARTICIPANTS, history, memory_length=3, rounds=["regular"])
+
+    assert not report.feasible
+    blocked = report.rounds["regular"]
+    assert len(blocked.blocking_givers) == 1
+    giver = blocked.blocking_givers[0]
+    assert sorted(receiver for _, receiver, _ in blocked.blocking_pairs) == sorted(set(NAMES) - {giver})
+    assert all(len(years) == 1 for _, _, years in blocked.blocking_pairs)
+    # The suggestion is only worked out when it is read, and then only once
+    suggest, suggestions = report.suggest, []
+    report.suggest = lambda: suggestions.append(suggest()) or suggestions[-1]
+    assert suggestions == []
+    assert report.suggested_exclude_last_n == 2
+    assert report.suggested_exclude_last_n == 2
+    assert suggestions == [2]
+    assert "largest exclude_last_n that still allows a draw is 2" in report.describe()
+
+
+def test_rounds_that_cannot_be_combined_are_settled_by_the_draw():
+    # Each round alone is a swap of the two, but then both rounds give each the same receiver
+    participants = {"Ann": "ann@example.com", "Bob": "bob@example.com"}
+    report = check_feasibility(participants, {}, memory_length=0)
+    assert report.feasible
+
+    memory = SantasMemory({}, 0)
+    with pytest.raises(NoValidDrawError) as raised:
+        generate_secret_santa_results(participants, {}, memory, rng=random.Random(0))
+
+    assert report.record_draw_failure(raised.value)
+    assert not report.feasible
+    assert report.rounds_combine is False
+    assert "same person twice" in report.describe()
+    assert report.suggested_exclude_last_n is None
+
+
+def test_a_search_that_gave_up_settles_nothing():
+    report = check_feasibility(PARTICIPANTS, {}, memory_length=0)
+
+    assert not report.record_draw_failure(DrawSearchGaveUp("gave up"))
+    assert report.feasible
+    assert report.rounds_combine is None
@@ -0,0 +1,182 @@
+"""Tests of batched Gmail delivery against a fake Gmail API service"""
+
+import base64
+from email import message_from_bytes
+
+from src.delivery import FAILED, SENT, TokenBucket, build_messages, gmail_send_batched
+
+PARTICIPANTS = {f"Person {index}": f"person{index}@example.com" for index in range(23)}
+NAMES = list(PARTICIPANTS)
+RESULTS = {"regular": {giver: NAMES[(index + 1) % len(NAMES)] for index, giver in enumerate(NAMES)}}
+
+
+class FakeResponse:
+    def __init__(self, status: int):
+        self.status = status
+
+
+class FakeHttpError(Exception):
+    """Carries the status on ``resp`` like ``googleapiclient.errors.HttpError``."""
+
+    def __init__(self, status: int):
+        super().__init__(f"<HttpError {status}>")
+        self.resp = FakeResponse(status)
+
+
+class FakeClock:
+    """A clock that only moves when something sleeps, recording every sleep."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        # Like a real clock, always move on, so rounding cannot leave the bucket a hair short forever
+        self.now += max(seconds, 1e-6)
+
+
+class FakeBatch:
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        service = self.service
+        service.batches.append([request_id for request_id, _ in self.requests])
+        if service.failing_batches:
+            service.failing_batches -= 1
+            raise FakeHttpError(503)
+        for request_id, request in self.requests:
+            to_email = message_from_bytes(base64.urlsafe_b64decode(request["raw"]))["To"]
+            assert to_email == PARTICIPANTS[request_id]
+            statuses = service.statuses.get(request_id)
+            status = statuses.pop(0) if statuses else 200
+            if status == 200:
+                self.callback(request_id, {"id": f"id-{request_id}"}, None)
+            else:
+                self.callback(request_id, None, FakeHttpError(status))
+
+
+class FakeGmailService:
+    """
+    Stands in for the Gmail API service: ``statuses[name]`` lists the statuses that recipient gets on
+    successive attempts (200 once the list runs out), and the first ``failing_batches`` batches fail
+    as a whole, as when the batch request itself is lost.
+    """
+
+    def __init__(self, statuses=None, failing_batches=0):
+        self.statuses = {name: list(codes) for name, codes in (statuses or {}).items()}
+        self.failing_batches = failing_batches
+        self.batches = []
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def send(self, userId, body):
+        assert userId == "me"
+        return body
+
+
+def send(service, **options):
+    clock = FakeClock()
+    recorded = []
+    options.setdefault("rate_limiter", TokenBucket(rate=1000.0, capacity=100, clock=clock.time, sleep=clock.sleep))
+    outcomes = gmail_send_batched(
+        service, build_messages(PARTICIPANTS, RESULTS), sleep=clock.sleep, on_result=recorded.append, **options
+    )
+    return outcomes, recorded, clock
+
+
+def test_messages_are_sent_in_batches_of_the_batch_size():
+    service = FakeGmailService()
+
+    outcomes, recorded, clock = send(service, batch_size=10)
+
+    assert [len(batch) for batch in service.batches] == [10, 10, 3]
+    assert [name for batch in service.batches for name in batch] == NAMES
+    assert {name: (result.status, result.message_id, result.attempts) for name, result in outcomes.items()} == {
+        name: (SENT, f"id-{name}", 1) for name in NAMES
+    }
+    assert sorted(result.name for result in recorded) == sorted(NAMES)
+    assert clock.sleeps == []
+
+
+def test_rate_limited_and_server_errors_are_retried_with_backoff():
+    service = FakeGmailService(statuses={"Person 1": [429], "Person 2": [503, 500], "Person 20": [502]})
+
+    outcomes, recorded, clock = send(service, batch_size=10, base_delay=1.0)
+
+    assert all(result.status == SENT for result in outcomes.values())
+    assert outcomes["Person 1"].attempts == 2
+    assert outcomes["Person 2"].attempts == 3
+    assert outcomes["Person 20"].attempts == 2
+    assert outcomes["Person 0"].attempts == 1
+    # Only the failed requests are retried, together in one batch per round
+    assert service.batches[3:] == [["Person 1", "Person 2", "Person 20"], ["Person 2"]]
+    # The backoff doubles each round, plus up to one base delay of jitter
+    assert len(clock.sleeps) == 2
+    assert 1.0 <= clock.sleeps[0] < 2.0
+    assert 2.0 <= clock.sleeps[1] < 3.0
+    assert len(recorded) == len(NAMES)
+
+
+def test_other_client_errors_fail_at_once(caplog):
+    service = FakeGmailService(statuses={"Person 3": [400], "Person 4": [403]})
+
+    with caplog.at_level("INFO", logger="src.delivery"):
+        outcomes, recorded, clock = send(service)
+
+    assert (outcomes["Person 3"].status, outcomes["Person 3"].attempts) == (FAILED, 1)
+    assert "400" in outcomes["Person 3"].error
+    assert outcomes["Person 4"].status == FAILED
+    assert sum(batch.count("Person 3") for batch in service.batches) == 1
+    assert all(outcomes[name].status == SENT for name in NAMES if name not in ("Person 3", "Person 4"))
+    assert clock.sleeps == []
+    assert f"Delivery summary: {len(NAMES) - 2} sent, 2 failed" in caplog.messages
+    assert any(message.startswith("  Person 4 <person4@example.com> failed after 1 attempts") for message in caplog.messages)
+
+
+def test_retries_stop_after_the_last_attempt():
+    service = FakeGmailService(statuses={"Person 5": [503] * 10})
+
+    outcomes, _, clock = send(service, max_attempts=3)
+
+    assert (outcomes["Person 5"].status, outcomes["Person 5"].attempts) == (FAILED, 3)
+    assert "503" in outcomes["Person 5"].error
+    assert len(clock.sleeps) == 2
+
+
+def test_a_lost_batch_request_is_retried_whole():
+    service = FakeGmailService(failing_batches=1)
+
+    outcomes, _, _ = send(service, batch_size=10)
+
+    assert service.batches[0] == NAMES[:10]
+    assert all(outcomes[name].attempts == 2 for name in NAMES[:10])
+    assert all(outcomes[name].attempts == 1 for name in NAMES[10:])
+    assert all(result.status == SENT for result in outcomes.values())
+
+
+def test_sending_waits_for_the_rate_limiter():
+    clock = FakeClock()
+    service = FakeGmailService()
+
+    outcomes, _, _ = send(service, rate_limiter=TokenBucket(rate=2.5, capacity=10, clock=clock.time, sleep=clock.sleep))
+
+    assert len(outcomes) == len(NAMES)
+    # The first 10 go out at once, then 2.5 a second
+    assert abs(clock.now - (len(NAMES) - 10) / 2.5) < 1e-3
@@ -0,0 +1,79 @@
+"""Tests of the SQLite history store and its one-off import of the legacy JSON cache"""
+
+import json
+import sqlite3
+
+import pytest
+
+from src.history import LEGACY_JSON_MIGRATED, HistoryStore
+
+LEGACY = {
+    "2022": {"regular": {"Ann": "Bob", "Bob": "Ann"}, "gag": {"Ann": "Bob"}},
+    "2023": {"regular": {"Ann": "Cat", "Cat": "Ann"}},
+}
+
+
+@pytest.fixture
+def legacy_json(tmp_path):
+    path = tmp_path / "prior_year_santa_results.json"
+    path.write_text(json.dumps(LEGACY))
+    return path
+
+
+def test_saved_years_load_back_and_replace_earlier_saves(tmp_path):
+    store = HistoryStore.open(tmp_path / "history.sqlite3")
+    store.save_year(2024, {"regular": {"Ann": "Bob"}})
+    store.save_year(2024, {"regular": {"Ann": "Cat"}, "gag": {"Ann": "Dan"}})
+
+    assert store.load([2024, 2025]) == {"2024": {"regular": {"Ann": "Cat"}, "gag": {"Ann": "Dan"}}}
+    assert store.load([]) == {}
+    store.close()
+
+
+def test_the_legacy_json_is_imported_once(tmp_path, legacy_json):
+    db_path = tmp_path / "history.sqlite3"
+    store = HistoryStore.open(db_path, legacy_json_path=legacy_json)
+
+    assert store.load([2022, 2023]) == LEGACY
+    assert store.has_marker(LEGACY_JSON_MIGRATED)
+    store.save_year(2023, {"regular": {"Ann": "Dan", "Dan": "Ann"}})
+    store.close()
+
+    # A later open neither imports the file again nor undoes the change made since
+    legacy_json.write_text(json.dumps({**LEGACY, "2021": {"regular": {"Bob": "Cat"}}}))
+    store = HistoryStore.open(db_path, legacy_json_path=legacy_json)
+    assert store.load([2021, 2023]) == {"2023": {"regular": {"Ann": "Dan", "Dan": "Ann"}}}
+    store.close()
+
+
+def test_an_interrupted_import_leaves_nothing_behind_and_is_retried(tmp_path, legacy_json):
+    db_path = tmp_path / "history.sqlite3"
+    # The last year cannot be read, so the import fails after writing the others
+    legacy_json.write_text(json.dumps({**LEGACY, "not a year": {"regular": {}}}))
+
+    with pytest.raises(ValueError):
+        HistoryStore.open(db_path, legacy_json_path=legacy_json)
+
+    connection = sqlite3.connect(db_path)
+    assert connection.execute("SELECT COUNT(*) FROM assignments").fetchone() == (0,)
+    assert connection.execute("SELECT COUNT(*) FROM markers").fetchone() == (0,)
+    connection.close()
+
+    # The database file now exists, which no longer stops the import from running
+    legacy_json.write_text(json.dumps(LEGACY))
+    store = HistoryStore.open(db_path, legacy_json_path=legacy_json)
+    assert store.load([2022, 2023]) == LEGACY
+    store.close()
+
+
+def test_an_existing_database_keeps_its_years_when_the_json_is_imported(tmp_path, legacy_json):
+    db_path = tmp_path / "history.sqlite3"
+    store = HistoryStore.open(db_path)
+    store.save_year(2023, {"regular": {"Ann": "Dan"}})
+    store.close()
+
+    store = HistoryStore.open(db_path, legacy_json_path=legacy_json)
+
+    assert store.load([2022, 2023]) == {"2022": LEGACY["2022"], "2023": {"regular": {"Ann": "Dan"}}}
+    assert store.has_marker(LEGACY_JSON_MIGRATED)
+    store.close()
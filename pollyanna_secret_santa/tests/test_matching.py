@@ -0,0 +1,105 @@
+"""Tests of the matching engine against brute force enumeration of every valid assignment"""
+
+import itertools
+import random
+from collections import Counter
+
+import pytest
+
+from src.constraints import ForbiddenPairs
+from src.matching import NoValidDrawError, sample_assignment, solve_assignment
+
+
+def valid_assignments(n, blocked):
+    return {
+        permutation for permutation in itertools.permutations(range(n))
+        if all(receiver != giver and receiver not in blocked[giver] for giver, receiver in enumerate(permutation))
+    }
+
+
+def assert_uniform(n, blocked, draws_per_assignment=1500, seed=0):
+    """Draw many times and check every valid assignment, and only those, comes up about equally often."""
+    valid = valid_assignments(n, blocked)
+    rng = random.Random(seed)
+    counts = Counter(tuple(solve_assignment(n, blocked, rng=rng)) for _ in range(draws_per_assignment * len(valid)))
+
+    assert set(counts) == valid
+    # 15% is over 4 standard deviations of every count at these draw counts
+    assert min(counts.values()) > draws_per_assignment * 0.85
+    assert max(counts.values()) < draws_per_assignment * 1.15
+
+
+def test_every_derangement_of_four_is_equally_likely():
+    # 6 four-cycles and 3 double transpositions, which an augmenting path repair does not draw equally often
+    assert_uniform(4, [set()] * 4)
+
+
+def test_draws_with_a_forbidden_pair_are_uniform():
+    assert_uniform(5, [{1}, set(), set(), set(), set()])
+
+
+def test_draws_with_history_are_uniform_for_six():
+    assert_uniform(6, [{1, 2}, {0}, {4}, set(), {5, 0}, {3}], draws_per_assignment=800)
+
+
+def test_draws_with_an_allow_list_are_uniform():
+    blocked = ForbiddenPairs.from_edges(5, [(1, 0, 2024)], allowed={0: frozenset({2, 3})})
+    rows = [set(blocked.excluded(giver)) for giver in range(5)]
+    assert_uniform(5, blocked, draws_per_assignment=800)
+    assert valid_assignments(5, rows) == valid_assignments(5, blocked)
+
+
+def test_forbidden_pairs_are_honoured():
+    rng = random.Random(1)
+    for _ in range(200):
+        n = rng.randrange(2, 40)
+        blocked = [set(rng.sample(range(n), rng.randrange(0, max(n // 3, 1)))) for _ in range(n)]
+        try:
+            assignment = solve_assignment(n, blocked, rng=rng)
+        except NoValidDrawError:
+            continue
+        assert sorted(assignment) == list(range(n))
+        for giver, receiver in enumerate(assignment):
+            assert receiver != giver
+            assert receiver not in blocked[giver]
+
+
+def test_tight_draws_fall_back_to_the_repair_and_stay_valid():
+    # Each giver may only draw one of the next two, far too rare for the rejection sampler
+    n = 60
+    allowed = {giver: frozenset({(giver + 1) % n, (giver + 2) % n}) for giver in range(n)}
+    blocked = ForbiddenPairs.from_edges(n, [], allowed=allowed)
+    assert sample_assignment(n, blocked, random.Random(0)) is None
+
+    assignment = solve_assignment(n, blocked, rng=random.Random(0))
+    assert sorted(assignment) == list(range(n))
+    assert all(assignment[giver] in allowed[giver] for giver in range(n))
+
+
+def test_a_hall_violation_names_the_blocking_givers():
+    # Givers 0 and 1 may only draw 2, so they cannot both be matched
+    blocked = [{1, 3}, {0, 3}, set(), set()]
+
+    with pytest.raises(NoValidDrawError) as raised:
+        solve_assignment(4, blocked, rng=random.Random(0))
+
+    assert sorted(raised.value.blocking_givers) == [0, 1]
+    assert raised.value.reachable_receivers == [2]
+
+
+def test_partial_leaves_the_unmatchable_giver_out():
+    assignment = solve_assignment(4, [{1, 3}, {0, 3}, set(), set()], rng=random.Random(0), partial=True)
+
+    assert assignment.count(None) == 1
+    assert assignment.index(None) in (0, 1)
+
+
+def test_seeded_draws_replay():
+    blocked = [set(random.Random(giver).sample(range(50), 5)) for giver in range(50)]
+    tight = ForbiddenPairs.from_edges(30, [], allowed={giver: frozenset({(giver + 1) % 30, (giver + 2) % 30})
+                                                       for giver in range(30)})
+
+    for n, rows in ((50, blocked), (30, tight)):
+        first = solve_assignment(n, rows, rng=random.Random(42))
+        assert solve_assignment(n, rows, rng=random.Random(42)) == first
+        assert any(solve_assignment(n, rows, rng=random.Random(seed)) != first for seed in range(5))
@@ -0,0 +1,142 @@
+"""Tests of the draw over every round together, against brute force enumeration"""
+
+import itertools
+import random
+
+import pytest
+
+from src.constants import GAG, REGULAR
+from src.constraints import ForbiddenPairs
+from src.helpers import SantasMemory, YearAllocator
+from src.matching import NoValidDrawError
+from src.secret_santa import (
+    DrawSearchGaveUp,
+    generate_secret_santa_results,
+    sample_disjoint_rounds,
+    search_disjoint_rounds,
+    solve_disjoint_rounds,
+)
+from src.validation import check_uniformity, validate_draw
+
+ROUNDS = ("regular", "gag", "white_elephant")
+
+
+def random_instance(rng, n, rounds):
+    return {
+        round_name: ForbiddenPairs.from_edges(
+            n, [(giver, receiver, 2024) for giver in range(n) for receiver in range(n) if rng.random() < 0.3]
+        )
+        for round_name in rounds
+    }
+
+
+def brute_force_draws(n, rounds, blocked):
+    per_round = [
+        [
+            permutation for permutation in itertools.permutations(range(n))
+            if all(receiver != giver and receiver not in blocked[round_name][giver]
+                   for giver, receiver in enumerate(permutation))
+        ]
+        for round_name in rounds
+    ]
+    return [
+        combination for combination in itertools.product(*per_round)
+        if all(len({assignment[giver] for assignment in combination}) == len(rounds) for giver in range(n))
+    ]
+
+
+def assert_valid(n, rounds, blocked, assignments):
+    assert list(assignments) == list(rounds)
+    for round_name, assignment in assignments.items():
+        assert sorted(assignment) == list(range(n))
+        assert all(receiver != giver and receiver not in blocked[round_name][giver]
+                   for giver, receiver in enumerate(assignment))
+    for giver in range(n):
+        assert len({assignments[round_name][giver] for round_name in rounds}) == len(rounds)
+
+
+def test_the_search_draws_exactly_the_groups_that_have_a_draw():
+    rng = random.Random(0)
+    outcomes = {"drawn": 0, "none": 0}
+    for _ in range(150):
+        n, rounds = rng.randrange(3, 7), ROUNDS[:rng.randrange(2, 4)]
+        blocked = random_instance(rng, n, rounds)
+        exists = bool(brute_force_draws(n, rounds, blocked))
+        try:
+            assignments = search_disjoint_rounds(n, rounds, blocked, rng=rng)
+        except DrawSearchGaveUp:
+            pytest.fail("the search gave up on a tiny group")
+        except NoValidDrawError:
+            assert not exists
+            outcomes["none"] += 1
+        else:
+            assert exists
+            assert_valid(n, rounds, blocked, assignments)
+            outcomes["drawn"] += 1
+    # Both kinds of group were actually covered
+    assert min(outcomes.values()) > 10
+
+
+def test_a_tight_group_with_a_single_draw_is_found():
+    # Only the two three-cycles are derangements of three people, so each round must take one of them
+    blocked = {round_name: ForbiddenPairs.from_edges(3, []) for round_name in ROUNDS[:2]}
+
+    assignments = solve_disjoint_rounds(3, ROUNDS[:2], blocked, rng=random.Random(0))
+
+    assert sorted(map(tuple, assignments.values())) == [(1, 2, 0), (2, 0, 1)]
+
+
+def test_a_group_with_no_draw_raises():
+    # Three rounds would need three different receivers each, but everyone has only two others
+    blocked = {round_name: ForbiddenPairs.from_edges(3, []) for round_name in ROUNDS}
+
+    with pytest.raises(NoValidDrawError) as raised:
+        solve_disjoint_rounds(3, ROUNDS, blocked, rng=random.Random(0))
+    assert not isinstance(raised.value, DrawSearchGaveUp)
+
+
+def test_the_search_gives_up_after_its_step_budget():
+    blocked = {round_name: ForbiddenPairs.from_edges(3, []) for round_name in ROUNDS}
+
+    with pytest.raises(DrawSearchGaveUp):
+        search_disjoint_rounds(3, ROUNDS, blocked, rng=random.Random(0), max_steps=0)
+
+
+def test_sampling_gives_up_on_groups_too_tight_to_sample():
+    n = 40
+    allowed = {giver: frozenset({(giver + 1) % n, (giver + 2) % n}) for giver in range(n)}
+    blocked = {round_name: ForbiddenPairs.from_edges(n, [], allowed=allowed) for round_name in ROUNDS[:2]}
+
+    assert sample_disjoint_rounds(n, ROUNDS[:2], blocked, rng=random.Random(0)) is None
+    assert_valid(n, ROUNDS[:2], blocked, solve_disjoint_rounds(n, ROUNDS[:2], blocked, rng=random.Random(0)))
+
+
+def test_every_valid_draw_is_equally_likely_by_default():
+    names = ["Ann", "Bob", "Cat", "Dan", "Eve"]
+    participants = {name: name for name in names}
+    last_year = str(YearAllocator.YEAR - 1)
+    # Drawing round by round instead of the rounds together makes some of these draws far likelier than others
+    history = {last_year: {REGULAR: {"Ann": "Bob", "Bob": "Ann"}, GAG: {"Ann": "Dan", "Dan": "Ann"}}}
+    memory = SantasMemory(history, 1)
+
+    report = check_uniformity(
+        participants, memory, lambda rng: generate_secret_santa_results(participants, history, memory, rng=rng),
+        draws=3000, rng=random.Random(0),
+    )
+
+    assert report.whole_draws is not None
+    assert report.whole_draws.unseen == 0
+    assert report.biased() is False
+
+
+def test_seeded_draws_replay_and_are_valid():
+    names = [f"P{index}" for index in range(30)]
+    participants = {name: name for name in names}
+    last_year = str(YearAllocator.YEAR - 1)
+    history = {last_year: {round_name: dict(zip(names, names[1:] + names[:1])) for round_name in (REGULAR, GAG)}}
+    memory = SantasMemory(history, 1)
+
+    first = generate_secret_santa_results(participants, history, memory, rng=random.Random(9))
+
+    assert generate_secret_santa_results(participants, history, memory, rng=random.Random(9)) == first
+    validate_draw(participants, first, memory)
@@ -0,0 +1,213 @@
+"""Tests of the local draw service, served on a free port"""
+
+import http.client
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+from batch import HISTORY_DB_FILE, JOURNAL_DIR, resume_exchange
+from server import ExchangeCache, SantaServer, exchange_signature
+from src.delivery import DeliveryResult, SENT
+from src.helpers import YearAllocator
+from src.history import HistoryStore
+from src.journal import SendJournal
+
+YEAR = YearAllocator.YEAR
+NAMES = ["Ann", "Bob", "Cat", "Dan", "Eve"]
+
+
+def write_roster(directory: Path, names) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    Path(directory, "participants.json").write_text(json.dumps({name: f"{name.lower()}@example.com" for name in names}))
+
+
+@pytest.fixture
+def root(tmp_path):
+    write_roster(Path(tmp_path, "family"), NAMES)
+    # Two people cannot draw each other in two rounds without repeating a receiver
+    write_roster(Path(tmp_path, "couple"), NAMES[:2])
+    return tmp_path
+
+
+@pytest.fixture
+def server(root):
+    server = SantaServer(("127.0.0.1", 0), root)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def call(server, method, path, body=None, raw=None):
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port, timeout=10)
+    try:
+        payload = raw if raw is not None else (json.dumps(body) if body is not None else None)
+        connection.request(method, path, body=payload)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_health_reports_the_cache(server):
+    status, body = call(server, "GET", "/health")
+
+    assert status == 200
+    assert body["status"] == "ok"
+    assert body["cache"]["entries"] == 0
+
+
+def test_feasibility_of_a_drawable_and_an_undrawable_exchange(server):
+    status, body = call(server, "POST", "/feasibility", {"exchange": "family"})
+    assert status == 200
+    assert body["feasible"] is True
+    assert set(body["rounds"]) == {"regular", "gag"}
+
+    # Each round of the couple can be drawn on its own; only a draw shows they cannot be drawn together
+    status, body = call(server, "POST", "/feasibility", {"exchange": "couple"})
+    assert status == 200
+    assert (body["feasible"], body["rounds_combine"]) == (True, None)
+
+    assert call(server, "POST", "/preview", {"exchange": "couple"})[0] == 409
+    _, body = call(server, "POST", "/feasibility", {"exchange": "couple"})
+    assert (body["feasible"], body["rounds_combine"]) == (False, False)
+    assert "same person twice" in body["description"]
+
+
+def test_preview_replays_its_seed_and_saves_nothing(server, root):
+    status, first = call(server, "POST", "/preview", {"exchange": "family"})
+    assert status == 200
+    assert first["saved"] is False
+    assert sorted(first["results"]["regular"]) == sorted(NAMES)
+
+    _, replay = call(server, "POST", "/preview", {"exchange": "family", "seed": first["seed"]})
+    assert replay["results"] == first["results"]
+
+    assert not Path(root, "family", HISTORY_DB_FILE).exists()
+    assert not Path(root, "family", JOURNAL_DIR).exists()
+
+
+def test_draw_saves_history_and_a_journal_that_resume_picks_up(server, root):
+    status, body = call(server, "POST", "/draw", {"exchange": "family"})
+
+    assert status == 200
+    assert body["saved"] is True
+    journal = SendJournal.latest_unfinished(Path(root, "family", JOURNAL_DIR))
+    assert journal.path.name == body["journal"]
+    assert journal.results == body["results"]
+    assert journal.seed == body["seed"]
+    assert sorted(journal.unfinished()) == sorted(NAMES)
+
+    _, history = call(server, "GET", f"/history?exchange=family&years={YEAR}")
+    assert history["years"][str(YEAR)] == body["results"]
+
+    resumed = resume_exchange({"name": "family", "directory": str(Path(root, "family"))})
+    assert "error" not in resumed
+    assert resumed["results"] == body["results"]
+    assert resumed["journal"].path.name == body["journal"]
+
+
+def test_drawing_again_before_sending_supersedes_the_unsent_run(server, root):
+    _, first = call(server, "POST", "/draw", {"exchange": "family"})
+    _, second = call(server, "POST", "/draw", {"exchange": "family"})
+
+    journals = SendJournal.for_year(Path(root, "family", JOURNAL_DIR), YEAR)
+    assert [journal.superseded for journal in journals] == [True, False]
+    assert SendJournal.latest_unfinished(Path(root, "family", JOURNAL_DIR)).path.name == second["journal"]
+
+
+def test_draw_refuses_to_replace_a_year_that_was_emailed(server, root):
+    _, drawn = call(server, "POST", "/draw", {"exchange": "family"})
+    journal = SendJournal.latest_unfinished(Path(root, "family", JOURNAL_DIR))
+    journal.record(DeliveryResult(name="Ann", to_email="ann@example.com", status=SENT, message_id="1"))
+
+    status, body = call(server, "POST", "/draw", {"exchange": "family"})
+
+    assert status == 409
+    assert "already been emailed" in body["error"]
+    _, history = call(server, "GET", f"/history?exchange=family&years={YEAR}")
+    assert history["years"][str(YEAR)] == drawn["results"]
+    assert len(SendJournal.for_year(Path(root, "family", JOURNAL_DIR), YEAR)) == 1
+
+
+def test_an_undrawable_exchange_is_a_conflict_unless_history_is_soft(server):
+    status, body = call(server, "POST", "/draw", {"exchange": "couple"})
+    assert status == 409
+
+    status, body = call(server, "POST", "/preview", {"exchange": "couple", "soft_history": True, "rounds": ["regular"]})
+    assert status == 200
+    assert body["results"] == {"regular": {"Ann": "Bob", "Bob": "Ann"}}
+
+
+def test_history_can_be_filtered_to_one_giver(server, root):
+    store = HistoryStore.open(Path(root, "family", HISTORY_DB_FILE))
+    store.save_year(YEAR - 1, {"regular": {"Ann": "Bob", "Bob": "Ann"}, "gag": {"Ann": "Cat"}})
+    store.close()
+
+    _, body = call(server, "GET", "/history?exchange=family&last=1&giver=Ann")
+
+    assert body["years"] == {str(YEAR - 1): {"regular": {"Ann": "Bob"}, "gag": {"Ann": "Cat"}}}
+
+
+@pytest.mark.parametrize("exchange", ["..", "../..", "family/../..", "/etc"])
+def test_exchanges_outside_the_root_are_rejected(server, exchange):
+    status, body = call(server, "POST", "/preview", {"exchange": exchange})
+
+    assert status == 400
+    assert "outside the served directory" in body["error"]
+
+
+def test_bad_requests_are_answered_in_json(server):
+    assert call(server, "POST", "/preview", {"exchange": "nobody"})[0] == 404
+    assert call(server, "POST", "/preview", raw="{not json")[0] == 400
+    assert call(server, "POST", "/preview", raw="[1, 2]")[0] == 400
+    assert call(server, "POST", "/preview", {"exchange": "family", "exclude_last_n": -1})[0] == 400
+    assert call(server, "POST", "/preview", {"exchange": "family", "rounds": []})[0] == 400
+    assert call(server, "GET", "/nowhere")[0] == 404
+    assert call(server, "POST", "/nowhere", {})[0] == 404
+
+
+def test_repeated_requests_are_served_from_the_cache(server):
+    call(server, "POST", "/preview", {"exchange": "family"})
+    call(server, "POST", "/preview", {"exchange": "family"})
+
+    _, health = call(server, "GET", "/health")
+    assert health["cache"]["misses"] == 1
+    assert health["cache"]["hits"] == 1
+
+
+def test_the_cache_reloads_when_the_roster_changes(root):
+    directory = Path(root, "family")
+    cache = ExchangeCache()
+    before = exchange_signature(directory)
+    first = cache.get(directory, 3, ("regular", "gag"))
+
+    assert cache.get(directory, 3, ("regular", "gag")) is first
+    write_roster(directory, NAMES + ["Fay"])
+
+    assert exchange_signature(directory) != before
+    reloaded = cache.get(directory, 3, ("regular", "gag"))
+    assert reloaded is not first
+    assert "Fay" in reloaded.participants
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_the_cache_reloads_when_the_history_changes(root):
+    directory = Path(root, "family")
+    store = HistoryStore.open(Path(directory, HISTORY_DB_FILE))
+    cache = ExchangeCache()
+    first = cache.get(directory, 1, ("regular",))
+    assert first.prior_year_results == {}
+
+    store.save_year(YEAR - 1, {"regular": {"Ann": "Bob"}})
+    store.close()
+
+    reloaded = cache.get(directory, 1, ("regular",))
+    assert reloaded is not first
+    assert reloaded.prior_year_results == {str(YEAR - 1): {"regular": {"Ann": "Bob"}}}
+    # Only the settings that shape the compiled exclusions key the cache
+    assert cache.get(directory, 2, ("regular",)) is not reloaded
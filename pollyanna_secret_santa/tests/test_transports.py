@@ -0,0 +1,224 @@
+"""Tests of the SMTP transport against a local stand-in server, and of the outbox round trip"""
+
+import base64
+import mailbox
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+
+import pytest
+
+from src.delivery import FAILED, SENT, build_messages
+from src.transports import MAILDIR, MBOX, OutboxTransport, SmtpTransport
+
+PARTICIPANTS = {f"Person {index}": f"person{index}@example.com" for index in range(8)}
+NAMES = list(PARTICIPANTS)
+RESULTS = {
+    "regular": {giver: NAMES[(index + 1) % len(NAMES)] for index, giver in enumerate(NAMES)},
+    "gag": {giver: NAMES[(index + 2) % len(NAMES)] for index, giver in enumerate(NAMES)},
+}
+
+
+class StubSmtpServer(socketserver.ThreadingTCPServer):
+    """
+    Speaks just enough SMTP for ``smtplib`` and records every connection, login and message.
+
+    ``drop_after`` closes a connection after it carried that many messages, ``refuse`` answers
+    those recipients with a 550, and ``offer_starttls`` advertises STARTTLS but then refuses it.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, drop_after=None, refuse=(), offer_starttls=False, delay=0.0):
+        super().__init__(("127.0.0.1", 0), StubSmtpHandler)
+        self.drop_after = drop_after
+        self.refuse = set(refuse)
+        self.offer_starttls = offer_starttls
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.quits = 0
+        self.commands = []
+        self.logins = []
+        self.messages = []
+
+
+class StubSmtpHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str) -> None:
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            connection = server.connections
+        sent_here = 0
+        sender, recipients = None, []
+        self.reply("220 stub ESMTP")
+        for raw_line in self.rfile:
+            line = raw_line.decode().rstrip("\r\n")
+            verb, _, argument = line.partition(" ")
+            verb = verb.upper()
+            with server.lock:
+                server.commands.append(verb)
+            if verb == "EHLO":
+                self.wfile.write(b"250-stub\r\n250-AUTH PLAIN\r\n")
+                if server.offer_starttls:
+                    self.wfile.write(b"250-STARTTLS\r\n")
+                self.reply("250 SIZE 10000000")
+            elif verb == "STARTTLS":
+                self.reply("454 TLS not available")
+            elif verb == "AUTH":
+                _, user, password = base64.b64decode(argument.split(" ", 1)[1]).decode().split("\0")
+                with server.lock:
+                    server.logins.append((connection, user + "\0" + password))
+                self.reply("235 Authentication successful")
+            elif verb == "MAIL":
+                sender, recipients = argument.split(":", 1)[1].split()[0].strip("<>"), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipient = argument.split(":", 1)[1].split()[0].strip("<>")
+                if recipient in server.refuse:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(recipient)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b"".join(iter(self.rfile.readline, b".\r\n"))
+                time.sleep(server.delay)
+                with server.lock:
+                    server.messages.append({"connection": connection, "from": sender, "to": recipients, "data": data})
+                self.reply("250 OK queued")
+                sent_here += 1
+                if server.drop_after is not None and sent_here == server.drop_after:
+                    return
+            elif verb == "QUIT":
+                with server.lock:
+                    server.quits += 1
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+@pytest.fixture
+def start_server():
+    servers = []
+
+    def start(**options) -> StubSmtpServer:
+        server = StubSmtpServer(**options)
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def smtp_transport(server, **options) -> SmtpTransport:
+    options = {"username": "santa@example.com", "password": "secret", "timeout": 5.0, **options}
+    return SmtpTransport("127.0.0.1", server.server_address[1], **options)
+
+
+def test_one_connection_carries_every_message(start_server):
+    server = start_server()
+
+    with smtp_transport(server) as transport:
+        outcomes = transport.send(build_messages(PARTICIPANTS, RESULTS))
+
+    assert {name: result.status for name, result in outcomes.items()} == {name: SENT for name in NAMES}
+    assert server.connections == 1
+    assert server.logins == [(1, "santa@example.com\0secret")]
+    assert sorted(message["to"][0] for message in server.messages) == sorted(PARTICIPANTS.values())
+    assert all(message["from"] == "santa@example.com" for message in server.messages)
+    first = message_from_bytes(server.messages[0]["data"])
+    assert first["From"] == "santa@example.com"
+    assert first["To"] == server.messages[0]["to"][0]
+    # Closing the transport logs out of the connection it kept open
+    assert server.quits == 1
+
+
+def test_a_pool_sends_over_one_connection_per_worker(start_server):
+    server = start_server(delay=0.05)
+
+    with smtp_transport(server, pool_size=3) as transport:
+        outcomes = transport.send(build_messages(PARTICIPANTS, RESULTS))
+
+    assert all(result.status == SENT for result in outcomes.values())
+    assert len(server.messages) == len(PARTICIPANTS)
+    # Every worker reused its connection rather than opening one per message
+    assert 1 < server.connections <= 3
+    assert len(server.logins) == server.connections
+    assert server.quits == server.connections
+
+
+def test_a_dropped_connection_is_reopened_without_resending(start_server):
+    server = start_server(drop_after=3)
+
+    with smtp_transport(server) as transport:
+        outcomes = transport.send(build_messages(PARTICIPANTS, RESULTS))
+
+    assert all(result.status == SENT for result in outcomes.values())
+    assert sorted(message["to"][0] for message in server.messages) == sorted(PARTICIPANTS.values())
+    assert [message["connection"] for message in server.messages] == [1, 1, 1, 2, 2, 2, 3, 3]
+
+
+def test_a_refused_recipient_fails_alone(start_server):
+    server = start_server(refuse={"person2@example.com"})
+
+    with smtp_transport(server) as transport:
+        outcomes = transport.send(build_messages(PARTICIPANTS, RESULTS))
+
+    assert outcomes["Person 2"].status == FAILED
+    assert all(outcomes[name].status == SENT for name in NAMES if name != "Person 2")
+    assert server.connections == 1
+
+
+def test_starttls_is_required_when_offered_before_logging_in(start_server):
+    server = start_server(offer_starttls=True)
+
+    with smtp_transport(server) as transport:
+        outcomes = transport.send(build_messages(PARTICIPANTS, RESULTS, names=NAMES[:2]))
+
+    assert all(result.status == FAILED for result in outcomes.values())
+    assert "STARTTLS" in server.commands
+    # The password never went over the connection that could not be encrypted
+    assert "AUTH" not in server.commands
+    assert server.messages == []
+
+
+def received_draws(data: bytes) -> str:
+    text = next(part for part in message_from_bytes(data).walk() if part.get_content_type() == "text/plain")
+    return text.get_payload(decode=True).decode()
+
+
+@pytest.mark.parametrize("mailbox_format", [MAILDIR, MBOX])
+def test_the_outbox_keeps_every_message_intact(tmp_path, mailbox_format):
+    path = tmp_path / ("outbox" if mailbox_format == MAILDIR else "outbox.mbox")
+
+    with OutboxTransport(path, mailbox_format=mailbox_format) as transport:
+        outcomes = transport.send(build_messages(PARTICIPANTS, RESULTS))
+    with OutboxTransport(path, mailbox_format=mailbox_format) as transport:
+        transport.send(build_messages(PARTICIPANTS, RESULTS, names=NAMES[:1]))
+
+    box = mailbox.Maildir(path, create=False) if mailbox_format == MAILDIR else mailbox.mbox(path, create=False)
+    try:
+        assert len(box) == len(PARTICIPANTS) + 1
+        for name, result in outcomes.items():
+            assert result.status == SENT
+            stored = box.get_bytes(result.message_id)
+            assert message_from_bytes(stored)["To"] == PARTICIPANTS[name]
+            text = received_draws(stored)
+            assert RESULTS["regular"][name] in text and RESULTS["gag"][name] in text
+    finally:
+        box.close()
+
+
+def test_an_unknown_outbox_format_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        OutboxTransport(tmp_path / "outbox", mailbox_format="pst")
@@ -0,0 +1,178 @@
+"""Tests of the draw validator and the uniformity check"""
+
+import itertools
+import random
+
+import pytest
+
+from src.constants import GAG, REGULAR
+from src.helpers import SantasMemory, YearAllocator
+from src.roster import MAX_REPORTED_PROBLEMS
+from src.rules import ExclusionRules
+from src.validation import InvalidDrawError, check_uniformity, validate_draw
+
+LAST_YEAR = str(YearAllocator.YEAR - 1)
+NAMES = ["Ann", "Bob", "Cat", "Dan", "Eve"]
+PARTICIPANTS = {name: f"{name.lower()}@example.com" for name in NAMES}
+HISTORY = {LAST_YEAR: {REGULAR: {"Ann": "Bob", "Bob": "Cat", "Cat": "Dan", "Dan": "Eve", "Eve": "Ann"}, GAG: {}}}
+VALID = {
+    REGULAR: {"Ann": "Cat", "Bob": "Dan", "Cat": "Eve", "Dan": "Ann", "Eve": "Bob"},
+    GAG: {"Ann": "Dan", "Bob": "Eve", "Cat": "Ann", "Dan": "Bob", "Eve": "Cat"},
+}
+
+
+def problems_of(results, santas_memory=None, **options):
+    with pytest.raises(InvalidDrawError) as raised:
+        validate_draw(PARTICIPANTS, results, santas_memory, **options)
+    return raised.value.problems
+
+
+def with_round(round_name, **changes):
+    return {**VALID, round_name: {**VALID[round_name], **changes}}
+
+
+def test_a_valid_draw_passes():
+    validate_draw(PARTICIPANTS, VALID, SantasMemory(HISTORY, 1))
+    validate_draw(PARTICIPANTS, VALID)
+
+
+def test_self_draws_and_repeated_receivers_are_reported():
+    problems = problems_of(with_round(REGULAR, Ann="Ann"))
+
+    assert "[regular] Ann drew themselves" in problems
+    assert "[regular] 1 participant(s) will not receive a gift" in problems
+
+    assert "[gag] Bob is drawn by more than one giver" in problems_of(with_round(GAG, Ann="Bob"))
+
+
+def test_missing_and_unknown_participants_are_reported():
+    regular = dict(VALID[REGULAR])
+    del regular["Eve"]
+    assert "[regular] Eve did not draw anyone" in problems_of({**VALID, REGULAR: regular})
+
+    problems = problems_of(with_round(REGULAR, Ann="Zed"))
+    assert "[regular] Ann drew Zed, who is not participating" in problems
+
+
+def test_history_is_enforced_unless_allowed():
+    results = {
+        REGULAR: {"Ann": "Bob", "Bob": "Cat", "Cat": "Eve", "Dan": "Ann", "Eve": "Dan"},
+        GAG: {"Ann": "Dan", "Bob": "Eve", "Cat": "Ann", "Dan": "Bob", "Eve": "Cat"},
+    }
+    memory = SantasMemory(HISTORY, 1)
+
+    assert problems_of(results, memory) == [
+        f"[regular] Ann drew Bob, which is excluded (drawn in {LAST_YEAR})",
+        f"[regular] Bob drew Cat, which is excluded (drawn in {LAST_YEAR})",
+    ]
+    validate_draw(PARTICIPANTS, results, memory, allow_history=True)
+
+
+def test_house_rules_are_enforced_even_when_history_is_allowed():
+    rules = ExclusionRules(groups={"kids": ["Cat", "Dan"]}, only_within={"Ann": "kids"})
+    results = {**VALID, GAG: {"Ann": "Eve", "Bob": "Ann", "Cat": "Bob", "Dan": "Cat", "Eve": "Dan"}}
+
+    problems = problems_of(results, SantasMemory({}, 1, rules=rules), allow_history=True)
+
+    assert problems == ["[gag] Ann drew Eve, which is excluded (house rule)"]
+
+
+def test_the_same_receiver_in_two_rounds_is_reported():
+    results = with_round(GAG, Ann="Cat", Cat="Dan", Dan="Bob", Bob="Eve", Eve="Ann")
+
+    assert "Ann drew Cat in both regular and gag" in problems_of(results)
+
+
+def test_rounds_that_are_not_drawn_are_reported():
+    problems = problems_of({**VALID, "white_elephant": VALID[GAG]}, SantasMemory({}, 1))
+
+    assert problems[0] == "[white_elephant] is not one of the rounds being drawn: regular, gag"
+
+
+def test_long_problem_lists_are_cut_short():
+    names = [f"P{index}" for index in range(MAX_REPORTED_PROBLEMS + 10)]
+    participants = {name: name for name in names}
+
+    with pytest.raises(InvalidDrawError) as raised:
+        validate_draw(participants, {REGULAR: {name: name for name in names}})
+
+    assert len(raised.value.problems) == MAX_REPORTED_PROBLEMS
+    assert raised.value.problem_count == len(names) + 1
+    assert "more" in str(raised.value)
+
+
+def derangements(names):
+    return [
+        dict(zip(names, permutation)) for permutation in itertools.permutations(names)
+        if all(giver != receiver for giver, receiver in zip(names, permutation))
+    ]
+
+
+def test_whole_draws_are_compared_with_every_valid_draw():
+    names = NAMES[:4]
+    participants = {name: name for name in names}
+    memory = SantasMemory({}, 1, rounds=[REGULAR])
+    valid = derangements(names)
+
+    report = check_uniformity(participants, memory, lambda rng: {REGULAR: rng.choice(valid)}, draws=4000,
+                              rng=random.Random(0))
+
+    assert report.whole_draws.valid_draws == 9
+    assert report.whole_draws.unseen == 0
+    assert report.biased() is False
+
+
+def test_a_bias_between_whole_draws_is_found_even_when_every_pair_is_even():
+    names = NAMES[:4]
+    participants = {name: name for name in names}
+    memory = SantasMemory({}, 1, rounds=[REGULAR])
+    # Favouring the double transpositions keeps every giver's receivers evenly spread
+    swaps = [draw for draw in derangements(names) if all(draw[draw[giver]] == giver for giver in names)]
+    valid = derangements(names) + swaps
+
+    report = check_uniformity(participants, memory, lambda rng: {REGULAR: rng.choice(valid)}, draws=4000,
+                              rng=random.Random(0))
+
+    assert all(result.p_value > 0.01 for result in report.rounds.values())
+    assert report.whole_draws.p_value < 0.01
+    assert report.biased() is True
+    assert "looks biased" in report.describe().splitlines()[0]
+
+
+def test_whole_draws_respect_history_and_every_round():
+    past = HISTORY[LAST_YEAR][REGULAR]
+    valid = [
+        {REGULAR: regular, GAG: gag}
+        for regular, gag in itertools.product(derangements(NAMES), repeat=2)
+        if all(regular[name] != gag[name] and regular[name] != past[name] for name in NAMES)
+    ]
+
+    report = check_uniformity(PARTICIPANTS, SantasMemory(HISTORY, 1), lambda rng: rng.choice(valid), draws=3000,
+                              rng=random.Random(1))
+
+    assert report.whole_draws.valid_draws == len(valid)
+    assert report.whole_draws.invalid == 0
+    assert report.biased() is False
+
+
+def test_large_groups_only_get_a_pair_verdict_without_exclusions():
+    names = [f"P{index}" for index in range(30)]
+    participants = {name: name for name in names}
+
+    def shifted(rng):
+        shift = rng.randrange(1, len(names))
+        return {REGULAR: {name: names[(index + shift) % len(names)] for index, name in enumerate(names)}}
+
+    def stuck(rng):
+        return {REGULAR: {name: names[(index + 1) % len(names)] for index, name in enumerate(names)}}
+
+    free = SantasMemory({}, 1, rounds=[REGULAR])
+    assert check_uniformity(participants, free, shifted, draws=300, rng=random.Random(0)).whole_draws is None
+    assert check_uniformity(participants, free, shifted, draws=300, rng=random.Random(0)).biased() is False
+    assert check_uniformity(participants, free, stuck, draws=300, rng=random.Random(0)).biased() is True
+
+    history = {LAST_YEAR: {REGULAR: {name: names[(index + 2) % len(names)] for index, name in enumerate(names)}}}
+    report = check_uniformity(participants, SantasMemory(history, 1, rounds=[REGULAR]), stuck, draws=300,
+                              rng=random.Random(0))
+    assert report.biased() is None
+    assert "no verdict" in report.describe()